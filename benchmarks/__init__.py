@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Order service
+
+Each module can be run with python -m benchmarks.<module> --help
+They use the database in the DATABASE_URI environment variable
+"""
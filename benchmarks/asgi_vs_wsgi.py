@@ -0,0 +1,145 @@
+"""
+Benchmark: the Flask service under gunicorn vs the ASGI service under uvicorn
+
+Starts both servers against the database in DATABASE_URI, seeds it with
+Orders and then keeps --concurrency requests in flight against each one
+for --duration seconds, reading random Orders and their Items. The order
+cache is turned off so every request goes to the database.
+
+Memory is the resident set of the server and all of its workers, sampled
+at the end of the run. Raise --sync-workers until the Flask service uses
+as much memory as the ASGI service to compare them at equal memory.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.asgi_vs_wsgi --sync-workers 2
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import httpx
+from service.models import db, Order, Item
+from tests.factories import OrderFactory, ItemFactory
+
+SERVER_ENV = {"ORDER_CACHE_SIZE": "0", "APP_ENV": "production", "SLOW_QUERY_MS": "-1"}
+
+
+def seed(count, item_count):
+    """Replaces every Order with count new ones that have item_count Items and returns their ids"""
+    db.session.query(Item).delete()
+    db.session.query(Order).delete()
+    db.session.commit()
+    orders = []
+    for order in OrderFactory.build_batch(count, id=None):
+        order.items = ItemFactory.build_batch(item_count, id=None)
+        orders.append(order)
+    return Order.create_all(orders)
+
+
+def start_server(command, port, env=None):
+    """Starts a server and waits until it answers its health check
+
+    Args:
+        env (dict): variables to set for the server, defaults to SERVER_ENV
+    """
+    env = dict(os.environ, **(SERVER_ENV if env is None else env))
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit(f"{command[0]} did not start on port {port}")
+
+
+def resident_memory(pid):
+    """Returns the resident memory in MiB of a process and all of its children"""
+    pids = [pid]
+    total = 0
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status", encoding="utf-8") as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children", encoding="utf-8") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except FileNotFoundError:
+            continue
+    return total / 1024
+
+
+async def load(base_url, ids, concurrency, duration):
+    """Keeps concurrency requests in flight for duration seconds and returns their latencies"""
+    latencies = []
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client):
+        while time.monotonic() < deadline:
+            order_id = random.choice(ids)
+            url = f"/orders/{order_id}" if random.random() < 0.5 else f"/orders/{order_id}/items"
+            start = time.perf_counter()
+            resp = await client.get(url)
+            latencies.append(time.perf_counter() - start)
+            assert resp.status_code == 200, resp.text
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies
+
+
+def measure(name, command, port, ids, args):
+    """Runs the load against one server and returns a line of results"""
+    process = start_server(command, port)
+    try:
+        # warm up the workers and their connection pools
+        asyncio.run(load(f"http://127.0.0.1:{port}", ids, args.concurrency, 1))
+        latencies = sorted(asyncio.run(load(f"http://127.0.0.1:{port}", ids, args.concurrency, args.duration)))
+        memory = resident_memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    rate = len(latencies) / args.duration
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return f"  {name:<28} {rate:10.1f} {p50:9.2f} {p99:9.2f} {memory:9.1f} {rate / memory * 100:12.1f}"
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1000, help="number of Orders to seed")
+    parser.add_argument("--items", type=int, default=3, help="number of Items per Order")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests kept in flight")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run the load for")
+    parser.add_argument("--sync-workers", type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument("--sync-threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--port", type=int, default=8900, help="first port to serve on")
+    args = parser.parse_args()
+
+    ids = seed(args.orders, args.items)
+    os.environ["GUNICORN_THREADS"] = str(args.sync_threads)
+    sync_name = f"gunicorn {args.sync_workers}x{args.sync_threads} threads"
+    sync_command = [
+        "gunicorn", "--workers", str(args.sync_workers), "--threads", str(args.sync_threads),
+        "--bind", f"127.0.0.1:{args.port}", "service:app",
+    ]
+    async_command = ["uvicorn", "service.asgi:app", "--port", str(args.port + 1), "--no-access-log"]
+
+    print(f"{args.concurrency} requests in flight for {args.duration:.0f}s against {args.orders} Orders")
+    print(f"  {'server':<28} {'req/sec':>10} {'p50 ms':>9} {'p99 ms':>9} {'RSS MiB':>9} {'req/s/100MiB':>12}")
+    print(measure(sync_name, sync_command, args.port, ids, args))
+    print(measure("uvicorn asyncio", async_command, args.port + 1, ids, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: creating Orders one at a time vs POST /orders/batch
+
+Both paths go through the Flask test client so only the service and the
+database are measured, not the network.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.batch_create --orders 2000
+"""
+import argparse
+import time
+from service import app
+from service.common import status
+from service.models import db, Order, Item
+from tests.factories import OrderFactory, ItemFactory
+
+
+def make_orders(count, item_count):
+    """Builds the json for count Orders with item_count Items each"""
+    orders = []
+    for order in OrderFactory.build_batch(count):
+        data = order.serialize()
+        data["items"] = [item.serialize() for item in ItemFactory.build_batch(item_count)]
+        orders.append(data)
+    return orders
+
+
+def clean_tables():
+    """Removes every Order and Item"""
+    db.session.query(Item).delete()
+    db.session.query(Order).delete()
+    db.session.commit()
+
+
+def create_one_at_a_time(client, orders):
+    """Creates each Order with its own POST /orders"""
+    for order in orders:
+        resp = client.post("/orders", json=order)
+        assert resp.status_code == status.HTTP_201_CREATED, resp.get_data(as_text=True)
+
+
+def create_in_batches(client, orders, batch_size):
+    """Creates the Orders batch_size at a time with POST /orders/batch"""
+    for start in range(0, len(orders), batch_size):
+        resp = client.post("/orders/batch", json=orders[start:start + batch_size])
+        assert resp.status_code == status.HTTP_201_CREATED, resp.get_data(as_text=True)
+
+
+def timed(function, *args):
+    """Returns how many seconds function took"""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1000, help="number of Orders to create")
+    parser.add_argument("--items", type=int, default=3, help="number of Items per Order")
+    parser.add_argument("--batch-size", type=int, default=500, help="Orders per batch request")
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders, args.items)
+    client = app.test_client()
+
+    clean_tables()
+    single = timed(create_one_at_a_time, client, orders)
+    clean_tables()
+    batch = timed(create_in_batches, client, orders, args.batch_size)
+    clean_tables()
+
+    print(f"{args.orders} Orders with {args.items} Items each")
+    print(f"  POST /orders        {single:8.3f}s  {args.orders / single:10.1f} orders/sec")
+    print(f"  POST /orders/batch  {batch:8.3f}s  {args.orders / batch:10.1f} orders/sec")
+    print(f"  speedup             {single / batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
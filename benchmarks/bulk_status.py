@@ -0,0 +1,59 @@
+"""
+Benchmark: shipping Orders one at a time vs POST /orders/status
+
+Both paths go through the Flask test client so only the service and the
+database are measured, not the network.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.bulk_status --orders 5000
+"""
+import argparse
+from service import app
+from service.common import status
+from service.models import Order
+from tests.factories import OrderFactory
+from benchmarks.batch_create import clean_tables, timed
+
+
+def seed(count):
+    """Replaces every Order with count Open ones and returns their ids"""
+    clean_tables()
+    orders = OrderFactory.build_batch(count, status="Open")
+    for order in orders:
+        order.items = []
+    return Order.create_all(orders)
+
+
+def ship_one_at_a_time(client, ids):
+    """Ships each Order with its own PUT /orders/<order_id>/ship"""
+    for order_id in ids:
+        resp = client.put(f"/orders/{order_id}/ship")
+        assert resp.status_code == status.HTTP_200_OK, resp.get_data(as_text=True)
+
+
+def ship_in_bulk(client, ids):
+    """Ships every Order with one POST /orders/status"""
+    resp = client.post("/orders/status", json={"status": "Shipped", "ids": ids})
+    assert resp.status_code == status.HTTP_200_OK, resp.get_data(as_text=True)
+    assert len(resp.get_json()["transitioned"]) == len(ids)
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000, help="number of Orders to ship")
+    args = parser.parse_args()
+    client = app.test_client()
+
+    single = timed(ship_one_at_a_time, client, seed(args.orders))
+    bulk = timed(ship_in_bulk, client, seed(args.orders))
+    clean_tables()
+
+    print(f"{args.orders} Orders shipped")
+    print(f"  PUT /orders/<id>/ship  {single:8.3f}s  {args.orders / single:10.1f} orders/sec")
+    print(f"  POST /orders/status    {bulk:8.3f}s  {args.orders / bulk:10.1f} orders/sec")
+    print(f"  speedup                {single / bulk:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
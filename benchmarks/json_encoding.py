@@ -0,0 +1,61 @@
+"""
+Benchmark: encoding a list of Orders with Flask's JSON provider vs orjson
+
+Builds --orders Orders with --items Items each in memory and times how
+long serialize() takes and how long each provider takes to turn the
+serialized list into a response, as GET /orders does. Nothing is read
+from the database.
+
+Usage:
+  python -m benchmarks.json_encoding --orders 10000
+"""
+import argparse
+import timeit
+from flask.json.provider import DefaultJSONProvider
+from service import app
+from service.common.json_provider import OrjsonProvider
+from tests.factories import OrderFactory, ItemFactory
+
+
+def make_orders(count, item_count):
+    """Builds count Orders with item_count Items each without saving them"""
+    orders = OrderFactory.build_batch(count)
+    for order in orders:
+        order.items = ItemFactory.build_batch(item_count, order_id=order.id)
+    return orders
+
+
+def best_of(function, repeat):
+    """Returns the fastest of repeat runs of function in seconds"""
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=10000, help="number of Orders to encode")
+    parser.add_argument("--items", type=int, default=3, help="number of Items per Order")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the best of")
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders, args.items)
+    serialized = [order.serialize() for order in orders]
+    providers = {"flask (json)": DefaultJSONProvider(app), "orjson": OrjsonProvider(app)}
+
+    print(f"{args.orders} Orders with {args.items} Items each, best of {args.repeat}")
+    elapsed = best_of(lambda: [order.serialize() for order in orders], args.repeat)
+    print(f"  {'serialize()':<14} {elapsed * 1000:9.1f} ms")
+    with app.app_context():
+        baseline = None
+        for name, provider in providers.items():
+            size = len(provider.response(serialized).get_data())
+            elapsed = best_of(lambda provider=provider: provider.response(serialized).get_data(), args.repeat)
+            baseline = baseline or elapsed
+            print(
+                f"  {name:<14} {elapsed * 1000:9.1f} ms  {size / elapsed / 2**20:8.1f} MiB/s"
+                f"  {baseline / elapsed:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
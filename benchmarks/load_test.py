@@ -0,0 +1,342 @@
+"""
+Load test: a mix of Order and Item traffic against a running service
+
+Seeds the database in DATABASE_URI with --orders Orders of --items Items
+each, starts the service under gunicorn (or uvicorn, or uses the one at
+--url) and keeps --concurrency requests in flight for --duration seconds.
+Each request is drawn from --mix, a weighted list of operations, and the
+Orders it touches are drawn from a Zipf distribution over the seeded ids
+(--skew), so a few hot Orders get most of the traffic like real ones do.
+
+The results are the throughput and the p50, p95 and p99 latency of every
+operation and of all of them together, printed as a table and written as
+JSON to --output. With --baseline the run fails (exit status 1) if any
+operation is slower or handles fewer requests per second than in the
+baseline by more than --tolerance, or fails a larger share of its
+requests than in the baseline, so a release can be gated on it.
+
+Every operation is served by both the Flask service and the ASGI service,
+so the same mix runs under gunicorn and uvicorn.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.load_test --orders 10000 --output load.json
+  DATABASE_URI=postgresql://... python -m benchmarks.load_test --baseline load.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import httpx
+from service import config
+from service.models import db, Order
+from tests.factories import OrderFactory, ItemFactory
+from benchmarks.asgi_vs_wsgi import start_server
+from benchmarks.order_stats import seed
+
+# the share of requests each operation gets unless --mix says otherwise
+DEFAULT_MIX = {
+    "get_order": 40,
+    "list_orders": 15,
+    "list_items": 10,
+    "create_order": 10,
+    "update_order": 10,
+    "add_item": 10,
+    "cancel_order": 5,
+}
+# a request is only an error if it ends with another status, a 409 or 412
+# is how the service answers a client that lost a race for an Order
+EXPECTED_STATUSES = {
+    "get_order": (200,),
+    "list_orders": (200,),
+    "list_items": (200,),
+    "create_order": (201,),
+    "update_order": (200, 412),
+    "add_item": (201,),
+    "cancel_order": (200, 409),
+}
+# the statistics compared with a baseline and whether higher is better
+COMPARED = {"throughput": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+PAYLOADS = 500
+
+
+######################################################################
+#  W O R K L O A D
+######################################################################
+class ZipfIds:
+    """Draws ids so the id of rank k comes up in proportion to 1 / k ** skew
+
+    The ranks are shuffled over the ids so the hot Orders are not simply
+    the oldest ones
+    """
+
+    def __init__(self, ids, skew, seed_value=None):
+        self.ids = list(ids)
+        random.Random(seed_value).shuffle(self.ids)
+        weights = [1 / rank**skew for rank in range(1, len(self.ids) + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def draw(self):
+        """Returns one id"""
+        return random.choices(self.ids, cum_weights=self.cum_weights)[0]
+
+
+def parse_mix(text):
+    """Returns the weights of a mix like get_order=50,create_order=10"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in EXPECTED_STATUSES or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"{part} is not one of {', '.join(EXPECTED_STATUSES)} with a weight")
+        mix[name] = int(weight)
+    return mix
+
+
+def make_payloads(count):
+    """Builds the bodies of new Orders and Items ahead of the run, so the client spends its time sending them"""
+    orders = []
+    for order in OrderFactory.build_batch(count):
+        data = order.serialize()
+        data["items"] = [item.serialize() for item in ItemFactory.build_batch(2)]
+        orders.append(data)
+    items = [item.serialize() for item in ItemFactory.build_batch(count)]
+    return orders, items
+
+
+class Workload:
+    """The requests of each operation"""
+
+    def __init__(self, client, ids, payloads):
+        self.client = client
+        self.ids = ids
+        self.orders, self.items = payloads
+
+    async def get_order(self):
+        """Reads an Order"""
+        return await self.client.get(f"/orders/{self.ids.draw()}")
+
+    async def list_orders(self):
+        """Reads the first page of Open Orders"""
+        return await self.client.get("/orders", params={"status": "Open", "limit": 20})
+
+    async def list_items(self):
+        """Reads the Items of an Order"""
+        return await self.client.get(f"/orders/{self.ids.draw()}/items")
+
+    async def create_order(self):
+        """Creates an Order with two Items"""
+        return await self.client.post("/orders", json=random.choice(self.orders))
+
+    async def update_order(self):
+        """Reads an Order and writes it back renamed if nobody changed it in between"""
+        order_id = self.ids.draw()
+        resp = await self.client.get(f"/orders/{order_id}")
+        if resp.status_code != 200:
+            return resp
+        order = resp.json()
+        del order["items"]
+        order["name"] = random.choice(self.orders)["name"]
+        return await self.client.put(f"/orders/{order_id}", json=order, headers={"If-Match": resp.headers["ETag"]})
+
+    async def add_item(self):
+        """Adds an Item to an Order"""
+        order_id = self.ids.draw()
+        return await self.client.post(f"/orders/{order_id}/items", json=dict(random.choice(self.items), order_id=order_id))
+
+    async def cancel_order(self):
+        """Cancels an Order, which fails with 409 once it is not Open"""
+        return await self.client.put(f"/orders/{self.ids.draw()}/cancel")
+
+
+async def run(base_url, workload_args, mix, concurrency, duration):
+    """Keeps concurrency requests in flight for duration seconds
+
+    Returns the latencies of each operation and the number of requests of
+    each that got an unexpected status
+    """
+    latencies = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(workload):
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                resp = await getattr(workload, name)()
+                ok = resp.status_code in EXPECTED_STATUSES[name]
+            except httpx.HTTPError:
+                ok = False
+            latencies[name].append(time.perf_counter() - start)
+            if not ok:
+                errors[name] += 1
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        workload = Workload(client, *workload_args)
+        await asyncio.gather(*(worker(workload) for _ in range(concurrency)))
+    return latencies, errors
+
+
+######################################################################
+#  R E S U L T S
+######################################################################
+def percentile(ordered, share):
+    """Returns the value below which share of the sorted values fall"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def summarize(latencies, errors, duration):
+    """Returns the statistics of one operation"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": round(len(ordered) / duration, 1),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+    }
+
+
+def report(latencies, errors, duration, settings):
+    """Returns the results of a run, by operation and in total"""
+    operations = {name: summarize(latencies[name], errors[name], duration) for name in latencies}
+    everything = list(itertools.chain.from_iterable(latencies.values()))
+    return {
+        "settings": settings,
+        "total": summarize(everything, sum(errors.values()), duration),
+        "operations": operations,
+    }
+
+
+def error_rate(stats):
+    """Returns the share of the requests of an operation that got an unexpected status"""
+    return stats["errors"] / stats["requests"] if stats["requests"] else 0.0
+
+
+def regressions(results, baseline, tolerance):
+    """
+    Returns a line for every statistic that got worse than the baseline by
+    more than tolerance, and for every operation that fails more often
+    """
+    lines = []
+    compared = dict(baseline["operations"], total=baseline["total"])
+    current = dict(results["operations"], total=results["total"])
+    for name, before in compared.items():
+        after = current.get(name)
+        if after is None:
+            continue
+        # errors are not timing noise, any rise in their rate is a regression
+        if error_rate(after) > error_rate(before):
+            lines.append(f"{name} errors: {error_rate(before):.2%} -> {error_rate(after):.2%} of requests")
+        for statistic, higher_is_better in COMPARED.items():
+            if not before[statistic]:
+                continue
+            change = (after[statistic] - before[statistic]) / before[statistic]
+            if (-change if higher_is_better else change) > tolerance:
+                lines.append(f"{name} {statistic}: {before[statistic]} -> {after[statistic]} ({change:+.1%})")
+    return lines
+
+
+def print_table(results):
+    """Prints the results as a table"""
+    header = f"  {'operation':<14} {'requests':>9} {'errors':>7} {'req/sec':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    for name, stats in itertools.chain(results["operations"].items(), [("total", results["total"])]):
+        print(
+            f"  {name:<14} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>9.1f} "
+            f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}"
+        )
+
+
+######################################################################
+#  M A I N
+######################################################################
+def server_command(args):
+    """Returns the command that starts the service, or None to use --url"""
+    if args.server == "gunicorn":
+        return [
+            "gunicorn", "--workers", str(args.workers), "--threads", str(args.threads),
+            "--bind", f"127.0.0.1:{args.port}", "service:app",
+        ]
+    if args.server == "uvicorn":
+        return ["uvicorn", "service.asgi:app", "--port", str(args.port), "--no-access-log"]
+    return None
+
+
+def parse_args():
+    """Returns the command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=10000, help="number of Orders to seed")
+    parser.add_argument("--items", type=int, default=3, help="number of Items per seeded Order")
+    parser.add_argument("--no-seed", action="store_true", help="use the Orders already in the database")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="operation weights, like get_order=50,add_item=5")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the Orders picked, 0 for uniform")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests kept in flight")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds to run before measuring")
+    parser.add_argument("--server", choices=("gunicorn", "uvicorn", "none"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--port", type=int, default=8900, help="port to start the service on")
+    parser.add_argument("--url", help="base URL of a service that is already running, with --server none")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="share a statistic may get worse by")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the random choices")
+    return parser.parse_args()
+
+
+def main():
+    """Runs the load test and prints the results"""
+    args = parse_args()
+    random.seed(args.seed)
+    if not args.no_seed:
+        seed(args.orders, args.items)
+    ids = ZipfIds(db.session.scalars(db.select(Order.id)).all(), args.skew, args.seed)
+    workload_args = (ids, make_payloads(PAYLOADS))
+    db.session.remove()
+
+    command = server_command(args)
+    process = None
+    if command:
+        env = {"GUNICORN_THREADS": str(args.threads), "WEB_CONCURRENCY": str(args.workers), "APP_ENV": "production"}
+        process = start_server(command, args.port, env)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(run(base_url, workload_args, args.mix, args.concurrency, args.warmup))
+        latencies, errors = asyncio.run(run(base_url, workload_args, args.mix, args.concurrency, args.duration))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    settings = {
+        name: getattr(args, name)
+        for name in ("orders", "items", "mix", "skew", "concurrency", "duration", "server", "workers", "threads")
+    }
+    settings["database"] = config.DATABASE_URI.split(":", 1)[0]
+    results = report(latencies, errors, args.duration, settings)
+    print(f"{args.concurrency} requests in flight for {args.duration:.0f}s against {len(ids.ids)} Orders")
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            lines = regressions(results, json.load(baseline), args.tolerance)
+        for line in lines:
+            print(f"REGRESSION {line}")
+        if lines:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Microbenchmarks: the model and request helpers every request goes through
+
+Times Order.serialize and Order.deserialize for Orders with 0 to 1000
+Items, Item.serialize and Item.deserialize, jsonify of lists of 0 to 1000
+serialized Orders and check_content_type. The Orders and Items are ORM
+objects that are never added to a session, so the timed code sends no
+queries, but it runs inside the app context that importing the service
+pushes: that import connects to DATABASE_URI and creates the tables, and
+the ORM attribute events of the models are part of what is measured. The
+cases take turns to run for about 0.2 seconds, --repeat times over, and
+each reports its fastest time per call, which is the least disturbed by
+the rest of the machine.
+
+The results are written as JSON with --output. With --baseline every case
+is compared with the same case of an earlier run, and the run fails (exit
+status 1) if any of them got slower by more than --tolerance, so a change
+can be checked against the main branch before it is merged. The times are
+scaled by the calibrate case, plain Python work that none of the code
+under test changes, since a shared machine can run everything a third
+slower from one minute to the next.
+
+Usage:
+  python -m benchmarks.microbench --output main.json                     # on main
+  python -m benchmarks.microbench --baseline main.json                   # on the branch
+  python -m benchmarks.microbench --sizes 0,10,100 --only order_serialize
+"""
+import sys
+import json
+import timeit
+import argparse
+import platform
+from flask import jsonify
+from service import app
+from service.models import Order, Item
+from service.routes import check_content_type
+from tests.factories import OrderFactory, ItemFactory
+
+DEFAULT_SIZES = (0, 1, 10, 100, 1000)
+# Items per Order in the lists given to jsonify
+LIST_ITEMS = 3
+CALIBRATE = "calibrate"
+
+
+def calibrate():
+    """Does a fixed amount of plain Python work to measure the speed of the machine"""
+    return sorted({str(number): number for number in range(200)}.items())
+
+
+def make_order(item_count):
+    """Builds an Order with item_count Items without saving it"""
+    order = OrderFactory.build(item_count=item_count, items_total=0)
+    order.items = ItemFactory.build_batch(item_count, order_id=order.id)
+    return order
+
+
+def make_cases(sizes):
+    """Returns the name and the function to time of every case"""
+    cases = {CALIBRATE: calibrate}
+    item = ItemFactory.build(order_id=1)
+    item_data = item.serialize()
+    cases["item_serialize"] = item.serialize
+    cases["item_deserialize"] = lambda: Item().deserialize(item_data)
+    for size in sizes:
+        order = make_order(size)
+        order_data = order.serialize()
+        orders = [make_order(LIST_ITEMS).serialize() for _ in range(size)]
+        cases[f"order_serialize[{size}]"] = order.serialize
+        cases[f"order_deserialize[{size}]"] = lambda data=order_data: Order().deserialize(data)
+        cases[f"jsonify[{size}]"] = lambda orders=orders: jsonify(orders).get_data()
+    cases["check_content_type"] = lambda: check_content_type("application/json")
+    return cases
+
+
+def run(cases, repeat):
+    """Times every case inside a request and returns the fastest time per call in microseconds
+
+    Each case runs for about 0.2 seconds in turn, repeat times over, so
+    that the machine getting slower for a while affects every case alike
+    """
+    timers = {name: timeit.Timer(function) for name, function in cases.items()}
+    results = {}
+    with app.test_request_context(method="POST", headers={"Content-Type": "application/json"}):
+        # the first calls also warm up the caches and allocator the later ones use
+        numbers = {name: timer.autorange()[0] for name, timer in timers.items()}
+        for _ in range(repeat):
+            for name, timer in timers.items():
+                elapsed = timer.timeit(numbers[name]) / numbers[name] * 1e6
+                results[name] = min(results.get(name, elapsed), elapsed)
+    results = {name: round(elapsed, 3) for name, elapsed in results.items()}
+    for name, elapsed in results.items():
+        print(f"  {name:<26} {elapsed:12.3f} us")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints every case next to its baseline and returns the ones slower by more than tolerance
+
+    The times of the run are scaled by how much faster or slower the
+    machine ran the calibrate case than it did for the baseline
+    """
+    slower = []
+    speed = 1.0
+    if results.get(CALIBRATE) and baseline.get(CALIBRATE):
+        speed = baseline[CALIBRATE] / results[CALIBRATE]
+        print(f"  machine speed {speed:.2f}x the baseline, times scaled to match")
+    print(f"  {'case':<26} {'baseline us':>12} {'us':>12} {'change':>8}")
+    for name, after in results.items():
+        before = baseline.get(name)
+        after = round(after * speed, 3)
+        if not before or name == CALIBRATE:
+            print(f"  {name:<26} {'-':>12} {after:12.3f}")
+            continue
+        change = (after - before) / before
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"  {name:<26} {before:12.3f} {after:12.3f} {change:+8.1%}{flag}")
+        if flag:
+            slower.append(name)
+    return slower
+
+
+def main():
+    """Runs the microbenchmarks and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sizes", type=lambda value: [int(size) for size in value.split(",")], default=DEFAULT_SIZES,
+        help="Items per Order and Orders per jsonify list, like 0,10,100",
+    )
+    parser.add_argument("--only", help="run only the cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the fastest of")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="share a case may get slower by")
+    args = parser.parse_args()
+
+    cases = make_cases(args.sizes)
+    if args.only:
+        cases = {name: function for name, function in cases.items() if name == CALIBRATE or args.only in name}
+    print(f"Fastest of {args.repeat} runs per call, Python {platform.python_version()}")
+    results = run(cases, args.repeat)
+    if args.output:
+        settings = {"python": platform.python_version(), "machine": platform.machine(), "repeat": args.repeat}
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({"settings": settings, "cases": results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            slower = compare(results, json.load(baseline)["cases"], args.tolerance)
+        if slower:
+            sys.exit(f"{len(slower)} cases got slower by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
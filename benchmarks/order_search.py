@@ -0,0 +1,80 @@
+"""
+Benchmark: GET /orders?q= over a large table
+
+Fills the database in DATABASE_URI with --orders Orders named and
+addressed from a few dozen first names, last names, streets and cities,
+then times the first page of a search for a rare term that matches a
+handful of Orders and for a common one that matches thousands.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.order_search --orders 1000000
+"""
+import random
+import argparse
+from sqlalchemy import insert
+from service import app
+from service.models import db, Order, Item, ORDER_STATUSES
+from benchmarks.order_stats import CHUNK, timed_get
+
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+)
+STREETS = ("Main Street", "Oak Avenue", "Pine Road", "Maple Lane", "Cedar Court", "Elm Drive", "Park Place")
+CITIES = ("Springfield", "Riverside", "Franklin", "Greenville", "Bristol", "Clinton", "Fairview", "Salem")
+
+
+def seed(count):
+    """Replaces every Order with count random ones without Items"""
+    db.session.query(Item).delete()
+    db.session.query(Order).delete()
+    db.session.commit()
+    for start in range(0, count, CHUNK):
+        db.session.execute(
+            insert(Order),
+            [
+                {
+                    "id": order_id,
+                    "name": f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}",
+                    "street": f"{random.randrange(1, 100000)} {random.choice(STREETS)}",
+                    "city": random.choice(CITIES),
+                    "state": "NY",
+                    "postal_code": f"{random.randrange(100000):05}",
+                    "shipping_price": 5.0,
+                    "status": random.choice(ORDER_STATUSES),
+                    "version": 1,
+                }
+                for order_id in range(start + 1, min(start + CHUNK, count) + 1)
+            ],
+        )
+        db.session.commit()
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1000000, help="number of Orders to seed")
+    parser.add_argument("--limit", type=int, default=20, help="page size")
+    parser.add_argument("--repeat", type=int, default=5, help="requests to take the best of")
+    parser.add_argument("--no-seed", action="store_true", help="use the Orders already in the database")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.orders)
+    client = app.test_client()
+    rare = db.session.query(Order.postal_code).filter(Order.id == args.orders // 2).scalar()
+    matches = {term: Order.search(term)[0].count() for term in (rare, "Jackson", "Jackson Salem")}
+
+    print(f"{db.session.query(Order).count()} Orders, first page of {args.limit}, best of {args.repeat}")
+    for term, count in matches.items():
+        url = f"/orders?q={term}&limit={args.limit}&fields=id,name,street,city"
+        print(f"  q={term:<16} {count:8} matches {timed_get(client, url, args.repeat):9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: GET /orders/stats over a large table
+
+Fills the database in DATABASE_URI with --orders Orders, --items Items
+each, spread over the statuses, a dozen states and two years of dates,
+then times GET /orders/stats over every Order and over the last month.
+The rows are written with multi-row INSERTs straight to the tables so a
+million Orders take seconds rather than minutes to load.
+
+Usage:
+  DATABASE_URI=postgresql://... python -m benchmarks.order_stats --orders 1000000
+"""
+import random
+import argparse
+import timeit
+from datetime import date, timedelta
+from sqlalchemy import insert, text
+from service import app
+from service.common import status
+from service.models import db, Order, Item, ORDER_STATUSES
+
+STATES = ("NY", "NJ", "CT", "CA", "TX", "FL", "WA", "OR", "IL", "MA", "PA", "OH")
+FIRST_DAY = date(2021, 1, 1)
+DAYS = 730
+CHUNK = 10000
+
+
+def seed(count, item_count):
+    """Replaces every Order with count random ones that have item_count Items each"""
+    db.session.query(Item).delete()
+    db.session.query(Order).delete()
+    db.session.commit()
+    next_id = 1
+    for start in range(0, count, CHUNK):
+        ids = range(next_id, next_id + min(CHUNK, count - start))
+        next_id = ids.stop
+        # the rows skip the unit of work, so the totals are written here
+        prices = {order_id: [round(random.uniform(1, 500), 2) for _ in range(item_count)] for order_id in ids}
+        # the Items carry the date of their Order like the session events set it
+        dates = {order_id: FIRST_DAY + timedelta(days=random.randrange(DAYS)) for order_id in ids}
+        db.session.execute(
+            insert(Order),
+            [
+                {
+                    "id": order_id,
+                    "name": f"Customer {order_id}",
+                    "street": f"{order_id} Main Street",
+                    "city": "Springfield",
+                    "state": random.choice(STATES),
+                    "postal_code": f"{order_id % 100000:05}",
+                    "shipping_price": round(random.uniform(1, 100), 2),
+                    "date_created": dates[order_id],
+                    "status": random.choice(ORDER_STATUSES),
+                    "version": 1,
+                    "item_count": item_count,
+                    "items_total": sum(prices[order_id]),
+                }
+                for order_id in ids
+            ],
+        )
+        if item_count:
+            db.session.execute(
+                insert(Item),
+                [
+                    {"order_id": order_id, "item_price": price, "sku": order_id, "order_date_created": dates[order_id]}
+                    for order_id in ids
+                    for price in prices[order_id]
+                ],
+            )
+        db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        # the ids were given explicitly, move the sequence past them
+        db.session.execute(text("SELECT setval(pg_get_serial_sequence('\"order\"', 'id'), :last)"), {"last": count})
+        db.session.commit()
+
+
+def timed_get(client, url, repeat):
+    """Returns the fastest of repeat GETs of url in milliseconds"""
+
+    def get():
+        resp = client.get(url)
+        assert resp.status_code == status.HTTP_200_OK, resp.get_data(as_text=True)
+
+    return min(timeit.repeat(get, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=1000000, help="number of Orders to seed")
+    parser.add_argument("--items", type=int, default=3, help="number of Items per Order")
+    parser.add_argument("--repeat", type=int, default=5, help="requests to take the best of")
+    parser.add_argument("--no-seed", action="store_true", help="use the Orders already in the database")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(args.orders, args.items)
+    client = app.test_client()
+    last_month = (FIRST_DAY + timedelta(days=DAYS - 30)).isoformat()
+
+    print(f"{db.session.query(Order).count()} Orders, best of {args.repeat}")
+    print(f"  GET /orders/stats                      {timed_get(client, '/orders/stats', args.repeat):9.1f} ms")
+    url = f"/orders/stats?created_after={last_month}"
+    print(f"  GET /orders/stats?created_after=<30d>  {timed_get(client, url, args.repeat):9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration
+
+Gunicorn reads this file from the working directory. It gives the
+workers a shared directory for their Prometheus metrics so /metrics
+reports the whole service and not just the worker that answered.
+"""
+import os
+import shutil
+
+# Must be set before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Removes the metrics of workers from an earlier run"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Stops counting the live gauges of a worker that has exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
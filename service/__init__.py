@@ -7,18 +7,19 @@ and SQL database
 import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import json_provider, log_handlers
 
 # Create Flask application
 app = Flask(__name__)
 app.config.from_object(config)
+json_provider.init_json(app)
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
 from service import routes, models  # noqa: E402, E261
 
 # pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import error_handlers, cli_commands, metrics, query_stats  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
@@ -29,6 +30,8 @@ app.logger.info(70 * "*")
 
 try:
     models.init_db(app)  # make our SQLAlchemy tables
+    metrics.init_metrics(app)
+    query_stats.init_app(app)
 except Exception as error:  # pylint: disable=broad-except
     app.logger.critical("%s: Cannot continue", error)
     # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -0,0 +1,435 @@
+"""
+ASGI Service
+
+Serves the /orders and /orders/<order_id>/items API from a single event
+loop with an asyncio SQLAlchemy session, so one process can keep many
+requests waiting on the database at the same time instead of needing a
+worker per concurrent request.
+
+It shares the models, and the JSON they produce, with the Flask service
+and talks to the database named by ASYNC_DATABASE_URI, which defaults to
+DATABASE_URI with the asyncpg or aiosqlite driver. Run it with:
+
+  uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+
+It serves a subset of the Flask service: the Order and Item routes below,
+including the status transitions and replacing the Items of an Order, and
+listing Orders by name and status a page at a time. Batch create, moving
+many Orders with POST /orders/status, GET /orders/stats, streaming, the
+order cache and the fields, include, q, sort, min_total, max_total,
+created_after and created_before query parameters are only served by the
+Flask service, a listing that asks for them is answered with 400.
+"""
+import logging
+import contextlib
+from http import HTTPStatus
+from sqlalchemy import delete, insert, inspect, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from service import config
+from service.common import query_stats, status
+from service.models import Order, Item, DataValidationError, STATUS_TRANSITIONS, decode_cursor, encode_cursor
+
+logger = logging.getLogger("service.asgi")
+
+engine = create_async_engine(config.ASYNC_DATABASE_URI, **config.ASYNC_ENGINE_OPTIONS)
+query_stats.instrument(engine.sync_engine)
+# objects stay loaded after a commit, they cannot lazy load in a coroutine
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# the query parameters of GET /orders that only the Flask service serves
+FLASK_ONLY_PARAMS = (
+    "fields", "include", "q", "sort", "min_total", "max_total", "created_after", "created_before", "stream",
+)
+
+
+######################################################################
+# GET HEALTH CHECK
+######################################################################
+async def healthcheck(request):  # pylint: disable=unused-argument
+    """Let them know our heart is still beating"""
+    return JSONResponse({"status": 200, "message": "OK"})
+
+
+######################################################################
+#  O R D E R   E N D P O I N T S
+######################################################################
+async def list_orders(request):
+    """
+    Returns all of the Orders
+    Filters by ?name= and ?status=, ?limit=n returns one page of Orders
+    with the URL of the next page in the Link header
+    """
+    unsupported = [name for name in FLASK_ONLY_PARAMS if name in request.query_params]
+    if unsupported:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, f"{', '.join(unsupported)} is only served by the Flask service"
+        )
+    query = select(Order).options(selectinload(Order.items)).order_by(Order.id)
+    if "name" in request.query_params:
+        query = query.where(Order.name == request.query_params["name"])
+    if "status" in request.query_params:
+        query = query.where(Order.status == request.query_params["status"])
+
+    headers = {}
+    limit, cursor = get_page_args(request)
+    if cursor:
+        query = query.where(Order.id > decode_cursor(cursor))
+    if limit:
+        # fetch one extra row to find out if there is another page
+        query = query.limit(limit + 1)
+
+    async with Session() as session:
+        orders = (await session.scalars(query)).all()
+
+    if limit and len(orders) > limit:
+        orders = orders[:limit]
+        next_url = request.url.include_query_params(cursor=encode_cursor(orders[-1].id))
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return JSONResponse([order.serialize() for order in orders], status.HTTP_200_OK, headers)
+
+
+async def create_order(request):
+    """Creates an Order from the data in the body that is posted"""
+    order = Order(items=[]).deserialize(await get_json(request))
+    async with Session() as session:
+        session.add(order)
+        await session.commit()
+    logger.info("Order with new id [%s] saved!", order.id)
+    location_url = request.url_for("get_order", order_id=order.id)
+    return order_response(order, status.HTTP_201_CREATED, {"Location": str(location_url)})
+
+
+async def get_order(request):
+    """Returns a single Order, or 304 if the client has the current version"""
+    order_id = request.path_params["order_id"]
+    async with Session() as session:
+        if request.headers.get("If-None-Match"):
+            version = await session.scalar(select(Order.version).where(Order.id == order_id))
+            if version is not None and etag_matches(request.headers["If-None-Match"], version):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": f'"{version}"'})
+        order = await find_order(session, order_id)
+    return order_response(order)
+
+
+async def update_order(request):
+    """Updates an Order from the body that is posted, honoring If-Match"""
+    order_id = request.path_params["order_id"]
+    data = await get_json(request)
+    async with Session() as session:
+        order = await find_order(session, order_id)
+        if "If-Match" in request.headers and not etag_matches(request.headers["If-Match"], order.version):
+            raise HTTPException(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Order with id '{order_id}' has been changed since it was read.",
+            )
+        order.deserialize(data)
+        order.id = order_id
+        await session.commit()
+        # new Items move the totals with SQL expressions, read back what they came to
+        expired = inspect(order).expired_attributes & {"item_count", "items_total"}
+        if expired:
+            await session.refresh(order, list(expired))
+    return order_response(order)
+
+
+async def delete_order(request):
+    """Deletes an Order and its Items"""
+    async with Session() as session:
+        order = await session.get(Order, request.path_params["order_id"])
+        if order:
+            await session.delete(order)
+            await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def cancel_order(request):
+    """Canceling an order changes its status to Cancelled"""
+    return await transition_order(request.path_params["order_id"], "Cancelled")
+
+
+async def ship_order(request):
+    """Shipping an Open order changes its status to Shipped"""
+    return await transition_order(request.path_params["order_id"], "Shipped")
+
+
+async def fulfill_order(request):
+    """Fulfilling a Shipped order changes its status to Fulfilled"""
+    return await transition_order(request.path_params["order_id"], "Fulfilled")
+
+
+######################################################################
+#  I T E M   E N D P O I N T S
+######################################################################
+async def list_items(request):
+    """Returns all of the Items for an Order"""
+    async with Session() as session:
+        order = await find_order(session, request.path_params["order_id"])
+    return JSONResponse(
+        [item.serialize() for item in order.items], headers={"ETag": f'"{order.version}"'}
+    )
+
+
+async def create_items(request):
+    """Adds an Item to an Order, or every Item in an array with one INSERT"""
+    order_id = request.path_params["order_id"]
+    data = await get_json(request)
+    async with Session() as session:
+        order = await find_order(session, order_id)
+        if not isinstance(data, list):
+            item = Item().deserialize(data)
+            order.items.append(item)
+            await session.commit()
+            return JSONResponse(item.serialize(), status.HTTP_201_CREATED)
+
+        items = deserialize_items(data)
+        results = await insert_items(
+            session,
+            order,
+            items,
+            item_count=Order.item_count + len(items),
+            items_total=Order.items_total + sum(item.item_price or 0.0 for item in items),
+        )
+        await session.commit()
+    return JSONResponse(results, status.HTTP_201_CREATED)
+
+
+async def replace_items(request):
+    """Replaces every Item of an Order with the array that is posted"""
+    order_id = request.path_params["order_id"]
+    data = await get_json(request)
+    if not isinstance(data, list):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Body must be an array of Items")
+    items = deserialize_items(data)
+    async with Session() as session:
+        order = await find_order(session, order_id)
+        await session.execute(delete(Item).where(Item.order_id == order_id))
+        results = await insert_items(
+            session, order, items, item_count=len(items), items_total=sum(item.item_price or 0.0 for item in items)
+        )
+        await session.commit()
+    return JSONResponse(results, status.HTTP_200_OK)
+
+
+async def get_item(request):
+    """Returns an Item of an Order"""
+    async with Session() as session:
+        item = await find_item(session, request.path_params["order_id"], request.path_params["item_id"])
+    return JSONResponse(item.serialize())
+
+
+async def update_item(request):
+    """Updates an Item of an Order from the body that is posted"""
+    data = await get_json(request)
+    async with Session() as session:
+        item = await find_item(session, request.path_params["order_id"], request.path_params["item_id"])
+        item.deserialize(data)
+        await session.commit()
+    return JSONResponse(item.serialize())
+
+
+async def delete_item(request):
+    """Deletes an Item of an Order"""
+    async with Session() as session:
+        item = await session.scalar(
+            select(Item).where(
+                Item.id == request.path_params["item_id"],
+                Item.order_id == request.path_params["order_id"],
+            )
+        )
+        if item:
+            await session.delete(item)
+            await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def get_json(request):
+    """Returns the JSON body of a request, which must be application/json"""
+    content_type = request.headers.get("Content-Type")
+    if content_type != "application/json":
+        raise HTTPException(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Content-Type must be application/json"
+        )
+    try:
+        return await request.json()
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Invalid JSON: {error}") from error
+
+
+async def transition_order(order_id, new_status):
+    """Moves an Order to a new status with one conditional UPDATE and returns it"""
+    async with Session() as session:
+        version = (
+            await session.execute(
+                update(Order)
+                .where(Order.id == order_id, Order.status.in_(STATUS_TRANSITIONS[new_status]))
+                .values(status=new_status, version=Order.version + 1)
+                .returning(Order.version),
+                execution_options={"synchronize_session": False},
+            )
+        ).scalar()
+        if version is None:
+            await session.rollback()
+            # the update matched nothing, find out why
+            current = await session.scalar(select(Order.status).where(Order.id == order_id))
+            if current is None:
+                raise HTTPException(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' was not found.")
+            raise HTTPException(
+                status.HTTP_409_CONFLICT, f"Order with id '{order_id}' is {current} and cannot be {new_status}."
+            )
+        # read before the commit, while the row is still locked, so the result is this transition's
+        order = await find_order(session, order_id)
+        await session.commit()
+    return order_response(order)
+
+
+def deserialize_items(data):
+    """Deserializes an array of Items, all of them must be valid"""
+    items = []
+    for index, json_item in enumerate(data):
+        try:
+            items.append(Item().deserialize(json_item))
+        except DataValidationError as error:
+            raise DataValidationError(f"Item {index}: {error}") from error
+    return items
+
+
+async def insert_items(session, order, items, **totals):
+    """Inserts Items for an Order with one INSERT and returns them serialized
+
+    Set based statements skip the unit of work, so the version and the
+    totals of the Order are set here from the totals given
+    """
+    await session.execute(
+        update(Order).where(Order.id == order.id).values(version=Order.version + 1, **totals),
+        execution_options={"synchronize_session": False},
+    )
+    if not items:
+        return []
+    rows = await session.execute(
+        insert(Item).returning(Item.id, Item.order_id, Item.item_price, Item.sku),
+        [
+            {
+                "order_id": order.id,
+                "order_date_created": order.date_created,
+                "item_price": item.item_price,
+                "sku": item.sku,
+            }
+            for item in items
+        ],
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+async def find_order(session, order_id):
+    """Returns an Order with its Items or aborts with 404"""
+    order = await session.scalar(
+        select(Order).options(selectinload(Order.items)).where(Order.id == order_id)
+    )
+    if order is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Order with id '{order_id}' could not be found.")
+    return order
+
+
+async def find_item(session, order_id, item_id):
+    """Returns an Item of an Order or aborts with 404"""
+    item = await session.scalar(select(Item).where(Item.id == item_id, Item.order_id == order_id))
+    if item is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' could not be found on Order '{order_id}'."
+        )
+    return item
+
+
+def order_response(order, status_code=status.HTTP_200_OK, headers=None):
+    """Returns an Order serialized, with its version as the ETag"""
+    headers = dict(headers or {}, ETag=f'"{order.version}"')
+    return JSONResponse(order.serialize(), status_code, headers)
+
+
+def etag_matches(header, version):
+    """Checks if an If-Match or If-None-Match header holds the version"""
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or f'"{version}"' in tags
+
+
+def get_page_args(request):
+    """Returns the page size and cursor from the query string"""
+    limit = request.query_params.get("limit")
+    cursor = request.query_params.get("cursor")
+    if limit is None:
+        return (config.MAX_PAGE_SIZE if cursor else None), cursor
+    if not limit.isdigit() or not 0 < int(limit) <= config.MAX_PAGE_SIZE:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, f"limit must be a number between 1 and {config.MAX_PAGE_SIZE}"
+        )
+    return int(limit), cursor
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+def error_response(status_code, message):
+    """Returns an error in the same JSON as the Flask service"""
+    logger.warning(message)
+    return JSONResponse(
+        {"status": status_code, "error": HTTPStatus(status_code).phrase, "message": message},
+        status_code,
+    )
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """Handles aborted requests"""
+    return error_response(error.status_code, error.detail)
+
+
+async def request_validation_error(request, error):  # pylint: disable=unused-argument
+    """Handles Value Errors from bad data"""
+    return error_response(status.HTTP_400_BAD_REQUEST, str(error))
+
+
+async def concurrent_update_error(request, error):  # pylint: disable=unused-argument
+    """Handles writes that lost a race with another request"""
+    return error_response(status.HTTP_409_CONFLICT, str(error))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):  # pylint: disable=unused-argument,redefined-outer-name
+    """Closes the database connections when the server shuts down"""
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", healthcheck),
+        Route("/orders", list_orders, methods=["GET"]),
+        Route("/orders", create_order, methods=["POST"]),
+        Route("/orders/{order_id:int}", get_order, methods=["GET"]),
+        Route("/orders/{order_id:int}", update_order, methods=["PUT"]),
+        Route("/orders/{order_id:int}", delete_order, methods=["DELETE"]),
+        Route("/orders/{order_id:int}/cancel", cancel_order, methods=["PUT"]),
+        Route("/orders/{order_id:int}/ship", ship_order, methods=["PUT"]),
+        Route("/orders/{order_id:int}/fulfill", fulfill_order, methods=["PUT"]),
+        Route("/orders/{order_id:int}/items", list_items, methods=["GET"]),
+        Route("/orders/{order_id:int}/items", create_items, methods=["POST"]),
+        Route("/orders/{order_id:int}/items", replace_items, methods=["PUT"]),
+        Route("/orders/{order_id:int}/items/{item_id:int}", get_item, methods=["GET"]),
+        Route("/orders/{order_id:int}/items/{item_id:int}", update_item, methods=["PUT"]),
+        Route("/orders/{order_id:int}/items/{item_id:int}", delete_item, methods=["DELETE"]),
+    ],
+    exception_handlers={
+        HTTPException: http_error,
+        DataValidationError: request_validation_error,
+        StaleDataError: concurrent_update_error,
+    },
+    lifespan=lifespan,
+)
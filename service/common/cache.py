@@ -0,0 +1,121 @@
+"""
+LRU Cache
+
+A small thread safe least recently used cache whose entries also expire
+after a time to live. Each process has its own cache so the time to live
+bounds how long another worker can serve an entry after a write.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least recently used cache with a time to live and hit counters"""
+
+    def __init__(self, maxsize=1024, ttl=10.0):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.listener = None
+
+    def configure(self, maxsize, ttl):
+        """Sets the size and time to live, a maxsize of 0 turns the cache off"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        """Returns the value for key or None if it is not cached"""
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value):
+        """Caches value under key, evicting the least recently used entry"""
+        with self._lock:
+            self._set(key, value)
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key or caches what loader() returns
+
+        The loaded value is not cached if anything was invalidated while it
+        was loading, as it could have been read before that write. A loader
+        that returns None is not cached either.
+        """
+        # the generation is read with the lookup, so no invalidation can fall between them
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            generation = self._generation
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._set(key, value)
+        return value
+
+    def invalidate(self, key):
+        """Removes key from the cache"""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes everything from the cache"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the counters of the cache as a dictionary"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _get(self, key):
+        """Returns the value for key or None if it is not cached, the lock must be held"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self._count("expirations")
+            self._count("misses")
+            return None
+        self._entries.move_to_end(key)
+        self._count("hits")
+        return value
+
+    def _set(self, key, value):
+        """Caches value under key, the lock must be held"""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def _count(self, event):
+        """Adds one to the counter for event and tells the listener"""
+        setattr(self, event, getattr(self, event) + 1)
+        if self.listener is not None:
+            self.listener(event)
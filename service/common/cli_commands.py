@@ -1,8 +1,16 @@
 """
 Flask CLI Command Extensions
 """
+import os
+import time
+import itertools
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+import click
+from sqlalchemy import text
 from service import app
-from service.models import db
+from service.models import db, Order
+from service import export, importer, migrations, partitions, seed
 
 
 ######################################################################
@@ -19,3 +27,253 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    migrations.stamp(db.engine)
+    if app.config["PARTITION_ORDERS"]:
+        with db.engine.begin() as connection:
+            partitions.create_partitions(connection, date.today(), app.config["PARTITION_MONTHS_AHEAD"] + 1)
+
+
+######################################################################
+# Command to bring an existing database up to date
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Applies the migrations that the database does not have yet
+    """
+    applied = migrations.migrate(db.engine, app.config["MIGRATION_LOCK_TIMEOUT"])
+    if applied:
+        print(f"Applied migrations {', '.join(str(version) for version in applied)}")
+    else:
+        print("Database is up to date")
+
+
+######################################################################
+# Command to find Orders whose totals do not match their Items
+# Usage:
+#   flask db-check-totals [--repair]
+######################################################################
+@app.cli.command("db-check-totals")
+@click.option("--repair", is_flag=True, help="Recount the totals of the Orders that are off")
+def db_check_totals(repair):
+    """
+    Compares the item_count and items_total of every Order with its Items
+    """
+    drift = Order.find_total_drift()
+    for row in drift:
+        print(
+            f"Order {row['id']}: item_count {row['item_count']} counted {row['counted_item_count']}, "
+            f"items_total {row['items_total']} counted {row['counted_items_total']}"
+        )
+    if not drift:
+        print("Order totals match their Items")
+    elif repair:
+        Order.repair_totals([row["id"] for row in drift])
+        print(f"Repaired {len(drift)} Orders")
+    else:
+        print(f"{len(drift)} Orders are off, run with --repair to fix them")
+
+
+######################################################################
+# Command to manage the month partitions of a partitioned database
+# Usage:
+#   flask db-partitions [--detach-before 2022-01-01]
+######################################################################
+@app.cli.command("db-partitions")
+@click.option("--detach-before", type=click.DateTime(["%Y-%m-%d"]), help="Detach the months before this date")
+def db_partitions(detach_before):
+    """
+    Creates the partitions of this month and the coming months and
+    detaches the old ones
+    """
+    if not app.config["PARTITION_ORDERS"]:
+        raise click.ClickException("PARTITION_ORDERS is not set for this database")
+    with db.engine.begin() as connection:
+        # attaching and detaching lock the tables, give up rather than queue every query behind it
+        connection.execute(
+            text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": app.config["MIGRATION_LOCK_TIMEOUT"]}
+        )
+        created = partitions.create_partitions(connection, date.today(), app.config["PARTITION_MONTHS_AHEAD"] + 1)
+        detached = partitions.detach_partitions(connection, detach_before.date()) if detach_before else []
+    print(f"Created partitions: {', '.join(created) or 'none'}")
+    print(f"Detached partitions: {', '.join(detached) or 'none'}")
+
+
+######################################################################
+# Command to fill the database with synthetic Orders for perf testing
+# Usage:
+#   flask seed --orders 5000000 --items 10 --workers 8
+######################################################################
+@app.cli.command("seed")
+@click.option("--orders", type=click.IntRange(min=1), default=1000, help="Number of Orders to add")
+@click.option("--items", type=click.IntRange(min=0), default=10, help="Average number of Items per Order")
+@click.option("--workers", type=click.IntRange(min=1), default=1, help="Processes loading chunks at once")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Orders per transaction")
+@click.option("--since", type=click.DateTime(["%Y-%m-%d"]), help="Earliest date_created, 2008-01-01 by default")
+@click.option("--random-seed", type=int, default=42, help="Seed of the generated values")
+def seed_database(orders, items, workers, chunk_size, since, random_seed):  # pylint: disable=too-many-arguments
+    """
+    Adds synthetic Orders and Items, streamed with COPY on Postgres
+    """
+    since = since.date() if since else seed.FIRST_DAY
+    if db.engine.dialect.name != "postgresql" and workers > 1:
+        print("SQLite takes one writer at a time, loading with 1 worker")
+        workers = 1
+    if app.config["PARTITION_ORDERS"]:
+        today = date.today()
+        count = (today.year - since.year) * 12 + today.month - since.month + app.config["PARTITION_MONTHS_AHEAD"] + 1
+        with db.engine.begin() as connection:
+            partitions.create_partitions(connection, since, count)
+
+    pools = seed.make_pools(random_seed)
+    work = seed.chunks(seed.reserve_ids(db.engine, orders), orders, chunk_size, random_seed)
+    start = time.monotonic()
+    loaded_orders = loaded_items = 0
+    for order_count, item_count in _load_chunks(work, items, pools, since, workers):
+        loaded_orders += order_count
+        loaded_items += item_count
+        rate = (loaded_orders + loaded_items) / (time.monotonic() - start)
+        print(f"Seeded {loaded_orders}/{orders} Orders, {rate:.0f} rows/sec")
+    seed.analyze(db.engine)
+    elapsed = time.monotonic() - start
+    print(
+        f"Seeded {loaded_orders} Orders and {loaded_items} Items in {elapsed:.1f}s, "
+        f"{(loaded_orders + loaded_items) / elapsed:.0f} rows/sec"
+    )
+
+
+def _load_chunks(work, items, pools, since, workers):
+    """Loads the chunks in this process or in workers processes, yielding the rows of each"""
+    if workers == 1:
+        for first_id, count, chunk_seed in work:
+            yield seed.load_chunk(db.engine, first_id, count, items, pools, since, chunk_seed)
+        return
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(workers, initializer=seed.start_worker, initargs=(database_uri, pools)) as executor:
+        futures = [
+            executor.submit(seed.load_chunk_in_worker, first_id, count, items, since, chunk_seed)
+            for first_id, count, chunk_seed in work
+        ]
+        for future in futures:
+            yield future.result()
+
+
+######################################################################
+# Command to dump the Orders and their Items for analytics
+# Usage:
+#   flask export --format csv --shard-size 1000000 --workers 4
+######################################################################
+@app.cli.command("export")
+@click.option("--output", help="File to write, orders.<format>.gz by default")
+@click.option("--format", "fmt", type=click.Choice(export.FORMATS), default="ndjson", help="One Order or one Item per line")
+@click.option("--after-id", type=click.IntRange(min=0), default=0, help="Export the Orders after this id")
+@click.option("--shard-size", type=click.IntRange(min=1), help="Orders per file, the files are numbered")
+@click.option("--workers", type=click.IntRange(min=1), default=1, help="Processes writing shards at once")
+@click.option("--batch-size", type=click.IntRange(min=1), default=5000, help="Rows fetched from the cursor at a time")
+def export_orders(output, fmt, after_id, shard_size, workers, batch_size):  # pylint: disable=too-many-arguments
+    """
+    Dumps the Orders and their Items to gzip compressed NDJSON or CSV
+    """
+    output = output or f"orders.{fmt}.gz"
+    start = time.monotonic()
+    with db.engine.connect() as connection:
+        export.begin_snapshot(connection)
+        if shard_size:
+            bounds = export.shard_bounds(connection, after_id, shard_size)
+            paths = [export.shard_path(output, index) for index in range(len(bounds))]
+            _check_not_exists(paths)
+            orders, rows, last_id = _export_shards(connection, paths, bounds, fmt, workers, batch_size)
+        else:
+            _check_not_exists([output])
+            orders, rows, last_id = export.export_range(
+                connection, output, fmt, after_id, None, batch_size,
+                lambda count, last: print(f"Exported {count} Orders through id {last}"),
+            )
+        connection.rollback()
+    elapsed = time.monotonic() - start
+    print(f"Exported {orders} Orders in {rows} rows in {elapsed:.1f}s, {rows / elapsed:.0f} rows/sec")
+    if last_id is not None:
+        print(f"Last id {last_id}, continue after it with --after-id {last_id}")
+
+
+def _check_not_exists(paths):
+    """Stops before an export writes over the files of an earlier one"""
+    existing = [path for path in paths if os.path.exists(path)]
+    if existing:
+        raise click.ClickException(f"{existing[0]} already exists, choose another --output")
+
+
+def _export_shards(connection, paths, bounds, fmt, workers, batch_size):  # pylint: disable=too-many-arguments
+    """Writes the shards in this process or in worker processes that share its snapshot, returns the totals"""
+    if connection.dialect.name != "postgresql" and workers > 1:
+        print("SQLite cannot share a snapshot between connections, exporting with 1 worker")
+        workers = 1
+    firsts = [first for first, _ in bounds]
+    lasts = [last for _, last in bounds]
+    if workers == 1:
+        results = map(
+            export.export_range, itertools.repeat(connection), paths, itertools.repeat(fmt), firsts, lasts,
+            itertools.repeat(batch_size),
+        )
+        return _report_shards(paths, results)
+    snapshot = export.export_snapshot(connection)
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(workers, initializer=export.start_worker, initargs=(database_uri,)) as executor:
+        results = executor.map(
+            export.export_shard_in_worker, itertools.repeat(snapshot), paths, itertools.repeat(fmt), firsts, lasts,
+            itertools.repeat(batch_size),
+        )
+        return _report_shards(paths, results)
+
+
+def _report_shards(paths, results):
+    """Prints every shard as it is written and returns the Orders, rows and last id of all of them"""
+    orders = rows = 0
+    last_id = None
+    for path, (shard_orders, shard_rows, shard_last_id) in zip(paths, results):
+        print(f"Wrote {path}: {shard_orders} Orders through id {shard_last_id}")
+        orders += shard_orders
+        rows += shard_rows
+        last_id = shard_last_id
+    return orders, rows, last_id
+
+
+######################################################################
+# Command to load Orders from NDJSON or CSV files
+# Usage:
+#   flask import orders.ndjson.gz --errors rejected.csv
+######################################################################
+@app.cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(importer.FORMATS), help="ndjson or csv, from the file name by default")
+@click.option("--batch-size", type=click.IntRange(min=1), default=10000, help="Orders merged per transaction")
+@click.option("--errors", default="import-errors.csv", help="CSV file to write the rejected rows to")
+def import_orders(path, fmt, batch_size, errors):
+    """
+    Loads Orders and their Items through a staging table
+    """
+    fmt = fmt or importer.guess_format(path)
+    if fmt is None:
+        raise click.ClickException(f"Cannot tell the format of {path}, use --format")
+    start = time.monotonic()
+    staged = orders = items = 0
+    with db.engine.connect() as connection:
+        importer.create_staging(connection)
+        for staged in importer.stage(connection, importer.read_rows(path, fmt)):
+            print(f"Staged {staged} rows, {staged / (time.monotonic() - start):.0f} rows/sec")
+        rejected = importer.validate(connection)
+        if rejected:
+            importer.write_errors(connection, errors)
+            print(f"Rejected {rejected} rows, written to {errors}")
+        for order_count, item_count in importer.merge(connection, batch_size):
+            orders += order_count
+            items += item_count
+            print(f"Merged {orders} Orders and {items} Items")
+        importer.finish(connection)
+    elapsed = time.monotonic() - start
+    print(
+        f"Imported {orders} Orders and {items} Items from {staged} rows in {elapsed:.1f}s, "
+        f"{staged / elapsed:.0f} rows/sec, {rejected} rows rejected"
+    )
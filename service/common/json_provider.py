@@ -0,0 +1,63 @@
+"""
+JSON Provider
+
+Encodes every response with orjson, which writes the UTF-8 bytes of the
+body straight from the dictionaries and lists it is given and handles
+dates, datetimes and UUIDs itself. The app keeps Flask's own provider
+when orjson is not installed or JSON_PROVIDER is set to "default".
+"""
+import decimal
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj):
+    """Encodes the types orjson does not know about"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """A JSON provider that encodes and decodes with orjson"""
+
+    mimetype = "application/json"
+    # Like DefaultJSONProvider, None pretty prints in debug mode only
+    compact = None
+
+    def dumps(self, obj, **kwargs):
+        """Serializes obj to a JSON string"""
+        return self.dumps_bytes(obj, **kwargs).decode()
+
+    def dumps_bytes(self, obj, option=0, **kwargs):  # pylint: disable=unused-argument
+        """Serializes obj to UTF-8 encoded JSON without going through a str"""
+        return orjson.dumps(obj, default=_default, option=option)
+
+    def loads(self, s, **kwargs):
+        """Deserializes JSON from a str or bytes"""
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serializes the arguments to a JSON response with the body as bytes"""
+        obj = self._prepare_response_obj(args, kwargs)
+        option = 0
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option = orjson.OPT_INDENT_2
+        return self._app.response_class(self.dumps_bytes(obj, option), mimetype=self.mimetype)
+
+
+def init_json(app):
+    """Sets the JSON provider of the app from JSON_PROVIDER"""
+    if app.config["JSON_PROVIDER"] == "default":
+        app.json = DefaultJSONProvider(app)
+    elif orjson is None:
+        app.logger.warning("orjson is not installed, using the standard library for JSON")
+        app.json = DefaultJSONProvider(app)
+    else:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,127 @@
+"""
+Prometheus Metrics
+
+Counts and times every request and reports the database time, cache
+and connection pool use of each one in the Prometheus text format.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory that
+every worker can write to. Each worker then keeps its samples in a
+memory mapped file there and /metrics adds them up across the workers.
+See gunicorn.conf.py for the hooks that clean up after dead workers.
+"""
+import os
+import time
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from service.common import query_stats
+from service.common.pool_stats import pool_stats
+from service.models import order_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled", ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle an HTTP request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time an HTTP request spent running SQL statements",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being handled", multiprocess_mode="livesum"
+)
+CACHE_EVENTS = Counter(
+    "order_cache_events_total", "Order cache hits, misses, evictions and expirations", ["event"]
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    buckets=LATENCY_BUCKETS,
+)
+POOL_EVENTS = Counter(
+    "db_pool_events_total", "Connection pool overflow checkouts and timeouts", ["event"]
+)
+POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Connections checked out of the pool", multiprocess_mode="livesum"
+)
+
+# labels() takes a lock and hashes the label values on every call, keep
+# the labelled children around so recording a request is a dict lookup
+_children = {}
+
+
+def init_metrics(app):
+    """Records metrics for every request and every cache and pool event"""
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_end_request)
+    pool_stats.listener = _record_pool_event
+    order_cache.listener = _record_cache_event
+
+
+def render():
+    """Returns the metrics of every worker in the Prometheus text format"""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _child(metric, *labels):
+    """Returns the child of metric with labels, creating it the first time"""
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+def _record_request(response):
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    _child(REQUESTS, request.method, route, str(response.status_code)).inc()
+    _child(LATENCY, request.method, route).observe(elapsed)
+    _child(DB_TIME, request.method, route).observe(query_stats.request_db_time())
+    return response
+
+
+def _end_request(error):  # pylint: disable=unused-argument
+    if "request_start" in g:
+        IN_FLIGHT.dec()
+
+
+def _record_cache_event(event):
+    _child(CACHE_EVENTS, event).inc()
+
+
+def _record_pool_event(event, seconds=None):
+    if event == "checkout":
+        POOL_IN_USE.inc()
+    elif event == "checkin":
+        POOL_IN_USE.dec()
+    elif event == "wait":
+        POOL_CHECKOUT_WAIT.observe(seconds)
+    else:
+        _child(POOL_EVENTS, event).inc()
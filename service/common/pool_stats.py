@@ -0,0 +1,108 @@
+"""
+Connection Pool Statistics
+
+Counts how the SQLAlchemy connection pool of this process is used: how
+long requests wait to check out a connection, how many connections are
+in use and how often the pool has to open overflow connections or gives
+up waiting.
+"""
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Counters for a connection pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.listener = None
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.checkouts = 0
+            self.in_use = 0
+            self.peak_in_use = 0
+            self.overflow_checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds, overflow=False):
+        """Records how long a checkout waited for a connection"""
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if overflow:
+                self.overflow_checkouts += 1
+        self._notify("wait", seconds)
+        if overflow:
+            self._notify("overflow")
+
+    def record_timeout(self, seconds):
+        """Records a checkout that gave up waiting for a connection"""
+        self.record_wait(seconds)
+        with self._lock:
+            self.timeouts += 1
+        self._notify("timeout")
+
+    def instrument(self, engine):
+        """Counts the connections checked out of and back into an engine's pool"""
+        if not event.contains(engine, "checkout", self._checkout):
+            event.listen(engine, "checkout", self._checkout)
+            event.listen(engine, "checkin", self._checkin)
+
+    def stats(self, pool=None):
+        """Returns the counters, and the state of pool if one is given, as a dictionary"""
+        with self._lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_total, 6),
+                "wait_seconds_max": round(self.wait_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0))
+        return stats
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self._notify("checkout")
+
+    def _checkin(self, dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        with self._lock:
+            self.in_use -= 1
+        self._notify("checkin")
+
+    def _notify(self, event_name, *args):
+        """Tells the listener, if there is one, about a pool event"""
+        if self.listener is not None:
+            self.listener(event_name, *args)
+
+
+# The counters of this process
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that times how long each checkout waits for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_timeout(time.perf_counter() - start)
+            raise
+        pool_stats.record_wait(time.perf_counter() - start, overflow=self.checkedout() > self.size())
+        return connection
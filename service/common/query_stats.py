@@ -0,0 +1,86 @@
+"""
+Query Statistics
+
+Times every SQL statement sent through an engine and adds the time to
+the request that issued it, so the time a request spends waiting on the
+database can be told apart from the time it spends in Python.
+
+Outside of production every response carries the number of statements
+and the time they took in the X-DB-Queries and Server-Timing headers,
+and any statement slower than SLOW_QUERY_MS is logged with its route.
+"""
+import json
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+
+def instrument(engine):
+    """Times the statements run by an engine"""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def init_app(app):
+    """Counts the statements of each request and reports them if SQL_TIMING_HEADERS is set"""
+    app.before_request(_reset_counters)
+    if app.config["SQL_TIMING_HEADERS"]:
+        app.after_request(_add_timing_headers)
+
+
+def request_db_time():
+    """Returns the seconds the current request has spent in the database"""
+    return g.get("db_time", 0.0)
+
+
+def request_db_queries():
+    """Returns the number of statements the current request has run"""
+    return g.get("db_queries", 0)
+
+
+def parameters_shape(parameters, executemany=False):
+    """Describes the parameters of a statement without giving away their values"""
+    if executemany:
+        return {"rows": len(parameters), "row": parameters_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return sorted(parameters)
+    return len(parameters or ())
+
+
+def _reset_counters():
+    g.db_time = 0.0
+    g.db_queries = 0
+
+
+def _add_timing_headers(response):
+    response.headers["X-DB-Queries"] = str(request_db_queries())
+    response.headers.add("Server-Timing", f'db;dur={request_db_time() * 1000:.2f};desc="{request_db_queries()} queries"')
+    return response
+
+
+def _log_slow_query(statement, parameters, executemany, elapsed):
+    entry = {
+        "duration_ms": round(elapsed * 1000, 2),
+        "statement": statement,
+        "parameters": parameters_shape(parameters, executemany),
+    }
+    if has_request_context():
+        entry.update(method=request.method, route=request.url_rule.rule if request.url_rule else request.path)
+    current_app.logger.warning("Slow query: %s", json.dumps(entry))
+
+
+# pylint: disable=unused-argument,too-many-arguments
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context():
+        g.db_time = g.get("db_time", 0.0) + elapsed
+        g.db_queries = g.get("db_queries", 0) + 1
+    if has_app_context():
+        threshold = current_app.config["SLOW_QUERY_MS"]
+        if 0 <= threshold <= elapsed * 1000:
+            _log_slow_query(statement, parameters, executemany, elapsed)
@@ -0,0 +1,217 @@
+"""
+Order Export
+
+`flask export` dumps every Order with its Items to gzip compressed NDJSON,
+one Order per line in the shape GET /orders/<id> returns, or to CSV, one
+line per Item with the columns of its Order in front and the Orders
+without Items on a line of their own.
+
+The rows come from a server-side cursor a batch at a time and are written
+as they arrive, so memory stays the same however large the tables are.
+Everything is read inside one read only, repeatable read transaction, a
+consistent snapshot of the database that writes made during the export
+do not show up in. The output can be split into shards of a fixed number
+of Orders. On Postgres the shards are written by several processes that
+share the snapshot with pg_export_snapshot().
+
+A shard is written to a .part file that is only renamed once it is
+complete. Orders are exported in id order and --after-id starts after an
+id, so an export that stopped can be picked up after the last id it
+reported.
+"""
+import os
+import csv
+import gzip
+import json
+import itertools
+from operator import itemgetter
+from sqlalchemy import create_engine, func, select, text
+from service.models import Order, Item
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+FORMATS = ("ndjson", "csv")
+ORDER_COLUMNS = (
+    "id", "name", "street", "city", "state", "postal_code", "shipping_price",
+    "date_created", "status", "item_count", "items_total",
+)
+CSV_HEADER = ORDER_COLUMNS + ("item_id", "item_price", "sku")
+# items_total is rounded to cents like the API does, the sum of the prices is not
+TOTAL = ORDER_COLUMNS.index("items_total")
+# gzip's default of 9 takes more than twice as long for files a few percent smaller
+COMPRESS_LEVEL = 6
+# report the progress of a single file export every this many Orders
+PROGRESS_EVERY = 100000
+
+# the engine of a worker process, made by start_worker
+_engine = None
+
+
+def dumps(obj):
+    """Encodes a dictionary as one line of JSON"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+######################################################################
+#  S N A P S H O T S
+######################################################################
+def begin_snapshot(connection, snapshot=None):
+    """
+    Starts the read only transaction that the export reads from
+
+    Args:
+        connection (Connection): a connection that has not run anything yet
+        snapshot (str): a snapshot from export_snapshot() to read instead
+            of a new one, Postgres only
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+        if snapshot:
+            # the snapshot id comes from pg_export_snapshot(), it cannot be a bound parameter
+            connection.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+    else:
+        # pysqlite only opens a transaction before a write, a read needs its own
+        connection.exec_driver_sql("BEGIN")
+
+
+def export_snapshot(connection):
+    """Returns the id of the snapshot of a transaction for other connections to read"""
+    return connection.execute(text("SELECT pg_export_snapshot()")).scalar()
+
+
+######################################################################
+#  Q U E R I E S
+######################################################################
+def export_query(after_id=0, last_id=None):
+    """Returns the Orders after after_id up to last_id joined with their Items, in id order"""
+    orders = Order.__table__
+    items = Item.__table__
+    query = (
+        select(*(orders.c[name] for name in ORDER_COLUMNS), items.c.id.label("item_id"), items.c.item_price, items.c.sku)
+        .select_from(orders.outerjoin(items, items.c.order_id == orders.c.id))
+        .where(orders.c.id > after_id)
+        .order_by(orders.c.id, items.c.id)
+    )
+    if last_id is not None:
+        query = query.where(orders.c.id <= last_id)
+    return query
+
+
+def shard_bounds(connection, after_id, shard_size):
+    """
+    Splits the Orders after after_id into shards of shard_size Orders
+
+    Returns the (after_id, last_id) of every shard
+    """
+    orders = Order.__table__
+    numbered = (
+        select(orders.c.id, func.row_number().over(order_by=orders.c.id).label("number"))
+        .where(orders.c.id > after_id)
+        .subquery()
+    )
+    lasts = connection.execute(
+        select(numbered.c.id).where(numbered.c.number % shard_size == 0).order_by(numbered.c.id)
+    ).scalars().all()
+    last_id = connection.execute(select(func.max(orders.c.id)).where(orders.c.id > after_id)).scalar()
+    if last_id is not None and (not lasts or lasts[-1] != last_id):
+        lasts.append(last_id)
+    return list(zip([after_id] + lasts[:-1], lasts))
+
+
+######################################################################
+#  W R I T E R S
+######################################################################
+def write_ndjson(rows, output, progress=None):
+    """Writes an Order with its Items per line, returns the Orders, rows and last id written"""
+    orders = count = 0
+    last_id = None
+    # the rows are read by position, it is much faster than by name
+    width = len(ORDER_COLUMNS)
+    for last_id, group in itertools.groupby(rows, key=itemgetter(0)):
+        group = list(group)
+        order = dict(zip(ORDER_COLUMNS, group[0]))
+        order["date_created"] = order["date_created"].isoformat()
+        order["items_total"] = round(order["items_total"], 2)
+        order["items"] = [
+            {"id": row[width], "order_id": last_id, "item_price": row[width + 1], "sku": row[width + 2]}
+            for row in group
+            if row[width] is not None
+        ]
+        output.write(dumps(order) + "\n")
+        orders += 1
+        count += len(group)
+        if progress and orders % PROGRESS_EVERY == 0:
+            progress(orders, last_id)
+    return orders, count, last_id
+
+
+def write_csv(rows, output, progress=None):
+    """Writes an Item per line after the columns of its Order, returns the Orders, rows and last id written"""
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    orders = count = 0
+    last_id = None
+    for row in rows:
+        if row[0] != last_id:
+            orders += 1
+            last_id = row[0]
+            if progress and orders % PROGRESS_EVERY == 0:
+                progress(orders, last_id)
+        writer.writerow(row[:TOTAL] + (round(row[TOTAL], 2),) + row[TOTAL + 1:])
+        count += 1
+    return orders, count, last_id
+
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv}
+
+
+######################################################################
+#  E X P O R T
+######################################################################
+def shard_path(path, index):
+    """Returns the name of a shard, orders.ndjson.gz becomes orders-00003.ndjson.gz"""
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    return os.path.join(directory, f"{stem}-{index:05}{dot}{suffix}")
+
+
+def export_range(connection, path, fmt, after_id=0, last_id=None, batch_size=5000, progress=None):
+    """
+    Writes the Orders after after_id up to last_id to a gzip compressed file
+
+    Args:
+        connection (Connection): a connection in the transaction to read from
+        path (str): the file to write, it only appears once it is complete
+        fmt (str): one of FORMATS
+        batch_size (int): the rows fetched from the cursor at a time
+        progress (function): called with the Orders written and the last
+            id every PROGRESS_EVERY Orders
+    Returns the number of Orders and rows written and the last id
+    """
+    rows = connection.execution_options(yield_per=batch_size).execute(export_query(after_id, last_id))
+    part = path + ".part"
+    with gzip.open(part, "wt", COMPRESS_LEVEL, encoding="utf-8", newline="") as output:
+        result = WRITERS[fmt](rows, output, progress)
+    os.replace(part, path)
+    return result
+
+
+def start_worker(database_uri):
+    """Gives a worker process its own engine, the connections of the parent cannot be shared"""
+    global _engine  # pylint: disable=global-statement
+    _engine = create_engine(database_uri)
+
+
+def export_shard_in_worker(snapshot, path, fmt, after_id, last_id, batch_size):
+    """Writes a shard from the snapshot of the parent process"""
+    with _engine.connect() as connection:
+        begin_snapshot(connection, snapshot)
+        try:
+            return export_range(connection, path, fmt, after_id, last_id, batch_size)
+        finally:
+            connection.rollback()
@@ -0,0 +1,365 @@
+"""
+Order Import
+
+`flask import` loads Orders from NDJSON or CSV files, gzip compressed or
+not, in the formats `flask export` writes: an Order per line with its
+Items, or an Item per line after the columns of its Order. The ids of the
+Orders are kept, the Items get new ones.
+
+The rows never go through the ORM one at a time:
+
+1. They are streamed into the order_import staging table, with COPY on
+   Postgres where the table is UNLOGGED, all columns as text.
+2. Every check is an UPDATE over the whole table that writes the reason
+   a row is rejected into its error column: missing fields, text longer
+   than its column, numbers that are not numbers or do not fit their
+   column, dates that are not days written as YYYY-MM-DD, statuses outside
+   the enum and Orders that already exist. An Order with a rejected row is
+   rejected as a whole, so the merge never meets a value it cannot insert.
+3. The valid Orders are merged into the order and item tables with an
+   INSERT ... SELECT per batch of Orders, each in its own transaction,
+   with their item_count and items_total counted in SQL.
+
+Orders that were merged before an import stopped are rejected as already
+existing when it is run again, so the same file can be imported twice.
+One import runs at a time, they share the staging table.
+"""
+import csv
+import gzip
+import json
+import itertools
+from sqlalchemy import (
+    BigInteger, Column, Float, Integer, MetaData, Table, Text, and_, case, cast, exists, func, insert, literal,
+    literal_column, or_, select, text, update,
+)
+from service.models import Order, Item, ORDER_STATUSES
+from service.seed import copy_rows, insert_rows
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+FORMATS = ("ndjson", "csv")
+ORDER_FIELDS = ("id", "name", "street", "city", "state", "postal_code", "shipping_price", "date_created", "status")
+ITEM_FIELDS = ("item_price", "sku")
+REQUIRED_FIELDS = ("name", "street", "city", "state", "postal_code")
+# position numbers the rows in the order they were read, line is where they came from
+STAGED_COLUMNS = ("position", "line") + ORDER_FIELDS + ITEM_FIELDS + ("error",)
+
+STAGING = Table(
+    "order_import",
+    MetaData(),
+    Column("position", Integer, primary_key=True),
+    Column("line", Integer),
+    *(Column(name, Text) for name in ORDER_FIELDS + ITEM_FIELDS),
+    Column("order_id", Integer),
+    Column("error", Text),
+)
+
+# the text of a number, an integer and a date, anchored at both ends of the
+# string on Postgres and in Python alike. Numbers have at most 100 digits on
+# each side of the point and a two digit exponent so that they always fit in
+# a float, integers at most 10 digits so that they fit in a BIGINT to compare
+PATTERNS = {
+    "number": r"\A-?[0-9]{1,100}(\.[0-9]{1,100})?([eE][-+]?[0-9]{1,2})?\Z",
+    "integer": r"\A-?[0-9]{1,10}\Z",
+    "date": r"\A[0-9]{4}-[0-9]{2}-[0-9]{2}\Z",
+}
+# the largest value of an INTEGER column
+MAX_INTEGER = 2**31 - 1
+# the text columns of an Order and the longest value each one holds
+LENGTHS = {
+    name: Order.__table__.c[name].type.length for name in ("name", "street", "city", "state", "postal_code")
+}
+
+
+def loads(line):
+    """Decodes a line of JSON"""
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+######################################################################
+#  R E A D I N G
+######################################################################
+def guess_format(path):
+    """Returns the format of a file from its name, or None"""
+    name = path[:-3] if path.endswith(".gz") else path
+    for fmt in FORMATS:
+        if name.endswith("." + fmt):
+            return fmt
+    return None
+
+
+def _text(value):
+    """Returns a value as the text the staging table holds"""
+    if value is None or value == "":
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def order_rows(line, order):
+    """Returns the staged rows of an Order from a line of NDJSON, one per Item"""
+    if not isinstance(order, dict):
+        return [(line,) + (None,) * (len(ORDER_FIELDS) + len(ITEM_FIELDS)) + ("not an Order object",)]
+    values = tuple(_text(order.get(name)) for name in ORDER_FIELDS)
+    items = order.get("items") or []
+    if not isinstance(items, list):
+        return [(line,) + values + (None, None, "items must be an array")]
+    if not items:
+        return [(line,) + values + (None, None, None)]
+    rows = []
+    for item in items:
+        if not isinstance(item, dict) or item.get("item_price") is None:
+            rows.append((line,) + values + (None, None, "missing item_price"))
+        else:
+            rows.append((line,) + values + (_text(item["item_price"]), _text(item.get("sku")), None))
+    return rows
+
+
+def read_rows(path, fmt):
+    """
+    Reads the rows to stage from a file, one at a time
+
+    Returns the rows as tuples in the order of STAGED_COLUMNS
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as source:
+        if fmt == "csv":
+            rows = (
+                (line,) + tuple(_text(record.get(name)) for name in ORDER_FIELDS + ITEM_FIELDS) + (None,)
+                for line, record in enumerate(csv.DictReader(source), start=2)
+            )
+        else:
+            rows = itertools.chain.from_iterable(
+                _json_rows(line, content) for line, content in enumerate(source, start=1) if content.strip()
+            )
+        for position, row in enumerate(rows, start=1):
+            yield (position,) + row
+
+
+def _json_rows(line, content):
+    """Returns the staged rows of a line of NDJSON"""
+    try:
+        return order_rows(line, loads(content))
+    except ValueError:
+        return [(line,) + (None,) * (len(ORDER_FIELDS) + len(ITEM_FIELDS)) + ("invalid JSON",)]
+
+
+######################################################################
+#  S T A G I N G
+######################################################################
+def create_staging(connection):
+    """Creates an empty staging table, UNLOGGED on Postgres since it is thrown away"""
+    drop_staging(connection)
+    columns = ", ".join(
+        f'"{column.name}" {"INTEGER" if isinstance(column.type, Integer) else "TEXT"}'
+        f'{" PRIMARY KEY" if column.primary_key else ""}'
+        for column in STAGING.columns
+    )
+    unlogged = "UNLOGGED " if connection.dialect.name == "postgresql" else ""
+    connection.execute(text(f"CREATE {unlogged}TABLE order_import ({columns})"))
+    connection.commit()
+
+
+def drop_staging(connection):
+    """Drops the staging table"""
+    connection.execute(text("DROP TABLE IF EXISTS order_import"))
+    connection.commit()
+
+
+def stage(connection, rows, chunk_size=50000):
+    """
+    Writes rows to the staging table a chunk per transaction
+
+    Yields the number of rows staged so far after each chunk
+    """
+    write = copy_rows if connection.dialect.name == "postgresql" else insert_rows
+    staged = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        write(connection, "order_import", STAGED_COLUMNS, chunk)
+        connection.commit()
+        staged += len(chunk)
+        yield staged
+
+
+######################################################################
+#  V A L I D A T I O N
+######################################################################
+def _invalid_date(column, dialect):
+    """Returns the condition of text shaped like a date that is not a day of the calendar"""
+    if dialect != "postgresql":
+        # SQLite normalizes a date it does arithmetic on, the 30th of February becomes the 2nd of
+        # March and a 13th month NULL, so only a real day comes back as it went in
+        return func.date(column, "+0 days").is_not(column)
+    year = cast(func.substr(column, 1, 4), Integer)
+    month = cast(func.substr(column, 6, 2), Integer)
+    last_day = func.date_part("day", func.make_date(year, month, 1) + literal_column("interval '1 month - 1 day'"))
+    # a CASE is the only way Postgres promises not to cast before the month is known to be valid
+    return case(
+        (func.substr(column, 6, 2).between("01", "12"), cast(func.substr(column, 9, 2), Integer) > last_day),
+        else_=True,
+    )
+
+
+def invalid(column, kind, dialect):
+    """
+    Returns the condition of a value that is not a number, an integer or a date
+
+    Integers must fit in an INTEGER column and dates must be days of the
+    calendar after the year 0, a missing value is not invalid
+    """
+    matches = column.regexp_match(PATTERNS[kind])
+    if kind == "number":
+        wrong = ~matches
+    elif kind == "integer":
+        wrong = case((matches, ~cast(column, BigInteger).between(-MAX_INTEGER, MAX_INTEGER)), else_=True)
+    else:
+        usable = and_(matches, func.substr(column, 1, 4) != "0000", func.substr(column, 9, 2) != "00")
+        wrong = case((usable, _invalid_date(column, dialect)), else_=True)
+    return and_(column.is_not(None), wrong)
+
+
+def checks(dialect):
+    """Returns the condition and the error message of every check of the staged rows, in order"""
+    staged = STAGING.c
+    result = [(or_(staged.id.is_(None), invalid(staged.id, "integer", dialect)), literal("missing or invalid id"))]
+    for name in REQUIRED_FIELDS:
+        result.append((or_(staged[name].is_(None), staged[name] == ""), literal(f"missing {name}")))
+    for name, length in LENGTHS.items():
+        result.append((func.length(staged[name]) > length, literal(f"{name} longer than {length} characters")))
+    for name, kind in (("shipping_price", "number"), ("item_price", "number"), ("sku", "integer")):
+        result.append((invalid(staged[name], kind, dialect), literal(f"invalid {name} ") + staged[name]))
+    result.append(
+        (invalid(staged.date_created, "date", dialect), literal("invalid date_created ") + staged.date_created)
+    )
+    result.append((staged.status.not_in(ORDER_STATUSES), literal("unknown status ") + staged.status))
+    return result
+
+
+def validate(connection):
+    """
+    Checks every staged row with one UPDATE per check
+
+    Returns the number of rejected rows
+    """
+    staged = STAGING.c
+    connection.execute(update(STAGING).where(staged.status.is_(None)).values(status="Open"))
+    for condition, message in checks(connection.dialect.name):
+        connection.execute(update(STAGING).where(staged.error.is_(None), condition).values(error=message))
+    connection.execute(update(STAGING).where(staged.error.is_(None)).values(order_id=cast(staged.id, Integer)))
+    orders = Order.__table__
+    connection.execute(
+        update(STAGING)
+        .where(staged.error.is_(None), exists().where(orders.c.id == staged.order_id))
+        .values(error="Order already exists")
+    )
+    # an Order is imported with all of its Items or not at all
+    rejected = select(STAGING.c.id).where(staged.error.is_not(None), staged.id.is_not(None)).scalar_subquery()
+    connection.execute(
+        update(STAGING)
+        .where(staged.error.is_(None), staged.id.in_(rejected))
+        .values(error="another row of the Order was rejected")
+    )
+    connection.execute(text("CREATE INDEX order_import_order_id ON order_import (order_id)"))
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("ANALYZE order_import"))
+    connection.commit()
+    return connection.execute(select(func.count()).where(staged.error.is_not(None))).scalar()
+
+
+def write_errors(connection, path):
+    """Writes the line, id and error of every rejected row to a CSV file"""
+    staged = STAGING.c
+    rows = connection.execute(
+        select(staged.line, staged.id, staged.error).where(staged.error.is_not(None)).order_by(staged.position)
+    )
+    with open(path, "w", encoding="utf-8", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(("line", "id", "error"))
+        writer.writerows(rows)
+
+
+######################################################################
+#  M E R G E
+######################################################################
+def merge(connection, batch_size):
+    """
+    Inserts the valid Orders and their Items a batch of Orders per transaction
+
+    Yields the number of Orders and Items inserted by each batch
+    """
+    after_id = 0
+    while True:
+        batch = (
+            select(STAGING.c.order_id)
+            .where(STAGING.c.error.is_(None), STAGING.c.order_id > after_id)
+            .distinct()
+            .order_by(STAGING.c.order_id)
+            .limit(batch_size)
+            .subquery()
+        )
+        last_id = connection.execute(select(func.max(batch.c.order_id))).scalar()
+        if last_id is None:
+            return
+        result = merge_batch(connection, after_id, last_id)
+        connection.commit()
+        after_id = last_id
+        yield result
+
+
+def merge_batch(connection, after_id, last_id):
+    """Inserts the valid Orders with ids after after_id up to last_id, returns the Orders and Items inserted"""
+    staged = STAGING.c
+    batch = and_(staged.error.is_(None), staged.order_id > after_id, staged.order_id <= last_id)
+    # each Order comes from its first row, its totals from all of them
+    firsts = (
+        select(
+            func.min(staged.position).label("position"),
+            func.count(staged.item_price).label("item_count"),
+            func.coalesce(func.sum(cast(staged.item_price, Float)), 0.0).label("items_total"),
+        )
+        .where(batch)
+        .group_by(staged.order_id)
+        .subquery()
+    )
+    orders = Order.__table__
+    # SQLite keeps dates as the text they are staged as and would turn a CAST into a number
+    date_created = cast(staged.date_created, orders.c.date_created.type) \
+        if connection.dialect.name == "postgresql" else staged.date_created
+    order_count = connection.execute(
+        insert(orders).from_select(
+            ORDER_FIELDS + ("version", "item_count", "items_total"),
+            select(
+                staged.order_id, staged.name, staged.street, staged.city, staged.state, staged.postal_code,
+                cast(staged.shipping_price, Float), func.coalesce(date_created, func.current_date()),
+                cast(staged.status, orders.c.status.type), literal(1), firsts.c.item_count, firsts.c.items_total,
+            ).select_from(STAGING.join(firsts, firsts.c.position == staged.position)),
+        )
+    ).rowcount
+    item_count = connection.execute(
+        insert(Item.__table__).from_select(
+            ("order_id", "item_price", "sku", "order_date_created"),
+            select(staged.order_id, cast(staged.item_price, Float), cast(staged.sku, Integer), orders.c.date_created)
+            .select_from(STAGING.join(orders, orders.c.id == staged.order_id))
+            .where(batch, staged.item_price.is_not(None))
+            .order_by(staged.position),
+        )
+    ).rowcount
+    return order_count, item_count
+
+
+def finish(connection):
+    """Moves the Postgres id sequence past the imported ids and drops the staging table"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT setval(pg_get_serial_sequence('\"order\"', 'id'), (SELECT max(id) FROM \"order\"))")
+        )
+        connection.execute(text('ANALYZE "order"'))
+        connection.execute(text('ANALYZE "item"'))
+        connection.commit()
+    drop_staging(connection)
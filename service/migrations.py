@@ -0,0 +1,201 @@
+"""
+Database Migrations
+
+New databases get the whole schema from db.create_all(). Existing
+databases are brought up to date by the numbered migrations in this
+module, which `flask db-migrate` applies in order. The version of the
+last migration applied is kept in the schema_version table.
+
+Migrations run in autocommit mode so indexes on Postgres can be built
+with CREATE INDEX CONCURRENTLY, which does not block writes to the
+table while it runs.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, func, inspect, select, text
+from service.models import SEARCH_INDEX, SQLITE_SEARCH_DDL
+
+logger = logging.getLogger("flask.app")
+
+# Kept out of db.metadata so db.create_all() leaves it alone
+metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(128)),
+    Column("applied_on", DateTime, default=datetime.utcnow),
+)
+
+MIGRATIONS = {}
+
+# the rows a backfill updates per statement
+BACKFILL_CHUNK = 10000
+
+
+def migration(version):
+    """Registers a function as the migration with the given version"""
+
+    def register(function):
+        MIGRATIONS[version] = function
+        return function
+
+    return register
+
+
+def current_version(connection):
+    """Returns the version of the last migration applied to the database"""
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate(engine, lock_timeout="5s"):
+    """
+    Applies every migration that is newer than the database
+
+    Args:
+        engine (Engine): the engine of the database to migrate
+        lock_timeout (string): how long a statement may wait for a lock on
+            Postgres before it gives up instead of queueing other queries
+    Returns the versions that were applied
+    """
+    applied = []
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT set_config('lock_timeout', :timeout, false)"), {"timeout": lock_timeout})
+        version = current_version(connection)
+        for number in sorted(MIGRATIONS):
+            if number <= version:
+                continue
+            upgrade = MIGRATIONS[number]
+            logger.info("Applying migration %s: %s", number, upgrade.__doc__)
+            upgrade(connection)
+            connection.execute(schema_version.insert().values(version=number, description=upgrade.__doc__))
+            applied.append(number)
+    return applied
+
+
+def stamp(engine):
+    """Marks a database made by db.create_all() as having every migration"""
+    with engine.begin() as connection:
+        version = current_version(connection)
+        for number in sorted(MIGRATIONS):
+            if number > version:
+                connection.execute(
+                    schema_version.insert().values(version=number, description=MIGRATIONS[number].__doc__)
+                )
+
+
+def create_index(connection, ddl):
+    """Creates an index without locking out writes where the database allows it
+
+    Args:
+        ddl (string): the index definition that follows CREATE INDEX
+    """
+    if connection.dialect.name == "postgresql":
+        # a failed concurrent build leaves an invalid index behind, drop it
+        # by hand before running the migration again
+        connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {ddl}"))
+    else:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {ddl}"))
+
+
+def add_column(connection, table, column, ddl):
+    """Adds a column to a table unless it is already there
+
+    Give new columns a constant default, Postgres 11 and later then adds
+    them without rewriting the table
+
+    Args:
+        table (string): the name of the table
+        column (string): the name of the new column
+        ddl (string): the type, constraints and default of the column
+    """
+    if column in [existing["name"] for existing in inspect(connection).get_columns(table)]:
+        return
+    connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def backfill(connection, table, statement, chunk_size=None):
+    """Runs an UPDATE over a table one range of ids at a time
+
+    In autocommit mode each range is its own transaction, so the rows of a
+    large table are not all locked until the end of the migration and the
+    work done survives a migration that stops part way
+
+    Args:
+        table (string): the name of the table, which has an integer id
+        statement (string): the UPDATE, its WHERE ends with the condition
+            that the id is between :first and :last
+        chunk_size (int): the ids per range, defaults to BACKFILL_CHUNK
+    """
+    chunk_size = chunk_size or BACKFILL_CHUNK
+    first, last = connection.execute(text(f'SELECT min(id), max(id) FROM "{table}"')).one()
+    if first is None:
+        return
+    for start in range(first, last + 1, chunk_size):
+        connection.execute(text(statement), {"first": start, "last": start + chunk_size - 1})
+        logger.info("Backfilled %s up to id %s of %s", table, min(start + chunk_size - 1, last), last)
+
+
+######################################################################
+#  M I G R A T I O N S
+######################################################################
+@migration(1)
+def add_query_indexes(connection):
+    """Indexes for the name and status filters and the items of an order"""
+    create_index(connection, 'ix_order_name_status ON "order" (name, status)')
+    create_index(connection, "ix_order_status_open ON \"order\" (id) WHERE status = 'Open'")
+    create_index(connection, "ix_item_order_id ON item (order_id)")
+
+
+@migration(2)
+def add_order_version(connection):
+    """Version of each order for ETags"""
+    add_column(connection, "order", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+@migration(3)
+def add_order_totals(connection):
+    """Item count and total of each order"""
+    add_column(connection, "order", "item_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(connection, "order", "items_total", "FLOAT NOT NULL DEFAULT 0")
+    backfill(
+        connection,
+        "order",
+        'UPDATE "order" SET '
+        'item_count = (SELECT count(*) FROM item WHERE item.order_id = "order".id), '
+        'items_total = (SELECT coalesce(sum(item_price), 0) FROM item WHERE item.order_id = "order".id) '
+        "WHERE id BETWEEN :first AND :last",
+    )
+    create_index(connection, 'ix_order_items_total ON "order" (items_total, id)')
+
+
+@migration(4)
+def add_order_search(connection):
+    """Text search index over the name and address of each order"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        create_index(connection, SEARCH_INDEX)
+    elif connection.dialect.name == "sqlite":
+        for ddl in SQLITE_SEARCH_DDL:
+            connection.execute(text(ddl))
+        # index the orders that are already there
+        connection.execute(text("INSERT INTO order_search (order_search) VALUES ('rebuild')"))
+
+
+@migration(5)
+def add_order_dates(connection):
+    """Index on the creation date of each order and its copy on each item"""
+    add_column(connection, "item", "order_date_created", "DATE")
+    backfill(
+        connection,
+        "item",
+        'UPDATE item SET order_date_created = (SELECT date_created FROM "order" WHERE "order".id = item.order_id) '
+        "WHERE order_date_created IS NULL AND id BETWEEN :first AND :last",
+    )
+    if connection.dialect.name == "postgresql":
+        create_index(connection, 'ix_order_date_created ON "order" USING brin (date_created)')
+    else:
+        create_index(connection, 'ix_order_date_created ON "order" (date_created)')
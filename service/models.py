@@ -3,17 +3,37 @@ Models for Order
 
 All of the models are stored in this module
 """
+import json
+import base64
+import binascii
 import logging
 from datetime import date
 from abc import abstractmethod
-from sqlalchemy import Enum, and_
+from sqlalchemy import (
+    DDL, Enum, ForeignKeyConstraint, Index, Integer, and_, any_, column, delete, event, func, insert, inspect,
+    literal, literal_column, or_, select, table, tuple_, update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, load_only, query_expression, with_expression
 from flask_sqlalchemy import SQLAlchemy
+from service import config
+from service.common.cache import LRUCache
+from service.common import query_stats
+from service.common.pool_stats import InstrumentedQueuePool, pool_stats
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# The order and item tables are partitioned by month on Postgres, the
+# partitions are managed by service/partitions.py
+PARTITIONED = config.PARTITION_ORDERS
+
+# Serialized Orders by id, sized in init_db() and kept fresh by the
+# session events at the bottom of this module
+order_cache = LRUCache()
+
 
 def init_db(app):
     """Initialize the SQLAlchemy app"""
@@ -24,6 +44,52 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+ORDER_STATUSES = ("Open", "Shipped", "Fulfilled", "Cancelled")
+
+# The statuses an Order can be moved to and the statuses it can move from
+STATUS_TRANSITIONS = {
+    "Shipped": ("Open",),
+    "Fulfilled": ("Shipped",),
+    "Cancelled": ("Open",),
+}
+
+# the largest value an Integer column can hold on Postgres
+MAX_INTEGER = 2**31 - 1
+
+
+def _number(value, kind, name):
+    """
+    Converts a value from a request to a float or an int
+
+    Strings holding a number are accepted like they always were, anything
+    else that is not a number raises a DataValidationError
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise DataValidationError(f"{name} must be a number")
+    try:
+        number = float(value)
+    except (ValueError, OverflowError) as error:
+        raise DataValidationError(f"{name} must be a number") from error
+    if number != number or number in (float("inf"), float("-inf")):
+        raise DataValidationError(f"{name} must be a finite number")
+    if kind is float:
+        return number
+    if not number.is_integer() or abs(number) > MAX_INTEGER:
+        raise DataValidationError(f"{name} must be a whole number up to {MAX_INTEGER}")
+    return int(number)
+
+
+def _string(value, length, name):
+    """Checks that a value from a request is text that fits a column of length characters"""
+    if value is None:
+        return None
+    if not isinstance(value, str) or len(value) > length:
+        raise DataValidationError(f"{name} must be a string of at most {length} characters")
+    return value
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -57,6 +123,24 @@ class PersistentBase:
         logger.info("Updating %s", self.id)
         db.session.commit()
 
+    @classmethod
+    def create_all(cls, records):
+        """
+        Creates many records to the database in one transaction
+
+        The rows are sent as multi-row INSERT statements rather than one
+        statement and one commit per record. Returns the new ids, read
+        before the commit expires the records so they are not fetched again
+        """
+        logger.info("Creating %s %s records", len(records), cls.__name__)
+        for record in records:
+            record.id = None  # id must be none to generate next primary key
+        db.session.add_all(records)
+        db.session.flush()
+        ids = [record.id for record in records]
+        db.session.commit()
+        return ids
+
     def delete(self):
         """Removes an Order from the data store"""
         logger.info("Deleting %s", self.id)
@@ -68,9 +152,15 @@ class PersistentBase:
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
+        order_cache.configure(app.config["ORDER_CACHE_SIZE"], app.config["ORDER_CACHE_TTL"])
+        engine_options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in engine_options:
+            engine_options.setdefault("poolclass", InstrumentedQueuePool)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
+        pool_stats.instrument(db.engine)
+        query_stats.instrument(db.engine)
         db.create_all()  # make our sqlalchemy tables
 
     @classmethod
@@ -80,10 +170,112 @@ class PersistentBase:
         return cls.query.all()
 
     @classmethod
-    def find(cls, by_id):
-        """Finds a record by it's ID"""
+    def find(cls, by_id, *options):
+        """Finds a record by it's ID
+
+        Args:
+            by_id (int): the id of the record to find
+            options: loader options such as joinedload() for relationships
+                     that will be used right away
+        """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        return cls.query.options(*options).get(by_id)
+
+    @classmethod
+    def sort_keys(cls, sort=None):
+        """Returns the columns records are ordered by, ending with the id
+
+        Args:
+            sort (Column): a column to order by before the id, or None
+        """
+        return [cls.id] if sort is None else [sort, cls.id]
+
+    @classmethod
+    def sort_order(cls, sort=None, descending=False):
+        """Returns the ORDER BY clauses for sort_keys()"""
+        return [key.desc() if descending else key for key in cls.sort_keys(sort)]
+
+    @classmethod
+    def paginate(cls, query=None, limit=100, cursor=None, sort=None, descending=False):
+        """Returns one page of records and the cursor for the next page
+
+        This is keyset (seek) pagination: records are ordered by id and the
+        cursor remembers the last id returned, so every page is a bounded
+        index range scan no matter how deep into the table it starts. When
+        sorted by another column first the cursor remembers its last value
+        as well.
+
+        Args:
+            query (Query): the query to page through, defaults to all records
+            limit (int): the maximum number of records to return
+            cursor (string): the opaque cursor returned with the previous page
+            sort (Column): a column to order by before the id
+            descending (bool): pages go from the largest values down
+        """
+        logger.info("Processing page of %s after cursor %s", limit, cursor)
+        if query is None:
+            query = cls.query
+        keys = cls.sort_keys(sort)
+        if cursor:
+            last = decode_cursor(cursor, len(keys))
+            # compare (sort, id) as a row value so ties on sort are not skipped
+            position, last = (cls.id, last) if sort is None else (tuple_(*keys), tuple_(*last))
+            query = query.filter(position < last if descending else position > last)
+        # fetch one extra row to find out if there is another page
+        records = query.order_by(*cls.sort_order(sort, descending)).limit(limit + 1).all()
+        if len(records) <= limit:
+            return records, None
+        records = records[:limit]
+        return records, encode_cursor(*[getattr(records[-1], key.key) for key in keys])
+
+    @classmethod
+    def stream(cls, query=None, batch_size=500, sort=None, descending=False):
+        """Yields every record of a query without loading them all at once
+
+        The rows are read from a server side cursor ``batch_size`` at a time
+        so memory use stays flat however large the table is.
+
+        Args:
+            query (Query): the query to stream, defaults to all records
+            batch_size (int): the number of rows to fetch per round trip
+            sort (Column): a column to order by before the id
+            descending (bool): stream from the largest values down
+        """
+        logger.info("Streaming records in batches of %s", batch_size)
+        if query is None:
+            query = cls.query
+        yield from query.order_by(*cls.sort_order(sort, descending)).yield_per(batch_size)
+
+
+######################################################################
+#  P A G I N A T I O N   C U R S O R S
+######################################################################
+def encode_cursor(*values):
+    """Encodes the sort values of the last record of a page into an opaque cursor
+
+    The id of the record always comes last
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, size=1):
+    """Decodes an opaque cursor back into the values of the previous page
+
+    Returns the last id for a page sorted by id, otherwise a list of the
+    size sort values ending with the id
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if (
+            not isinstance(values, list)
+            or len(values) != size
+            or not isinstance(values[-1], int)
+            or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+        ):
+            raise ValueError(values)
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+    return values[0] if size == 1 else values
 
 
 ######################################################################
@@ -95,12 +287,26 @@ class Item(db.Model, PersistentBase):
     """
 
     # Table Schema
-    id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(
-        db.Integer, db.ForeignKey("order.id", ondelete="CASCADE"), nullable=False
-    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
     item_price = db.Column(db.Float)
     sku = db.Column(db.Integer)
+    # the date_created of the Order, so the Items of an Order are kept in
+    # the same month partition as the Order itself
+    order_date_created = db.Column(db.Date(), primary_key=PARTITIONED)
+
+    # a unique key on a partitioned table must hold the partition key, so
+    # the Items of partitioned Orders point at (id, date_created)
+    if PARTITIONED:
+        __table_args__ = (
+            ForeignKeyConstraint(
+                [order_id, order_date_created], ["order.id", "order.date_created"], ondelete="CASCADE"
+            ),
+            {"postgresql_partition_by": "RANGE (order_date_created)"},
+        )
+        __mapper_args__ = {"primary_key": [id]}
+    else:
+        __table_args__ = (ForeignKeyConstraint([order_id], ["order.id"], ondelete="CASCADE"),)
 
     def __repr__(self):
         return f"<Item {self.order_id} id=[{self.id}] order[{self.order_id}]>"
@@ -126,8 +332,8 @@ class Item(db.Model, PersistentBase):
         """
         try:
             self.order_id = data["order_id"]
-            self.item_price = data["item_price"]
-            self.sku = data["sku"]
+            self.item_price = _number(data["item_price"], float, "Invalid Item: item_price")
+            self.sku = _number(data["sku"], int, "Invalid Item: sku")
         except KeyError as error:
             raise DataValidationError(
                 "Invalid Item: missing " + error.args[0]
@@ -152,26 +358,79 @@ class Order(db.Model, PersistentBase):
     # app = None
 
     # Table Schema
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64))
     street = db.Column(db.String(64), nullable=True)
     city = db.Column(db.String(64))
     state = db.Column(db.String(2))
     postal_code = db.Column(db.String(16))
     shipping_price = db.Column(db.Float)
-    date_created = db.Column(db.Date(), nullable=False, default=date.today())
+    date_created = db.Column(db.Date(), nullable=False, default=date.today, primary_key=PARTITIONED)
     status = db.Column(
-        Enum("Open", "Shipped", "Fulfilled", "Cancelled", name="status_enum"),
+        Enum(*ORDER_STATUSES, name="status_enum"),
         nullable=False,
         default="Open",
     )
+    # bumped on every write to the Order or its Items, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # the number of Items and the sum of their prices, kept up to date on
+    # every write to the Items so Orders can be listed by value without
+    # reading the item table
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    items_total = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
     items = db.relationship("Item", backref="order", passive_deletes=True)
+    # how well the Order matched a search, only loaded by search()
+    search_rank = query_expression()
+
+    # every UPDATE checks the version it read so concurrent writes fail
+    # with a StaleDataError instead of overwriting each other
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False, "primary_key": [id]}
+
+    # Indexes for the list filters, existing databases get them from
+    # the migrations in service/migrations.py
+    __table_args__ = (
+        Index("ix_order_name_status", name, status),
+        Index("ix_order_items_total", items_total, id),
+        # Orders are appended in date order, a BRIN index on Postgres holds
+        # the range of dates in each block of the table in a few pages
+        Index("ix_order_date_created", date_created, postgresql_using="brin"),
+        # most lookups by status are for the few orders that are still Open
+        Index(
+            "ix_order_status_open",
+            id,
+            postgresql_where=status == "Open",
+            sqlite_where=status == "Open",
+        ),
+        {"postgresql_partition_by": "RANGE (date_created)"} if PARTITIONED else {},
+    )
+
+    # the names serialize() can return, in the order it returns them
+    FIELDS = (
+        "id",
+        "name",
+        "street",
+        "city",
+        "state",
+        "postal_code",
+        "shipping_price",
+        "date_created",
+        "status",
+        "item_count",
+        "items_total",
+        "items",
+    )
 
     def __repr__(self):
         return f"<Order id=[{self.id}]>"
 
-    def serialize(self):
-        """Converts an Order into a dictionary"""
+    def serialize(self, fields=None):
+        """Converts an Order into a dictionary
+
+        Args:
+            fields (list): the names from FIELDS to return, all of them if None
+        """
+        if fields is not None:
+            return self._serialize_fields(fields)
         order = {
             "id": self.id,
             "name": self.name,
@@ -182,12 +441,41 @@ class Order(db.Model, PersistentBase):
             "shipping_price": self.shipping_price,
             "date_created": self.date_created.isoformat(),
             "status": self.status,
+            "item_count": self.item_count,
+            "items_total": _money(self.items_total),
             "items": [],
         }
         for item in self.items:
             order["items"].append(item.serialize())
         return order
 
+    def _serialize_fields(self, fields):
+        """Converts only the given fields of an Order into a dictionary"""
+        order = {}
+        for name in fields:
+            if name == "items":
+                order["items"] = [item.serialize() for item in self.items]
+            elif name == "date_created":
+                order["date_created"] = self.date_created.isoformat()
+            elif name == "items_total":
+                order["items_total"] = _money(self.items_total)
+            else:
+                order[name] = getattr(self, name)
+        return order
+
+    @classmethod
+    def load_fields(cls, fields):
+        """Returns the loader option that reads only the columns of fields
+
+        The id and version are always read. The items are not a column, the
+        caller chooses how to load them if "items" is in fields
+
+        Args:
+            fields (list): the names from FIELDS that will be serialized
+        """
+        columns = [getattr(cls, name) for name in fields if name not in ("id", "items")]
+        return load_only(cls.version, *columns)
+
     def deserialize(self, data):
         """
         Populates an Order from a dictionary
@@ -196,19 +484,21 @@ class Order(db.Model, PersistentBase):
             data (dict): A dictionary containing the resource data
         """
         try:
-            self.name = data["name"]
-            self.street = data["street"]
-            self.city = data["city"]
-            self.state = data["state"]
-            self.postal_code = data["postal_code"]
-            self.shipping_price = data.get("shipping_price")
+            for name in ("name", "street", "city", "state", "postal_code"):
+                length = Order.__table__.c[name].type.length
+                setattr(self, name, _string(data[name], length, f"Invalid Order: {name}"))
+            self.shipping_price = _number(data.get("shipping_price"), float, "Invalid Order: shipping_price")
             self.status = data.get("status")
+            if self.status is not None and self.status not in ORDER_STATUSES:
+                raise DataValidationError(f"Invalid Order: unknown status {self.status}")
             # handle inner list of items
             item_list = data.get("items")
             if item_list:
                 for json_item in item_list:
                     item = Item()
                     item.deserialize(json_item)
+                    # the Items of an Order belong to it, not to the order_id they were sent with
+                    item.order_id = self.id
                     self.items.append(item)
         except KeyError as error:
             raise DataValidationError(
@@ -221,6 +511,371 @@ class Order(db.Model, PersistentBase):
             ) from error
         return self
 
+    def add_items(self, items):
+        """
+        Adds many Items to the Order with one INSERT statement
+
+        Args:
+            items (list): the Items to add
+        Returns the new Items serialized
+        """
+        logger.info("Adding %s items to Order %s", len(items), self.id)
+        results = self._insert_items(
+            items,
+            item_count=Order.item_count + len(items),
+            items_total=Order.items_total + _items_total(items),
+        )
+        db.session.commit()
+        return results
+
+    def replace_items(self, items):
+        """
+        Replaces all of the Items of the Order in one transaction
+
+        The old Items go with one DELETE and the new ones come in with one
+        INSERT statement
+
+        Args:
+            items (list): the Items the Order should have
+        Returns the new Items serialized
+        """
+        logger.info("Replacing the items of Order %s with %s items", self.id, len(items))
+        db.session.execute(delete(Item).where(Item.order_id == self.id))
+        results = self._insert_items(items, item_count=len(items), items_total=_items_total(items))
+        db.session.commit()
+        return results
+
+    def _insert_items(self, items, **totals):
+        """Inserts the Items for the Order and returns them serialized
+
+        Args:
+            items (list): the Items to insert
+            totals: the new item_count and items_total of the Order
+        """
+        db.session.execute(
+            update(Order).where(Order.id == self.id).values(version=Order.version + 1, **totals),
+            execution_options={"synchronize_session": False},
+        )
+        db.session.expire(self, ["items", "version", "item_count", "items_total"])
+        mark_order_changed(db.session, self.id)
+        if not items:
+            return []
+        rows = db.session.execute(
+            insert(Item).returning(Item.id, Item.order_id, Item.item_price, Item.sku),
+            [
+                {
+                    "order_id": self.id,
+                    "order_date_created": self.date_created,
+                    "item_price": item.item_price,
+                    "sku": item.sku,
+                }
+                for item in items
+            ],
+        )
+        return [dict(row._mapping) for row in rows]
+
+    @classmethod
+    def transition(cls, by_id, new_status):
+        """
+        Moves an Order to a new status with one conditional UPDATE
+
+        The status check and the change are a single statement, so two
+        requests racing to move the same Order cannot both succeed
+
+        Args:
+            by_id (int): the id of the Order
+            new_status (string): one of the statuses in STATUS_TRANSITIONS
+        Returns the new version of the Order, or None if there is no such
+        Order or its status cannot be moved to new_status
+        """
+        logger.info("Moving Order %s to %s", by_id, new_status)
+        version = db.session.execute(
+            cls._transition_statement(by_id, new_status).returning(cls.version),
+            execution_options={"synchronize_session": False},
+        ).scalar()
+        if version is not None:
+            mark_order_changed(db.session, by_id)
+        db.session.commit()
+        return version
+
+    @classmethod
+    def transition_and_read(cls, by_id, new_status):
+        """
+        Moves an Order to a new status like transition() and returns it as
+        the UPDATE left it
+
+        Where the database supports UPDATE ... RETURNING the Order comes back
+        from the UPDATE itself, elsewhere it is read again. Either way its
+        Items are read before the commit, while the transaction still holds
+        the lock on the row of the Order, so a later write cannot show up in
+        the result
+
+        Args:
+            by_id (int): the id of the Order
+            new_status (string): one of the statuses in STATUS_TRANSITIONS
+        Returns the new version and the serialized Order, or None if there
+        is no such Order or its status cannot be moved to new_status
+        """
+        logger.info("Moving Order %s to %s", by_id, new_status)
+        statement = cls._transition_statement(by_id, new_status)
+        if db.engine.dialect.update_returning:
+            # from_statement() lets the returned row refresh an Order the session already holds
+            order = db.session.scalars(
+                select(cls).from_statement(statement.returning(cls)).execution_options(populate_existing=True)
+            ).first()
+        else:
+            matched = db.session.execute(statement, execution_options={"synchronize_session": False}).rowcount
+            order = cls.query.populate_existing().get(by_id) if matched else None
+        if order is None:
+            db.session.rollback()
+            return None
+        result = (order.version, order.serialize())
+        mark_order_changed(db.session, by_id)
+        db.session.commit()
+        return result
+
+    @classmethod
+    def _transition_statement(cls, by_id, new_status):
+        """Returns the conditional UPDATE that moves an Order to a new status"""
+        return (
+            update(cls)
+            .where(cls.id == by_id, cls.status.in_(STATUS_TRANSITIONS[new_status]))
+            .values(status=new_status, version=cls.version + 1)
+        )
+
+    @classmethod
+    def transition_all(cls, new_status, *conditions, limit=None):
+        """
+        Moves every Order that matches the conditions to a new status with
+        one conditional UPDATE
+
+        Only the Orders in a status they may move from are changed, the
+        others are left as they are
+
+        Args:
+            new_status (string): one of the statuses in STATUS_TRANSITIONS
+            conditions: the conditions the Orders must match
+            limit (int): move at most this many Orders, the lowest ids first
+        Returns the ids of the Orders that were moved
+        """
+        logger.info("Moving Orders to %s", new_status)
+        movable = [*conditions, cls.status.in_(STATUS_TRANSITIONS[new_status])]
+        if limit is not None:
+            movable.append(cls.id.in_(select(cls.id).where(*movable).order_by(cls.id).limit(limit)))
+        ids = (
+            db.session.execute(
+                update(cls)
+                .where(*movable)
+                .values(status=new_status, version=cls.version + 1)
+                .returning(cls.id),
+                execution_options={"synchronize_session": False},
+            )
+            .scalars()
+            .all()
+        )
+        for order_id in ids:
+            mark_order_changed(db.session, order_id)
+        db.session.commit()
+        return ids
+
+    @classmethod
+    def id_in(cls, ids):
+        """Returns the condition for Orders whose id is in a list
+
+        On Postgres the list is sent as one array parameter, so the
+        statement is the same however many ids there are
+        """
+        if db.engine.dialect.name == "postgresql":
+            return cls.id == any_(literal(list(ids), ARRAY(Integer)))
+        return cls.id.in_(ids)
+
+    @classmethod
+    def find_statuses(cls, ids):
+        """Returns the status of each Order in a list of ids that exists
+
+        Args:
+            ids (list): the ids of the Orders
+        """
+        logger.info("Processing status lookup for %s ids ...", len(ids))
+        return dict(db.session.execute(select(cls.id, cls.status).where(cls.id_in(ids))).all())
+
+    @classmethod
+    def find_version(cls, by_id):
+        """Returns the version of an Order without loading the Order
+
+        Args:
+            by_id (int): the id of the Order
+        """
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return db.session.query(cls.version).filter(cls.id == by_id).scalar()
+
+    @classmethod
+    def created_between(cls, created_after=None, created_before=None):
+        """Returns the conditions for Orders created in a range of dates
+
+        Args:
+            created_after (date): the first date to include, or None
+            created_before (date): the last date to include, or None
+        """
+        conditions = []
+        if created_after is not None:
+            conditions.append(cls.date_created >= created_after)
+        if created_before is not None:
+            conditions.append(cls.date_created <= created_before)
+        return conditions
+
+    @classmethod
+    def statistics(cls, created_after=None, created_before=None):
+        """Returns the number of Orders and their totals by status and by state
+
+        Counted by one GROUP BY query over the orders, the Items are counted
+        from the item_count and items_total of each Order
+
+        Args:
+            created_after (date): count Orders created on or after this date
+            created_before (date): count Orders created on or before this date
+        """
+        logger.info("Processing statistics from %s to %s", created_after, created_before)
+        conditions = cls.created_between(created_after, created_before)
+        rows = db.session.execute(
+            select(
+                cls.status,
+                cls.state,
+                func.count(cls.id),
+                func.sum(cls.item_count),
+                func.sum(cls.items_total),
+                func.sum(cls.shipping_price),
+            )
+            .where(*conditions)
+            .group_by(cls.status, cls.state)
+        )
+        stats = _totals()
+        stats.update(by_status={}, by_state={})
+        for order_status, state, count, item_count, items_total, shipping_total in rows:
+            _add_totals(
+                stats,
+                order_status,
+                state,
+                count=count,
+                item_count=item_count or 0,
+                items_total=items_total or 0.0,
+                shipping_total=shipping_total or 0.0,
+            )
+        for totals in [stats, *stats["by_status"].values(), *stats["by_state"].values()]:
+            totals["items_total"] = round(totals["items_total"], 2)
+            totals["shipping_total"] = round(totals["shipping_total"], 2)
+        return stats
+
+    @classmethod
+    def total_between(cls, min_total=None, max_total=None):
+        """Returns the conditions for Orders whose items_total is in a range
+
+        Args:
+            min_total (float): the smallest total to include, or None
+            max_total (float): the largest total to include, or None
+        """
+        conditions = []
+        if min_total is not None:
+            conditions.append(cls.items_total >= min_total)
+        if max_total is not None:
+            conditions.append(cls.items_total <= max_total)
+        return conditions
+
+    @classmethod
+    def search(cls, text, query=None):
+        """Returns the Orders whose name, street, city or postal code match text
+
+        The match runs against the trigram index on Postgres and the FTS5
+        table on SQLite, so it does not scan the order table. Terms shorter
+        than a trigram are left out. Each Order carries how well it matched
+        in search_rank, higher is better.
+
+        Args:
+            text (string): the words to search for
+            query (Query): the query to search within, defaults to all Orders
+        Returns the query and the rank expression to order it by
+        """
+        logger.info("Processing search for %s ...", text)
+        terms = [term for term in text.split() if len(term) >= SEARCH_MIN_LENGTH]
+        if not terms:
+            raise DataValidationError(f"Search terms must be at least {SEARCH_MIN_LENGTH} characters long")
+        if query is None:
+            query = cls.query
+        if db.engine.dialect.name == "sqlite":
+            # every term must appear, each one quoted so it is taken as text
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+            query = query.join(search_table, search_table.c.rowid == cls.id).filter(
+                literal_column("order_search").op("MATCH")(match)
+            )
+            # bm25() is lower for better matches
+            rank = -func.bm25(literal_column("order_search"))
+        else:
+            phrase = " ".join(terms)
+            query = query.filter(search_text().bool_op("%>")(phrase))
+            rank = func.word_similarity(phrase, search_text())
+        rank = rank.label("search_rank")
+        return query.options(with_expression(cls.search_rank, rank)), rank
+
+    @classmethod
+    def find_total_drift(cls):
+        """Returns the Orders whose item_count or items_total disagree with their Items
+
+        Each one is a dictionary of the id with the stored and the counted
+        item_count and items_total
+        """
+        logger.info("Processing check of the Order totals")
+        item_count = func.count(Item.id)
+        items_total = func.coalesce(func.sum(Item.item_price), 0.0)
+        rows = db.session.execute(
+            select(cls.id, cls.item_count, item_count, cls.items_total, items_total)
+            .outerjoin(Item, Item.order_id == cls.id)
+            .group_by(cls.id, cls.item_count, cls.items_total)
+            .having(
+                or_(
+                    cls.item_count != item_count,
+                    func.abs(cls.items_total - items_total) > TOTAL_TOLERANCE,
+                )
+            )
+            .order_by(cls.id)
+        )
+        return [
+            {
+                "id": order_id,
+                "item_count": stored_count,
+                "counted_item_count": counted_count,
+                "items_total": _money(stored_total),
+                "counted_items_total": _money(counted_total),
+            }
+            for order_id, stored_count, counted_count, stored_total, counted_total in rows
+        ]
+
+    @classmethod
+    def repair_totals(cls, ids, chunk_size=1000):
+        """Recounts the item_count and items_total of Orders from their Items
+
+        Args:
+            ids (list): the ids of the Orders to repair
+            chunk_size (int): the number of Orders to update per statement
+        """
+        logger.info("Repairing the totals of %s Orders", len(ids))
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            db.session.execute(
+                update(cls)
+                .where(cls.id.in_(chunk))
+                .values(
+                    item_count=select(func.count(Item.id)).where(Item.order_id == cls.id).scalar_subquery(),
+                    items_total=select(func.coalesce(func.sum(Item.item_price), 0.0))
+                    .where(Item.order_id == cls.id)
+                    .scalar_subquery(),
+                    version=cls.version + 1,
+                ),
+                execution_options={"synchronize_session": False},
+            )
+            for order_id in chunk:
+                mark_order_changed(db.session, order_id)
+        db.session.commit()
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Orders with the given name
@@ -249,3 +904,240 @@ class Order(db.Model, PersistentBase):
             name (string): the name of the Orders you want to match
         """
         return cls.query.filter(and_(cls.name == name, cls.status == status))
+
+
+######################################################################
+#  S E A R C H
+######################################################################
+# the columns Order.search() matches against, run together
+SEARCH_COLUMNS = ("name", "street", "city", "postal_code")
+# terms shorter than a trigram cannot be looked up in the index
+SEARCH_MIN_LENGTH = 3
+SEARCH_TEXT_SQL = " || ' ' || ".join(f"coalesce({name}, '')" for name in SEARCH_COLUMNS)
+# the trigram index behind Order.search() on Postgres, for CREATE INDEX
+SEARCH_INDEX = f'ix_order_search ON "order" USING gin (({SEARCH_TEXT_SQL}) gin_trgm_ops)'
+# the FTS5 table behind Order.search() on SQLite and the triggers that
+# keep it in step with the order table
+_new_values = ", ".join(f"new.{name}" for name in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{name}" for name in SEARCH_COLUMNS)
+SQLITE_SEARCH_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS order_search USING fts5({', '.join(SEARCH_COLUMNS)}, "
+    "content='order', content_rowid='id', tokenize='trigram')",
+    'CREATE TRIGGER IF NOT EXISTS order_search_insert AFTER INSERT ON "order" BEGIN '
+    f"INSERT INTO order_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (new.id, {_new_values}); END",
+    'CREATE TRIGGER IF NOT EXISTS order_search_delete AFTER DELETE ON "order" BEGIN '
+    f"INSERT INTO order_search (order_search, rowid, {', '.join(SEARCH_COLUMNS)}) "
+    f"VALUES ('delete', old.id, {_old_values}); END",
+    f'CREATE TRIGGER IF NOT EXISTS order_search_update AFTER UPDATE OF {", ".join(SEARCH_COLUMNS)} ON "order" BEGIN '
+    f"INSERT INTO order_search (order_search, rowid, {', '.join(SEARCH_COLUMNS)}) "
+    f"VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO order_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (new.id, {_new_values}); END",
+)
+search_table = table("order_search", column("rowid"))
+
+
+def search_text():
+    """Returns the SQL expression the trigram index on Postgres is built on"""
+    return literal_column(f"({SEARCH_TEXT_SQL})")
+
+
+# db.create_all() builds the search index along with the order table,
+# existing databases get it from the migrations
+event.listen(
+    Order.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+event.listen(
+    Order.__table__, "after_create", DDL(f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX}").execute_if(dialect="postgresql")
+)
+for _ddl in SQLITE_SEARCH_DDL:
+    event.listen(Order.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+event.listen(Order.__table__, "after_drop", DDL("DROP TABLE IF EXISTS order_search").execute_if(dialect="sqlite"))
+
+
+######################################################################
+#  P A R T I T I O N S
+######################################################################
+# rows outside every month partition land in a default partition, so a
+# write never fails for want of a partition
+if PARTITIONED:
+    event.listen(
+        Order.__table__, "after_create", DDL('CREATE TABLE IF NOT EXISTS order_default PARTITION OF "order" DEFAULT')
+    )
+    event.listen(Item.__table__, "after_create", DDL("CREATE TABLE IF NOT EXISTS item_default PARTITION OF item DEFAULT"))
+
+
+@event.listens_for(Session, "before_flush")
+def _set_item_order_dates(session, flush_context, instances):  # pylint: disable=unused-argument
+    """Copies the date_created of each Order onto the Items written with it
+
+    Set based statements that bypass the unit of work must set
+    order_date_created themselves
+    """
+    for item in session.new | session.dirty:
+        if not isinstance(item, Item) or item in session.deleted:
+            continue
+        order = _item_order(session, item)
+        if order is None:
+            continue
+        if order.date_created is None:
+            # the column default would only be set during the flush
+            order.date_created = date.today()
+        if item.order_date_created != order.date_created:
+            item.order_date_created = order.date_created
+
+
+######################################################################
+#  O R D E R   T O T A L S
+######################################################################
+# a difference in items_total smaller than this is rounding, not drift
+TOTAL_TOLERANCE = 0.005
+
+
+def _money(value):
+    """Rounds an amount to cents"""
+    return None if value is None else round(value, 2)
+
+
+def _items_total(items):
+    """Returns the sum of the prices of Items"""
+    return sum(item.item_price or 0.0 for item in items)
+
+
+def _committed(item, name):
+    """Returns the value an attribute of an Item has in the database"""
+    getattr(item, name)  # loads the attribute if it has expired
+    history = inspect(item).attrs[name].history
+    values = history.deleted or history.unchanged
+    return values[0] if values else None
+
+
+def _item_order(session, item):
+    """Returns the Order an Item will belong to after the flush"""
+    added = inspect(item).attrs.order.history.added
+    if added:
+        return added[0]
+    return session.get(Order, item.order_id) if item.order_id is not None else None
+
+
+def _item_changes(session):
+    """Returns how many Items and how much of their price each Order gains in a flush"""
+    changes = {}
+
+    def change(order, count, total):
+        if order is not None:
+            changed = changes.setdefault(order, [0, 0.0])
+            changed[0] += count
+            changed[1] += total
+
+    for item in session.new | session.dirty | session.deleted:
+        if not isinstance(item, Item):
+            continue
+        if inspect(item).has_identity:
+            # take out what the Item added to its Order before this write
+            order_id = _committed(item, "order_id")
+            if order_id is not None:
+                change(session.get(Order, order_id), -1, -(_committed(item, "item_price") or 0.0))
+        if item not in session.deleted:
+            change(_item_order(session, item), 1, item.item_price or 0.0)
+    return changes
+
+
+@event.listens_for(Session, "before_flush")
+def _update_order_totals(session, flush_context, instances):  # pylint: disable=unused-argument
+    """Moves the item_count and items_total of Orders by the Items being written
+
+    Orders that are already in the database are changed with SET item_count
+    = item_count + n, so concurrent writes to the Items of an Order add up.
+    Set based statements that bypass the unit of work must keep the totals
+    up to date themselves
+    """
+    for order, (count, total) in _item_changes(session).items():
+        if order in session.deleted or (not count and not total):
+            continue
+        if inspect(order).persistent:
+            order.item_count = Order.item_count + count
+            order.items_total = Order.items_total + total
+        else:
+            order.item_count = (order.item_count or 0) + count
+            order.items_total = (order.items_total or 0.0) + total
+
+
+######################################################################
+#  S T A T I S T I C S
+######################################################################
+def _totals():
+    """Returns an empty set of Order totals"""
+    return {"count": 0, "item_count": 0, "items_total": 0.0, "shipping_total": 0.0}
+
+
+def _add_totals(stats, order_status, state, **values):
+    """Adds values to the overall totals and those of the status and state"""
+    by_status = stats["by_status"].setdefault(order_status, _totals())
+    by_state = stats["by_state"].setdefault(state or "unknown", _totals())
+    for totals in (stats, by_status, by_state):
+        for name, value in values.items():
+            totals[name] += value
+
+
+######################################################################
+#  O R D E R   V E R S I O N S
+######################################################################
+@event.listens_for(Session, "before_flush")
+def _bump_order_versions(session, flush_context, instances):  # pylint: disable=unused-argument
+    """Bumps the version of every Order that is changed, or whose Items are"""
+    orders = set()
+    for record in session.new | session.dirty | session.deleted:
+        if isinstance(record, Order) and session.is_modified(record):
+            orders.add(record)
+        elif isinstance(record, Item):
+            if record.order is not None:
+                orders.add(record.order)
+            # a new Item belongs to the Order it was added to, whatever
+            # order_id the request gave it
+            if record in session.new:
+                continue
+            # an Item that moved changes the Order it left as well
+            for order_id in inspect(record).attrs.order_id.history.deleted:
+                if order_id is not None:
+                    orders.add(session.get(Order, order_id))
+    for order in orders:
+        if order is not None and inspect(order).persistent and order not in session.deleted:
+            order.version += 1
+
+
+######################################################################
+#  C A C H E   I N V A L I D A T I O N
+######################################################################
+def mark_order_changed(session, order_id):
+    """Drops an Order from the cache now and again when the session commits
+
+    Set based statements that bypass the unit of work must call this for
+    every Order they change
+    """
+    order_cache.invalidate(order_id)
+    session.info.setdefault("changed_orders", set()).add(order_id)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_orders(session, flush_context):  # pylint: disable=unused-argument
+    """Finds the Orders written by a flush, including those whose Items changed"""
+    for record in session.new | session.dirty | session.deleted:
+        if isinstance(record, Order):
+            mark_order_changed(session, record.id)
+        elif isinstance(record, Item):
+            # an Item that moved changes the Order it left as well
+            for order_id in inspect(record).attrs.order_id.history.sum() or [record.order_id]:
+                mark_order_changed(session, order_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_orders(session):
+    """Drops the committed Orders again in case they were re-read before the commit"""
+    for order_id in session.info.pop("changed_orders", ()):
+        order_cache.invalidate(order_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_orders(session):
+    """Nothing was written, the Orders were dropped from the cache at flush time"""
+    session.info.pop("changed_orders", None)
@@ -0,0 +1,141 @@
+"""
+Order Partitions
+
+With PARTITION_ORDERS set, `flask db-create` builds the order and item
+tables on Postgres partitioned by the month of the date each order was
+created, with the Items of an Order in the partition of the same month.
+Queries that filter on date_created only read the partitions of the
+months they cover, and a month that is no longer needed is detached in
+one statement instead of being deleted row by row.
+
+Month partitions are named order_YYYY_MM and item_YYYY_MM. Orders outside
+every month land in order_default and item_default, so partitions should
+be created before their month starts: a month cannot be added once the
+default partition holds rows for it. `flask db-partitions` creates the
+coming months and detaches the old ones.
+"""
+import re
+import logging
+from datetime import date
+from sqlalchemy import text
+
+logger = logging.getLogger("flask.app")
+
+# the partitioned tables, the Items of an Order are in the same month
+TABLES = ("order", "item")
+PARTITION_NAME = re.compile(r"^(order|item)_(\d{4})_(\d{2})$")
+
+
+def month_start(day):
+    """Returns the first day of the month of a date"""
+    return day.replace(day=1)
+
+
+def next_month(day):
+    """Returns the first day of the month after a date"""
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def months(first, count):
+    """Returns the first days of count months starting with the month of first"""
+    result = []
+    month = month_start(first)
+    for _ in range(count):
+        result.append(month)
+        month = next_month(month)
+    return result
+
+
+def partition_name(table, month):
+    """Returns the name of the partition of a table for a month"""
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_month(name):
+    """Returns the month a partition holds from its name, or None for other tables"""
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(2)), int(match.group(3)), 1) if match else None
+
+
+def list_partitions(connection, table="order"):
+    """Returns the names of the partitions attached to a table"""
+    rows = connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table ORDER BY child.relname"
+        ),
+        {"table": table},
+    )
+    return [row[0] for row in rows]
+
+
+def create_partitions(connection, first, count):
+    """
+    Creates the month partitions of the order and item tables
+
+    Args:
+        connection (Connection): a connection to the database
+        first (date): a day in the first month to create
+        count (int): the number of months to create
+    Returns the names of the partitions that were created
+    """
+    created = []
+    for month in months(first, count):
+        for table in TABLES:
+            name = partition_name(table, month)
+            if name in list_partitions(connection, table):
+                continue
+            logger.info("Creating partition %s", name)
+            connection.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+                )
+            )
+            created.append(name)
+    return created
+
+
+def detach_partitions(connection, before):
+    """
+    Detaches the partitions of the months before the month of a date
+
+    The Items go first since they point at their Orders. The detached
+    tables keep their rows, to be archived or dropped, and are no longer
+    read by queries on the order and item tables.
+
+    Args:
+        connection (Connection): a connection to the database
+        before (date): the first day that stays attached, rounded down to
+            the start of its month
+    Returns the names of the partitions that were detached
+    """
+    detached = []
+    for table in reversed(TABLES):
+        for name in list_partitions(connection, table):
+            month = partition_month(name)
+            if month is None or month >= month_start(before):
+                continue
+            logger.info("Detaching partition %s", name)
+            connection.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+            if table == "item":
+                # the detached Items would still point at the Orders in
+                # the order table and stop their partition from detaching
+                for constraint in foreign_keys(connection, name):
+                    connection.execute(text(f'ALTER TABLE "{name}" DROP CONSTRAINT "{constraint}"'))
+            detached.append(name)
+    return detached
+
+
+def foreign_keys(connection, table):
+    """Returns the names of the foreign keys of a table"""
+    rows = connection.execute(
+        text(
+            "SELECT conname FROM pg_constraint JOIN pg_class ON pg_class.oid = pg_constraint.conrelid "
+            "WHERE pg_class.relname = :table AND pg_constraint.contype = 'f'"
+        ),
+        {"table": table},
+    )
+    return [row[0] for row in rows]
@@ -4,13 +4,22 @@ My Service
 Describe what your service does here
 """
 
-from flask import url_for, jsonify, request, make_response, abort
+from datetime import date
+from flask import url_for, jsonify, request, make_response, abort, stream_with_context
+from sqlalchemy.orm import joinedload, selectinload
 from service.common import status  # HTTP Status Codes
-from service.models import Order, Item
+from service.common import metrics
+from service.common.pool_stats import pool_stats
+from service.models import db, Order, Item, DataValidationError, STATUS_TRANSITIONS, order_cache
 
 # Import Flask application
 from . import app
 
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# The fields GET /orders can be sorted by
+SORT_FIELDS = ("id", "item_count", "items_total")
+
 
 ######################################################################
 # GET HEALTH CHECK
@@ -21,6 +30,28 @@ def healthcheck():
     return make_response(jsonify(status=200, message="OK"), status.HTTP_200_OK)
 
 
+######################################################################
+# GET INSTRUMENTATION
+######################################################################
+@app.route("/instrumentation")
+def instrumentation():
+    """Returns the counters of this worker's caches and connection pool"""
+    return make_response(
+        jsonify(order_cache=order_cache.stats(), db_pool=pool_stats.stats(db.engine.pool)),
+        status.HTTP_200_OK,
+    )
+
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route("/metrics")
+def get_metrics():
+    """Returns the request, cache and pool metrics in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return make_response(body, status.HTTP_200_OK, {"Content-Type": content_type})
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -66,6 +97,113 @@ def create_order():
     )
 
 
+######################################################################
+# CREATE MANY ORDERS
+######################################################################
+
+
+@app.route("/orders/batch", methods=["POST"])
+def create_orders_batch():
+    """
+    Creates many Orders
+    This endpoint takes an array of Orders and saves all of the valid ones
+    in a single transaction. The ids list lines up with the posted array
+    and holds null for every Order that is listed in errors
+    """
+    app.logger.info("Request to create a batch of Orders")
+    check_content_type("application/json")
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be an array of Orders")
+    if len(data) > app.config["MAX_BATCH_SIZE"]:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"A batch can hold at most {app.config['MAX_BATCH_SIZE']} Orders",
+        )
+
+    # Validate every order before anything is written
+    orders = []
+    errors = []
+    for index, json_order in enumerate(data):
+        try:
+            orders.append(Order().deserialize(json_order))
+        except DataValidationError as error:
+            orders.append(None)
+            errors.append({"index": index, "message": str(error)})
+
+    valid_orders = [order for order in orders if order is not None]
+    new_ids = iter(Order.create_all(valid_orders) if valid_orders else [])
+    app.logger.info("Batch saved %s Orders, %s rejected", len(valid_orders), len(errors))
+
+    ids = [next(new_ids) if order is not None else None for order in orders]
+    return_code = status.HTTP_201_CREATED if valid_orders else status.HTTP_400_BAD_REQUEST
+    return make_response(jsonify(ids=ids, errors=errors), return_code)
+
+
+######################################################################
+# MOVE MANY ORDERS TO A NEW STATUS
+######################################################################
+
+
+@app.route("/orders/status", methods=["POST"])
+def transition_orders():
+    """
+    Moves many Orders to a new status
+    The body holds the new status and either the ids of the Orders or a
+    filter of name, created_after and created_before. The Orders that may
+    move are moved by one UPDATE, the ids that were not moved are listed
+    in rejected with the reason. A filter moves at most
+    MAX_STATUS_BATCH_SIZE Orders, more is true while others are left to
+    move and the same request moves the next ones
+    """
+    app.logger.info("Request to move many Orders to a new status")
+    check_content_type("application/json")
+    data = request.get_json()
+    if not isinstance(data, dict) or data.get("status") not in list(STATUS_TRANSITIONS):
+        abort(status.HTTP_400_BAD_REQUEST, f"Body must hold a status of {', '.join(STATUS_TRANSITIONS)}")
+    new_status = data["status"]
+    if ("ids" in data) == ("filter" in data):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must hold either ids or a filter")
+
+    more = False
+    if "ids" in data:
+        ids = get_order_ids(data["ids"])
+        transitioned = Order.transition_all(new_status, Order.id_in(ids))
+        rejected = rejected_transitions(ids, transitioned, new_status)
+    else:
+        limit = app.config["MAX_STATUS_BATCH_SIZE"]
+        transitioned = Order.transition_all(new_status, *get_filter_conditions(data["filter"]), limit=limit)
+        # a full batch may have left Orders behind, the next request moves them
+        more = len(transitioned) == limit
+        rejected = []
+    app.logger.info("Moved %s Orders to %s, %s rejected", len(transitioned), new_status, len(rejected))
+    return make_response(
+        jsonify(status=new_status, transitioned=sorted(transitioned), rejected=rejected, more=more),
+        status.HTTP_200_OK,
+    )
+
+
+######################################################################
+# ORDER STATISTICS
+######################################################################
+
+
+@app.route("/orders/stats", methods=["GET"])
+def get_order_stats():
+    """
+    Returns Order counts and totals
+    The number of Orders, their Items, the sum of the item prices and of
+    the shipping prices overall, by status and by state. Pass
+    ?created_after= and ?created_before= (inclusive dates) to count only
+    the Orders created in that range
+    """
+    app.logger.info("Request for Order statistics")
+    created_after, created_before = get_date_args()
+    stats = Order.statistics(created_after, created_before)
+    return make_response(jsonify(stats), status.HTTP_200_OK)
+
+
 ######################################################################
 # READ AN ORDER
 ######################################################################
@@ -78,16 +216,23 @@ def get_orders(order_id):
     This endpoint will return an Order based on its id
     """
     app.logger.info("Request for Order with id: %s", order_id)
+    fields = get_fields()
+    response = not_modified(order_id)
+    if response is not None:
+        return response
 
     # See if the order exists and abort if it doesn't
-    order = Order.find(order_id)
-    if not order:
+    found = find_serialized_order(order_id, fields)
+    if not found:
         abort(
             status.HTTP_404_NOT_FOUND,
             f"Order with id '{order_id}' could not be found.",
         )
-    app.logger.info("Returning order: %s", order.name)
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    version, order = found
+    app.logger.info("Returning order: %s", order_id)
+    response = make_response(jsonify(order), status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
 
 
 ######################################################################
@@ -97,26 +242,50 @@ def get_orders(order_id):
 
 @app.route("/orders", methods=["GET"])
 def list_orders():
-    """Returns all of the Orders"""
+    """
+    Returns all of the Orders
+    Pass ?limit=n to get one page of Orders back, the Link header holds
+    the URL of the next page if there is one
+    Send Accept: application/x-ndjson (or ?stream=1) to stream every Order
+    back as newline delimited JSON
+    Pass ?fields=id,name,status to read and return only those fields, the
+    Items are left out unless ?include=items is passed as well
+    Pass ?min_total= and ?max_total= to filter on the sum of the item
+    prices and ?sort=items_total or ?sort=-item_count to order by them
+    Pass ?q= to search the name and address of the Orders, the best
+    matches come first unless ?sort= is given
+    Pass ?created_after= and ?created_before= to list the Orders created
+    in a range of dates
+    """
     app.logger.info("Request for Order list By Status")
-
-    # Process the query string if any by name and status
-    name_query = request.args.get("name")
-    status_query = request.args.get("status")
-
-    if name_query and status_query:
-        orders = Order.find_by_name_and_status(name_query, status_query)
-    elif name_query:
-        orders = Order.find_by_name(name_query)
-    elif status_query:
-        orders = Order.find_by_status(status_query)
-    else:
-        orders = Order.all()
+    fields = get_fields()
+    orders, sort, descending = search_orders(filter_orders())
+
+    # load the items of every order in one extra query instead of one per order
+    if fields is None or "items" in fields:
+        orders = orders.options(selectinload(Order.items))
+    if fields is not None:
+        orders = orders.options(Order.load_fields(fields))
+
+    if wants_stream():
+        return stream_response(Order.stream(orders, app.config["STREAM_BATCH_SIZE"], sort, descending), fields)
+
+    headers = {}
+    limit, cursor = get_page_args()
+    if limit:
+        orders, next_cursor = Order.paginate(orders, limit, cursor, sort, descending)
+        if next_cursor:
+            args = request.args.to_dict()
+            args["cursor"] = next_cursor
+            next_url = url_for("list_orders", _external=True, **args)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+    elif sort is not None or descending:
+        orders = orders.order_by(*Order.sort_order(sort, descending))
 
     # Return as an array of dictionaries
-    results = [order.serialize() for order in orders]
+    results = [order.serialize(fields) for order in orders]
     app.logger.info("[%s] Orders returned", len(results))
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    return make_response(jsonify(results), status.HTTP_200_OK, headers)
 
 
 ######################################################################
@@ -139,6 +308,13 @@ def update_orders(order_id):
         abort(status.HTTP_404_NOT_FOUND,
               f"Order with id '{order_id}' was not found.")
 
+    # Only update the version the client has when it sends If-Match
+    if request.if_match and not request.if_match.contains(str(order.version)):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"Order with id '{order_id}' has been changed since it was read.",
+        )
+
     # Update from the json in the body of the request
     data = request.get_json()
     app.logger.info(data)
@@ -146,7 +322,9 @@ def update_orders(order_id):
     order.id = order_id
     order.update()
 
-    return make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(order.serialize()), status.HTTP_200_OK)
+    response.set_etag(str(order.version))
+    return response
 
 
 ######################################################################
@@ -177,20 +355,27 @@ def delete_orders(order_id):
 def cancel_order(order_id):
     """Canceling an order changes its status to Cancelled"""
     app.logger.info("Request to cancel an order with id: %s", order_id)
-    order = Order.find(order_id)
-    if not order:
-        abort(status.HTTP_404_NOT_FOUND,
-              f"Order with id '{order_id}' was not found.")
-    if not order.status == "Open":
-        abort(
-            status.HTTP_409_CONFLICT,
-            f"Order with id '{order_id}' is already shipped or fulfilled and cannot be cancelled.",
-        )
-    # Set order to Cancelled
-    app.logger.info("Order ID %s  cancelled", order_id)
-    order.status = "Cancelled"
-    order.update()
-    return order.serialize(), status.HTTP_200_OK
+    return transition_order(order_id, "Cancelled")
+
+
+######################################################################
+# SHIP AN ORDER
+######################################################################
+@app.route("/orders/<int:order_id>/ship", methods=["PUT"])
+def ship_order(order_id):
+    """Shipping an Open order changes its status to Shipped"""
+    app.logger.info("Request to ship an order with id: %s", order_id)
+    return transition_order(order_id, "Shipped")
+
+
+######################################################################
+# FULFILL AN ORDER
+######################################################################
+@app.route("/orders/<int:order_id>/fulfill", methods=["PUT"])
+def fulfill_order(order_id):
+    """Fulfilling a Shipped order changes its status to Fulfilled"""
+    app.logger.info("Request to fulfill an order with id: %s", order_id)
+    return transition_order(order_id, "Fulfilled")
 
 
 # ---------------------------------------------------------------------
@@ -206,7 +391,8 @@ def cancel_order(order_id):
 def create_items(order_id):
     """
     Create an Item on an Order
-    This endpoint will add an item to an order
+    This endpoint will add an item to an order, or every item in the
+    array when an array of items is posted
     """
     app.logger.info(
         "Request to create an Item for Order with id: %s", order_id)
@@ -220,9 +406,14 @@ def create_items(order_id):
             f"Order with id '{order_id}' could not be found.",
         )
 
+    data = request.get_json()
+    if isinstance(data, list):
+        message = order.add_items(deserialize_items(data))
+        return make_response(jsonify(message), status.HTTP_201_CREATED)
+
     # Create an item from the json data
     item = Item()
-    item.deserialize(request.get_json())
+    item.deserialize(data)
 
     # Append the item to the order
     order.items.append(item)
@@ -234,6 +425,36 @@ def create_items(order_id):
     return make_response(jsonify(message), status.HTTP_201_CREATED)
 
 
+######################################################################
+# REPLACE ALL OF THE ITEMS OF AN ORDER
+######################################################################
+
+
+@app.route("/orders/<int:order_id>/items", methods=["PUT"])
+def replace_items(order_id):
+    """
+    Replace the Items of an Order
+    This endpoint will replace every item of an order with the posted array
+    """
+    app.logger.info("Request to replace the Items of Order with id: %s", order_id)
+    check_content_type("application/json")
+
+    # See if the order exists and abort if it doesn't
+    order = Order.find(order_id)
+    if not order:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Order with id '{order_id}' could not be found.",
+        )
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be an array of Items")
+    message = order.replace_items(deserialize_items(data))
+
+    return make_response(jsonify(message), status.HTTP_200_OK)
+
+
 ######################################################################
 # LIST ORDER ITEMS
 ######################################################################
@@ -241,21 +462,35 @@ def create_items(order_id):
 
 @app.route("/orders/<int:order_id>/items", methods=["GET"])
 def list_items(order_id):
-    """Returns all of the Items for an Order"""
+    """
+    Returns all of the Items for an Order
+    Pass ?limit=n to get one page of Items back, the Link header holds
+    the URL of the next page if there is one
+    """
     app.logger.info("Request for all Items for an Order with id: %s", order_id)
+    response = not_modified(order_id)
+    if response is not None:
+        return response
+
+    limit, cursor = get_page_args()
+    if limit:
+        return items_page(order_id, limit, cursor)
 
     # See if the order exists and abort if it doesn't
-    order = Order.find(order_id)
-    if not order:
+    found = find_serialized_order(order_id)
+    if not found:
         abort(
             status.HTTP_404_NOT_FOUND,
             f"Order with id '{order_id}' could not be found.",
         )
 
     # Get the items for the account
-    results = [item.serialize() for item in order.items]
+    version, order = found
+    results = order["items"]
 
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    response = make_response(jsonify(results), status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
 
 
 ######################################################################
@@ -356,3 +591,283 @@ def check_content_type(media_type):
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         f"Content-Type must be {media_type}",
     )
+
+
+def get_order_ids(ids):
+    """Returns the distinct ids in a request body, in the order they were given"""
+    if (
+        not isinstance(ids, list)
+        or not ids
+        or not all(isinstance(order_id, int) and not isinstance(order_id, bool) for order_id in ids)
+    ):
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a non-empty array of Order ids")
+    if len(ids) > app.config["MAX_STATUS_BATCH_SIZE"]:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"A request can move at most {app.config['MAX_STATUS_BATCH_SIZE']} Orders",
+        )
+    return list(dict.fromkeys(ids))
+
+
+def get_filter_conditions(filters):
+    """Returns the conditions for a filter of name, created_after and created_before"""
+    if not isinstance(filters, dict) or not filters or set(filters) - {"name", "created_after", "created_before"}:
+        abort(status.HTTP_400_BAD_REQUEST, "filter must hold name, created_after or created_before")
+    conditions = []
+    if "name" in filters:
+        conditions.append(Order.name == filters["name"])
+    dates = []
+    for name in ("created_after", "created_before"):
+        try:
+            dates.append(date.fromisoformat(filters[name]) if name in filters else None)
+        except (TypeError, ValueError):
+            abort(status.HTTP_400_BAD_REQUEST, f"{name} must be a date like 2023-04-01")
+    return conditions + Order.created_between(*dates)
+
+
+def rejected_transitions(ids, transitioned, new_status):
+    """Returns the ids that were not moved to a new status with the reason why"""
+    moved = set(transitioned)
+    missing = [order_id for order_id in ids if order_id not in moved]
+    if not missing:
+        return []
+    statuses = Order.find_statuses(missing)
+    return [
+        {
+            "id": order_id,
+            "message": (
+                f"Order is {statuses[order_id]} and cannot be {new_status}"
+                if order_id in statuses
+                else "Order was not found"
+            ),
+        }
+        for order_id in missing
+    ]
+
+
+def transition_order(order_id, new_status):
+    """Moves an Order to a new status and returns it as the transition left it"""
+    found = Order.transition_and_read(order_id, new_status)
+    if found is None:
+        # the update matched nothing, find out why
+        order = Order.find(order_id)
+        if not order:
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Order with id '{order_id}' was not found.")
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"Order with id '{order_id}' is {order.status} and cannot be {new_status}.",
+        )
+    app.logger.info("Order ID %s  %s", order_id, new_status)
+    version, order = found
+    response = make_response(jsonify(order), status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
+
+
+def find_serialized_order(order_id, fields=None):
+    """Returns the version of an Order and the Order with its Items serialized
+
+    They come from the cache if the Order is there. With a list of fields
+    only those are returned, and an Order that is not cached is read with
+    just those columns and is not cached
+    """
+
+    def load():
+        order = Order.find(order_id, joinedload(Order.items))
+        return (order.version, order.serialize()) if order else None
+
+    if fields is None:
+        return order_cache.get_or_load(order_id, load)
+    cached = order_cache.get(order_id)
+    if cached:
+        version, order = cached
+        return version, {name: order[name] for name in fields}
+    options = [Order.load_fields(fields)]
+    if "items" in fields:
+        options.append(joinedload(Order.items))
+    order = Order.find(order_id, *options)
+    return (order.version, order.serialize(fields)) if order else None
+
+
+def not_modified(order_id):
+    """Returns a 304 response if the client has the current version of an Order
+
+    The version comes from the cache or from a lookup of just the version
+    column, the Order is never loaded or serialized. Returns None when the
+    Order has to be sent
+    """
+    if not request.if_none_match:
+        return None
+    cached = order_cache.get(order_id)
+    version = cached[0] if cached else Order.find_version(order_id)
+    if version is None or not request.if_none_match.contains(str(version)):
+        return None
+    app.logger.info("Order with id %s has not been modified", order_id)
+    response = make_response("", status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(str(version))
+    return response
+
+
+def items_page(order_id, limit, cursor):
+    """Returns one page of the Items of an Order, read by id from the item table"""
+    version = Order.find_version(order_id)
+    if version is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Order with id '{order_id}' could not be found.",
+        )
+    items, next_cursor = Item.paginate(Item.query.filter(Item.order_id == order_id), limit, cursor)
+    response = make_response(jsonify([item.serialize() for item in items]), status.HTTP_200_OK)
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        next_url = url_for("list_items", order_id=order_id, _external=True, **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    response.set_etag(str(version))
+    return response
+
+
+def deserialize_items(data):
+    """Deserializes an array of Items, all of them must be valid"""
+    items = []
+    for index, json_item in enumerate(data):
+        try:
+            items.append(Item().deserialize(json_item))
+        except DataValidationError as error:
+            raise DataValidationError(f"Item {index}: {error}") from error
+    return items
+
+
+def wants_stream():
+    """Checks if the client asked for a streamed NDJSON listing"""
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    best = request.accept_mimetypes.best_match([JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE])
+    return best == NDJSON_MEDIA_TYPE
+
+
+def stream_response(records, fields=None):
+    """Streams records back as newline delimited JSON
+
+    Lines are sent a batch at a time so the first bytes go out as soon as
+    the first rows are read instead of after the whole listing is built
+    """
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+
+    def generate():
+        lines = []
+        for record in records:
+            lines.append(app.json.dumps(record.serialize(fields)))
+            if len(lines) >= batch_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    return app.response_class(
+        stream_with_context(generate()), status.HTTP_200_OK, mimetype=NDJSON_MEDIA_TYPE
+    )
+
+
+def get_page_args():
+    """Returns the page size and cursor from the query string
+
+    A cursor without a limit gets the largest page size allowed
+    """
+    max_page_size = app.config["MAX_PAGE_SIZE"]
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    if limit is None:
+        return (max_page_size if cursor else None), cursor
+    if not limit.isdigit() or not 0 < int(limit) <= max_page_size:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be a number between 1 and {max_page_size}",
+        )
+    return int(limit), cursor
+
+
+def filter_orders():
+    """Returns the query for the Orders that match the filters in the query string"""
+    name_query = request.args.get("name")
+    status_query = request.args.get("status")
+
+    if name_query and status_query:
+        orders = Order.find_by_name_and_status(name_query, status_query)
+    elif name_query:
+        orders = Order.find_by_name(name_query)
+    elif status_query:
+        orders = Order.find_by_status(status_query)
+    else:
+        orders = Order.query
+
+    min_total = get_number_arg("min_total")
+    max_total = get_number_arg("max_total")
+    return orders.filter(*Order.total_between(min_total, max_total), *Order.created_between(*get_date_args()))
+
+
+def search_orders(orders):
+    """Applies ?q= to the Orders and returns them with the sort to list them in"""
+    sort, descending = get_sort()
+    text = request.args.get("q")
+    if text is None:
+        return orders, sort, descending
+    orders, rank = Order.search(text, orders)
+    if "sort" in request.args:
+        return orders, sort, descending
+    return orders, rank, True
+
+
+def get_number_arg(name):
+    """Returns a number from the query string, or None if it is not there"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return abort(status.HTTP_400_BAD_REQUEST, f"{name} must be a number")
+
+
+def get_sort():
+    """Returns the column from ?sort= and whether it is descending
+
+    The column is None when the Orders are sorted by id
+    """
+    sort = request.args.get("sort", "id")
+    name = sort[1:] if sort.startswith("-") else sort
+    if name not in SORT_FIELDS:
+        abort(status.HTTP_400_BAD_REQUEST, f"sort must be one of {', '.join(SORT_FIELDS)}, - for descending")
+    return (None if name == "id" else getattr(Order, name)), sort.startswith("-")
+
+
+def get_fields():
+    """Returns the Order fields asked for with ?fields= and ?include=
+
+    None means the whole Order with its Items. The fields come back in the
+    order serialize() returns them
+    """
+    if "fields" not in request.args:
+        return None
+    names = {name.strip() for name in request.args["fields"].split(",")}
+    names.update(name.strip() for name in request.args.get("include", "").split(","))
+    names.discard("")
+    if not names:
+        abort(status.HTTP_400_BAD_REQUEST, "fields must name at least one field")
+    unknown = names.difference(Order.FIELDS)
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in Order.FIELDS if name in names]
+
+
+def get_date_args():
+    """Returns the created_after and created_before dates from the query string"""
+    dates = []
+    for name in ("created_after", "created_before"):
+        value = request.args.get(name)
+        try:
+            dates.append(date.fromisoformat(value) if value else None)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"{name} must be a date like 2023-04-01")
+    return tuple(dates)
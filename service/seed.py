@@ -0,0 +1,180 @@
+"""
+Synthetic Orders for performance testing
+
+`flask seed` fills the database with Orders and Items that look like the
+ones tests/factories.py builds: Faker names and addresses, a status drawn
+from the same four, a date_created from 2008 until today and prices
+between 1 and 100. Calling Faker for every row would take longer than
+loading it, so each field draws from a pool of a few thousand values
+made once per run.
+
+The rows skip the ORM. On Postgres they are streamed with COPY and on
+SQLite written with executemany, a chunk of Orders and their Items per
+transaction, with the item_count, items_total and order_date_created
+that the session events would have set. Chunks can be loaded by several
+processes at once, every chunk has its own range of Order ids and its
+own random seed, so a run makes the same rows however it is split up.
+"""
+import io
+import csv
+import random
+from datetime import date, timedelta
+from sqlalchemy import create_engine, text
+from service.models import ORDER_STATUSES
+
+try:
+    from faker import Faker
+except ImportError:  # pragma: no cover
+    Faker = None
+
+# the date_created of tests/factories.py starts here
+FIRST_DAY = date(2008, 1, 1)
+POOL_SIZE = 5000
+ORDER_COLUMNS = (
+    "id", "name", "street", "city", "state", "postal_code", "shipping_price",
+    "date_created", "status", "version", "item_count", "items_total",
+)
+ITEM_COLUMNS = ("order_id", "item_price", "sku", "order_date_created")
+
+# the engine and the value pools of a worker process, set by start_worker
+_engine = None
+_pools = None
+
+
+def make_pools(seed, size=POOL_SIZE):
+    """Returns size Faker values for each of the text fields of an Order"""
+    if Faker is None:
+        raise RuntimeError("Faker is not installed, it comes with factory-boy in requirements.txt")
+    fake = Faker()
+    fake.seed_instance(seed)
+    providers = {
+        "name": fake.name,
+        "street": fake.street_address,
+        "city": fake.city,
+        "state": fake.state_abbr,
+        "postal_code": fake.postalcode,
+    }
+    return {field: [provider() for _ in range(size)] for field, provider in providers.items()}
+
+
+def generate(first_id, count, items, pools, since, seed):
+    """
+    Makes the rows of count Orders and of their Items
+
+    Args:
+        first_id (int): the id of the first Order, the others follow it
+        count (int): the number of Orders
+        items (int): the average number of Items of an Order, each one
+            has between 0 and twice that many
+        pools (dict): the values of the text fields from make_pools()
+        since (date): the earliest date_created
+        seed (int): the seed of the random choices
+    Returns the Order rows and the Item rows as tuples in the order of
+    ORDER_COLUMNS and ITEM_COLUMNS
+    """
+    rng = random.Random(seed)
+    days = max(1, (date.today() - since).days + 1)
+    orders = []
+    order_items = []
+    for order_id in range(first_id, first_id + count):
+        created = since + timedelta(days=rng.randrange(days))
+        prices = [round(rng.uniform(1.00, 100.00), 2) for _ in range(rng.randint(0, 2 * items))]
+        orders.append(
+            (
+                order_id,
+                rng.choice(pools["name"]),
+                rng.choice(pools["street"]),
+                rng.choice(pools["city"]),
+                rng.choice(pools["state"]),
+                rng.choice(pools["postal_code"]),
+                round(rng.uniform(1.00, 100.00), 2),
+                created,
+                rng.choice(ORDER_STATUSES),
+                1,
+                len(prices),
+                round(sum(prices), 2),
+            )
+        )
+        order_items.extend((order_id, price, rng.randrange(1, 1000000), created) for price in prices)
+    return orders, order_items
+
+
+def copy_rows(connection, table, columns, rows):
+    """Streams rows into a Postgres table with COPY"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, columns, rows):
+    """Writes rows to a table with one executemany"""
+    if not rows:
+        return
+    placeholders = ", ".join("?" for _ in columns)
+    connection.exec_driver_sql(f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+
+def load_chunk(engine, first_id, count, items, pools, since, seed):
+    """
+    Writes count Orders and their Items in one transaction
+
+    Returns the number of Orders and the number of Items written
+    """
+    orders, order_items = generate(first_id, count, items, pools, since, seed)
+    write = copy_rows if engine.dialect.name == "postgresql" else insert_rows
+    with engine.begin() as connection:
+        write(connection, "order", ORDER_COLUMNS, orders)
+        write(connection, "item", ITEM_COLUMNS, order_items)
+    return len(orders), len(order_items)
+
+
+def reserve_ids(engine, count):
+    """
+    Returns the first of count Order ids that nothing else will be given
+
+    On Postgres the id sequence is moved past them, Orders created by the
+    service while the seed runs take the ids after the seeded ones
+    """
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            last = connection.execute(
+                text(
+                    "SELECT setval(pg_get_serial_sequence('\"order\"', 'id'), "
+                    "nextval(pg_get_serial_sequence('\"order\"', 'id')) + :count - 1)"
+                ),
+                {"count": count},
+            ).scalar()
+            return last - count + 1
+        return connection.execute(text('SELECT coalesce(max(id), 0) + 1 FROM "order"')).scalar()
+
+
+def chunks(first_id, count, chunk_size, seed):
+    """Returns the first id, the number of Orders and the seed of every chunk"""
+    return [
+        (first_id + start, min(chunk_size, count - start), seed + index)
+        for index, start in enumerate(range(0, count, chunk_size))
+    ]
+
+
+def start_worker(database_uri, pools):
+    """Gives a worker process its own engine, the connections of the parent cannot be shared"""
+    global _engine, _pools  # pylint: disable=global-statement
+    _engine = create_engine(database_uri)
+    _pools = pools
+
+
+def load_chunk_in_worker(first_id, count, items, since, seed):
+    """Loads a chunk with the engine and the pools of the worker process"""
+    return load_chunk(_engine, first_id, count, items, _pools, since, seed)
+
+
+def analyze(engine):
+    """Updates the planner statistics of the tables after a load"""
+    with engine.begin() as connection:
+        connection.execute(text('ANALYZE "order"'))
+        connection.execute(text('ANALYZE "item"'))
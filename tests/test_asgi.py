@@ -0,0 +1,200 @@
+"""
+ASGI Service Test Suite
+
+The ASGI service is exercised in process through the Starlette test
+client against the database named by DATABASE_URI
+"""
+from unittest import TestCase
+from starlette.testclient import TestClient
+from tests.factories import ItemFactory, OrderFactory
+from service.common import status  # HTTP Status Codes
+from service.models import db, Order, Item
+from service.asgi import app
+
+BASE_URL = "/orders"
+
+
+######################################################################
+#  A S G I   T E S T   C A S E S
+######################################################################
+class TestAsgiService(TestCase):
+    """ASGI Service Tests"""
+
+    def setUp(self):
+        """Runs before each test"""
+        db.session.query(Order).delete()  # clean up the last tests
+        db.session.query(Item).delete()
+        db.session.commit()
+        # entering the client runs the lifespan, which closes the connections
+        # of the event loop when the test is over
+        self.client = TestClient(app)
+        self.client.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def tearDown(self):
+        """Runs once after each test case"""
+        self.client.__exit__(None, None, None)
+        db.session.remove()
+
+    def _create_order(self, item_count=0, **kwargs):
+        """Creates an Order with item_count Items through the ASGI service"""
+        order = OrderFactory(**kwargs).serialize()
+        order["items"] = [item.serialize() for item in ItemFactory.build_batch(item_count)]
+        resp = self.client.post(BASE_URL, json=order)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.json()
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_health(self):
+        """It should be healthy"""
+        resp = self.client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["message"], "OK")
+
+    def test_create_and_get_order(self):
+        """It should Create an Order and Read it back with its ETag"""
+        order = self._create_order(2)
+        self.assertEqual(len(order["items"]), 2)
+        resp = self.client.get(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), order)
+        self.assertEqual(resp.headers["ETag"], '"1"')
+
+        resp = self.client.get(f"{BASE_URL}/{order['id']}", headers={"If-None-Match": '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.content, b"")
+
+    def test_get_order_not_found(self):
+        """It should not Read an Order that is not found"""
+        resp = self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(resp.json()["error"], "Not Found")
+
+    def test_list_orders(self):
+        """It should List Orders by name and status one page at a time"""
+        for _ in range(3):
+            self._create_order(1, name="Page", status="Open")
+        self._create_order(name="Page", status="Cancelled")
+        self._create_order(name="Other", status="Open")
+
+        resp = self.client.get(BASE_URL, params={"name": "Page", "status": "Open", "limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first_page = resp.json()
+        self.assertEqual(len(first_page), 2)
+        next_url = resp.headers["Link"].split(";")[0].strip("<>")
+        resp = self.client.get(next_url)
+        self.assertEqual(len(resp.json()), 1)
+        self.assertNotIn("Link", resp.headers)
+        self.assertTrue(all(order["items"] for order in first_page + resp.json()))
+
+        self.assertEqual(len(self.client.get(BASE_URL).json()), 5)
+        resp = self.client.get(BASE_URL, params={"limit": 0})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_order(self):
+        """It should Update an Order only if the client has its version"""
+        order = self._create_order()
+        url = f"{BASE_URL}/{order['id']}"
+        del order["items"]
+        order["name"] = "Changed"
+        resp = self.client.put(url, json=order, headers={"If-Match": '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["name"], "Changed")
+        self.assertEqual(resp.headers["ETag"], '"2"')
+
+        resp = self.client.put(url, json=order, headers={"If-Match": '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        order["items"] = [ItemFactory(item_price=2.5).serialize()]
+        resp = self.client.put(url, json=order)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["item_count"], 1)
+        self.assertEqual(resp.json()["items_total"], 2.5)
+
+    def test_delete_order(self):
+        """It should Delete an Order"""
+        order = self._create_order()
+        resp = self.client.delete(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_items(self):
+        """It should Create, Read, Update and Delete the Items of an Order"""
+        order = self._create_order()
+        url = f"{BASE_URL}/{order['id']}/items"
+        item = ItemFactory(order_id=order["id"]).serialize()
+
+        resp = self.client.post(url, json=item)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_id = resp.json()["id"]
+        resp = self.client.post(url, json=[item, item])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(resp.json()), 2)
+        dates = db.session.query(Item.order_date_created).filter(Item.order_id == order["id"]).distinct().all()
+        self.assertEqual([str(day) for (day,) in dates], [order["date_created"]])
+
+        resp = self.client.get(url)
+        self.assertEqual(len(resp.json()), 3)
+        self.assertEqual(resp.headers["ETag"], '"3"')
+
+        item["sku"] = 12345
+        resp = self.client.put(f"{url}/{item_id}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f"{url}/{item_id}").json()["sku"], 12345)
+
+        resp = self.client.delete(f"{url}/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(f"{url}/{item_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url).headers["ETag"], '"5"')
+        order = self.client.get(f"{BASE_URL}/{order['id']}").json()
+        self.assertEqual(order["item_count"], 2)
+        self.assertEqual(order["items_total"], round(item["item_price"] * 2, 2))
+
+    def test_replace_items(self):
+        """It should Replace every Item of an Order"""
+        order = self._create_order(3)
+        url = f"{BASE_URL}/{order['id']}/items"
+        items = [ItemFactory(order_id=order["id"]).serialize() for _ in range(2)]
+        resp = self.client.put(url, json=items)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.json()), 2)
+        order = self.client.get(f"{BASE_URL}/{order['id']}").json()
+        self.assertEqual(order["item_count"], 2)
+        self.assertEqual(order["items_total"], round(sum(item["item_price"] for item in items), 2))
+        resp = self.client.put(url, json=items[0])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transitions(self):
+        """It should Ship, Fulfill and Cancel Orders in the statuses they may move from"""
+        order = self._create_order(status="Open")
+        url = f"{BASE_URL}/{order['id']}"
+        resp = self.client.put(f"{url}/ship")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["status"], "Shipped")
+        self.assertEqual(resp.headers["ETag"], '"2"')
+        resp = self.client.put(f"{url}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.client.put(f"{url}/fulfill")
+        self.assertEqual(resp.json()["status"], "Fulfilled")
+        resp = self.client.put(f"{BASE_URL}/0/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_flask_only_params(self):
+        """It should not List Orders with the parameters only the Flask service serves"""
+        resp = self.client.get(BASE_URL, params={"q": "main", "sort": "items_total"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("q, sort", resp.json()["message"])
+
+    def test_bad_requests(self):
+        """It should reject bodies that are not valid Orders"""
+        resp = self.client.post(BASE_URL, content="{}")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.client.post(BASE_URL, content="not json", headers={"Content-Type": "application/json"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(BASE_URL, json={"name": "no address"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()["message"], "Invalid Order: missing street")
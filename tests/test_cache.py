@@ -0,0 +1,117 @@
+"""
+Test cases for the LRU Cache
+
+"""
+import threading
+import unittest
+from unittest.mock import patch
+from service.common.cache import LRUCache
+
+
+######################################################################
+#  L R U   C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """Test Cases for the LRU Cache"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.cache = LRUCache(maxsize=2, ttl=10)
+
+    def test_get_and_set(self):
+        """It should return what was cached and count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, "one")
+        self.assertEqual(self.cache.get(1), "one")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.get(1)
+        self.cache.set(3, "three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(self.cache.get(3), "three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expire(self):
+        """It should not return entries older than the time to live"""
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            self.cache.set(1, "one")
+        with patch("service.common.cache.time.monotonic", return_value=109.0):
+            self.assertEqual(self.cache.get(1), "one")
+        with patch("service.common.cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate_and_clear(self):
+        """It should drop invalidated entries"""
+        self.cache.set(1, "one")
+        self.cache.set(2, "two")
+        self.cache.invalidate(1)
+        self.cache.invalidate(3)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "two")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_get_or_load(self):
+        """It should load and cache values that are missing"""
+        self.assertEqual(self.cache.get_or_load(1, lambda: "one"), "one")
+        self.assertEqual(self.cache.get_or_load(1, lambda: "uno"), "one")
+        self.assertIsNone(self.cache.get_or_load(2, lambda: None))
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+    def test_get_or_load_with_invalidation(self):
+        """It should not cache a value loaded while there was a write"""
+
+        def load():
+            self.cache.invalidate(1)
+            return "stale"
+
+        self.assertEqual(self.cache.get_or_load(1, load), "stale")
+        self.assertIsNone(self.cache.get(1))
+
+    def test_get_or_load_with_invalidation_from_another_thread(self):
+        """It should not cache a value another thread invalidated while it was loading"""
+        loading = threading.Event()
+        invalidated = threading.Event()
+        results = []
+
+        def slow_load():
+            loading.set()
+            invalidated.wait(5)
+            return "stale"
+
+        reader = threading.Thread(target=lambda: results.append(self.cache.get_or_load(1, slow_load)))
+        reader.start()
+        self.assertTrue(loading.wait(5))
+        self.cache.invalidate(1)
+        invalidated.set()
+        reader.join(5)
+        self.assertEqual(results, ["stale"])
+        self.assertIsNone(self.cache.get(1))
+        # a load that starts after the write is cached
+        self.assertEqual(self.cache.get_or_load(1, lambda: "fresh"), "fresh")
+        self.assertEqual(self.cache.get(1), "fresh")
+
+    def test_turned_off(self):
+        """It should not cache anything with a size of 0"""
+        self.cache.configure(0, 10)
+        self.cache.set(1, "one")
+        self.assertIsNone(self.cache.get(1))
+
+    def test_listener(self):
+        """It should tell the listener about every counted event"""
+        events = []
+        self.cache.listener = events.append
+        self.cache.get(1)
+        for key in (1, 2, 3):
+            self.cache.set(key, key)
+        self.cache.get(3)
+        self.assertEqual(events, ["misses", "evictions", "hits"])
@@ -2,10 +2,14 @@
 CLI Command Extensions for Flask
 """
 import os
+from datetime import date
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service import app
+from service.common.cli_commands import (
+    db_create, db_migrate, db_check_totals, db_partitions, seed_database, export_orders, import_orders,
+)
 
 
 class TestFlaskCLI(TestCase):
@@ -14,10 +18,136 @@ class TestFlaskCLI(TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
+    @patch('service.common.cli_commands.migrations')
     @patch('service.common.cli_commands.db')
-    def test_db_create(self, db_mock):
+    def test_db_create(self, db_mock, migrations_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+            migrations_mock.stamp.assert_called_once_with(db_mock.engine)
+
+    @patch('service.common.cli_commands.migrations')
+    @patch('service.common.cli_commands.db')
+    def test_db_migrate(self, db_mock, migrations_mock):
+        """It should call the db-migrate command"""
+        migrations_mock.migrate.return_value = [1, 2]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_migrate)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Applied migrations 1, 2", result.output)
+            migrations_mock.migrate.assert_called_once_with(db_mock.engine, "5s")
+
+            migrations_mock.migrate.return_value = []
+            result = self.runner.invoke(db_migrate)
+            self.assertIn("up to date", result.output)
+
+    @patch('service.common.cli_commands.Order')
+    def test_db_check_totals(self, order_mock):
+        """It should report and repair the Orders whose totals are off"""
+        order_mock.find_total_drift.return_value = [
+            {"id": 7, "item_count": 1, "counted_item_count": 2, "items_total": 1.0, "counted_items_total": 3.0}
+        ]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_check_totals)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Order 7: item_count 1 counted 2", result.output)
+            order_mock.repair_totals.assert_not_called()
+
+            result = self.runner.invoke(db_check_totals, ["--repair"])
+            self.assertIn("Repaired 1 Orders", result.output)
+            order_mock.repair_totals.assert_called_once_with([7])
+
+            order_mock.find_total_drift.return_value = []
+            result = self.runner.invoke(db_check_totals)
+            self.assertIn("match", result.output)
+
+    @patch('service.common.cli_commands.partitions')
+    @patch('service.common.cli_commands.db')
+    def test_db_partitions(self, db_mock, partitions_mock):
+        """It should create and detach the month partitions"""
+        partitions_mock.create_partitions.return_value = ["order_2023_05", "item_2023_05"]
+        partitions_mock.detach_partitions.return_value = []
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            with patch.dict(app.config, {"PARTITION_ORDERS": False}):
+                result = self.runner.invoke(db_partitions)
+                self.assertNotEqual(result.exit_code, 0)
+                self.assertIn("PARTITION_ORDERS is not set", result.output)
+            with patch.dict(app.config, {"PARTITION_ORDERS": True, "PARTITION_MONTHS_AHEAD": 2}):
+                result = self.runner.invoke(db_partitions, ["--detach-before", "2022-01-01"])
+                self.assertEqual(result.exit_code, 0)
+                self.assertIn("Created partitions: order_2023_05, item_2023_05", result.output)
+                self.assertIn("Detached partitions: none", result.output)
+        connection = db_mock.engine.begin.return_value.__enter__.return_value
+        self.assertEqual(partitions_mock.create_partitions.call_args.args[2], 3)
+        partitions_mock.detach_partitions.assert_called_once_with(connection, date(2022, 1, 1))
+
+    @patch('service.common.cli_commands.seed')
+    @patch('service.common.cli_commands.db')
+    def test_seed(self, db_mock, seed_mock):
+        """It should load the chunks of synthetic Orders and report the rows per second"""
+        db_mock.engine.dialect.name = "sqlite"
+        seed_mock.chunks.return_value = [(1, 10, 42), (11, 5, 43)]
+        seed_mock.load_chunk.side_effect = [(10, 30), (5, 12)]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            with patch.dict(app.config, {"PARTITION_ORDERS": False}):
+                result = self.runner.invoke(seed_database, ["--orders", "15", "--chunk-size", "10", "--workers", "4"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("loading with 1 worker", result.output)
+        self.assertIn("Seeded 10/15 Orders", result.output)
+        self.assertIn("Seeded 15 Orders and 42 Items", result.output)
+        seed_mock.chunks.assert_called_once_with(seed_mock.reserve_ids.return_value, 15, 10, 42)
+        self.assertEqual(seed_mock.load_chunk.call_args.args[1:3], (11, 5))
+        seed_mock.analyze.assert_called_once_with(db_mock.engine)
+
+    @patch('service.common.cli_commands.export')
+    @patch('service.common.cli_commands.db')
+    def test_export(self, db_mock, export_mock):
+        """It should write the export in shards and report where to continue from"""
+        connection = db_mock.engine.connect.return_value.__enter__.return_value
+        connection.dialect.name = "sqlite"
+        export_mock.shard_bounds.return_value = [(0, 10), (10, 15)]
+        export_mock.shard_path.side_effect = lambda path, index: f"{path}-{index}"
+        export_mock.export_range.side_effect = [(10, 25, 10), (5, 9, 15)]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            with self.runner.isolated_filesystem():
+                result = self.runner.invoke(export_orders, ["--shard-size", "10", "--workers", "2", "--output", "o"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertIn("exporting with 1 worker", result.output)
+                self.assertIn("Wrote o-1: 5 Orders through id 15", result.output)
+                self.assertIn("Exported 15 Orders in 34 rows", result.output)
+                self.assertIn("--after-id 15", result.output)
+                export_mock.begin_snapshot.assert_called_once_with(connection)
+
+                with open("o-0", "w", encoding="utf-8"):
+                    pass
+                result = self.runner.invoke(export_orders, ["--shard-size", "10", "--output", "o"])
+                self.assertNotEqual(result.exit_code, 0)
+                self.assertIn("o-0 already exists", result.output)
+
+    @patch('service.common.cli_commands.importer')
+    @patch('service.common.cli_commands.db')
+    def test_import(self, db_mock, importer_mock):
+        """It should stage, check and merge a file and report the rejected rows"""
+        importer_mock.guess_format.return_value = "csv"
+        importer_mock.stage.return_value = iter([50000, 60000])
+        importer_mock.validate.return_value = 2
+        importer_mock.merge.return_value = iter([(100, 900), (50, 400)])
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            with self.runner.isolated_filesystem():
+                with open("orders.csv", "w", encoding="utf-8"):
+                    pass
+                result = self.runner.invoke(import_orders, ["orders.csv", "--errors", "bad.csv"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertIn("Staged 60000 rows", result.output)
+                self.assertIn("Rejected 2 rows, written to bad.csv", result.output)
+                self.assertIn("Imported 150 Orders and 1300 Items from 60000 rows", result.output)
+                connection = db_mock.engine.connect.return_value.__enter__.return_value
+                importer_mock.write_errors.assert_called_once_with(connection, "bad.csv")
+                importer_mock.finish.assert_called_once_with(connection)
+
+                importer_mock.guess_format.return_value = None
+                result = self.runner.invoke(import_orders, ["orders.csv"])
+                self.assertNotEqual(result.exit_code, 0)
+                self.assertIn("use --format", result.output)
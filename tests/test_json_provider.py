@@ -0,0 +1,66 @@
+"""
+Test cases for the JSON Provider
+
+"""
+import uuid
+import decimal
+import unittest
+from datetime import date
+from unittest.mock import patch
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from service.common import json_provider
+from service.common.json_provider import OrjsonProvider, init_json
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+class TestJsonProvider(unittest.TestCase):
+    """Test Cases for the JSON Provider"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.app = Flask(__name__)
+        self.app.config["JSON_PROVIDER"] = "orjson"
+        init_json(self.app)
+
+    def test_provider(self):
+        """It should encode and decode with orjson"""
+        self.assertIsInstance(self.app.json, OrjsonProvider)
+        data = {"id": 1, "name": "Ünïcode", "items": [{"item_price": 1.5}]}
+        self.assertEqual(self.app.json.loads(self.app.json.dumps(data)), data)
+        self.assertEqual(self.app.json.loads(b'{"id": 1}'), {"id": 1})
+        self.assertRaises(ValueError, self.app.json.loads, "not json")
+
+    def test_native_types(self):
+        """It should encode dates, UUIDs and Decimals"""
+        key = uuid.uuid4()
+        data = {"date": date(2023, 4, 1), "uuid": key, "price": decimal.Decimal("1.10")}
+        self.assertEqual(
+            self.app.json.loads(self.app.json.dumps(data)),
+            {"date": "2023-04-01", "uuid": str(key), "price": "1.10"},
+        )
+        self.assertRaises(TypeError, self.app.json.dumps, object())
+
+    def test_response(self):
+        """It should build a JSON response from the bytes orjson returns"""
+        with self.app.app_context():
+            resp = self.app.json.response([{"id": 1}, {"id": 2}])
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.get_data(), b'[{"id":1},{"id":2}]')
+
+        self.app.debug = True
+        with self.app.app_context():
+            resp = self.app.json.response(id=1)
+        self.assertEqual(resp.get_data(), b'{\n  "id": 1\n}')
+
+    def test_fallback(self):
+        """It should keep the standard library provider without orjson"""
+        with patch.object(json_provider, "orjson", None):
+            init_json(self.app)
+        self.assertIsInstance(self.app.json, DefaultJSONProvider)
+
+        self.app.config["JSON_PROVIDER"] = "default"
+        init_json(self.app)
+        self.assertIsInstance(self.app.json, DefaultJSONProvider)
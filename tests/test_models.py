@@ -5,8 +5,11 @@ Test cases for Order Model
 import logging
 import unittest
 import os
+from unittest.mock import patch
+from datetime import date
+from sqlalchemy import inspect, text
 from service import app
-from service.models import Order, Item, DataValidationError, db
+from service.models import Order, Item, DataValidationError, db, encode_cursor
 from tests.factories import OrderFactory, ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -84,6 +87,16 @@ class TestOrder(unittest.TestCase):
         orders = Order.all()
         self.assertEqual(len(orders), 1)
 
+    def test_create_all_orders(self):
+        """It should Create many Orders and their Items in one transaction"""
+        orders = OrderFactory.create_batch(4)
+        for order in orders:
+            order.items.append(ItemFactory(order=order))
+        Order.create_all(orders)
+        self.assertTrue(all(order.id is not None for order in orders))
+        self.assertEqual(len(Order.all()), 4)
+        self.assertEqual(len(Item.all()), 4)
+
     def test_read_order(self):
         """It should Read an order"""
         order = OrderFactory()
@@ -126,6 +139,35 @@ class TestOrder(unittest.TestCase):
         order = Order.find(order.id)
         self.assertEqual(order.name, "Sienna consedine")
 
+    def test_order_version(self):
+        """It should bump the version of an Order on every write"""
+        order = OrderFactory()
+        order.create()
+        self.assertEqual(order.version, 1)
+        self.assertEqual(Order.find_version(order.id), 1)
+
+        order.name = "New Name"
+        order.update()
+        self.assertEqual(Order.find_version(order.id), 2)
+
+        # writes to the items count as writes to the order
+        order.items.append(ItemFactory(order=order))
+        order.update()
+        self.assertEqual(Order.find_version(order.id), 3)
+        item = Item.find(order.items[0].id)
+        item.sku = 42
+        item.update()
+        self.assertEqual(Order.find_version(order.id), 4)
+        order.add_items([ItemFactory()])
+        self.assertEqual(Order.find_version(order.id), 5)
+        order.replace_items([])
+        self.assertEqual(Order.find_version(order.id), 6)
+
+        # an update that changes nothing is not a new version
+        order.update()
+        self.assertEqual(Order.find_version(order.id), 6)
+        self.assertIsNone(Order.find_version(0))
+
     def test_delete_an_order(self):
         """It should Delete an order from the database"""
         orders = Order.all()
@@ -157,6 +199,44 @@ class TestOrder(unittest.TestCase):
         orders = Order.all()
         self.assertEqual(order.status, "Cancelled")
 
+    def test_transition_order(self):
+        """It should move an Order between statuses it is allowed to"""
+        order = OrderFactory(status="Open")
+        order.create()
+        self.assertEqual(Order.transition(order.id, "Shipped"), 2)
+        self.assertIsNone(Order.transition(order.id, "Cancelled"))
+        self.assertEqual(Order.transition(order.id, "Fulfilled"), 3)
+        order = Order.find(order.id)
+        self.assertEqual(order.status, "Fulfilled")
+        self.assertEqual(order.version, 3)
+        self.assertIsNone(Order.transition(0, "Shipped"))
+
+    def test_transition_and_read(self):
+        """It should move an Order and return it as the UPDATE left it"""
+        order = OrderFactory(status="Open", items=[ItemFactory(id=None)])
+        order.create()
+        version, found = Order.transition_and_read(order.id, "Shipped")
+        self.assertEqual((version, found["status"]), (2, "Shipped"))
+        self.assertEqual(len(found["items"]), 1)
+        self.assertIsNone(Order.transition_and_read(order.id, "Cancelled"))
+        self.assertIsNone(Order.transition_and_read(0, "Shipped"))
+        # databases without UPDATE ... RETURNING read the Order again instead
+        with patch.object(db.engine.dialect, "update_returning", False):
+            version, found = Order.transition_and_read(order.id, "Fulfilled")
+        self.assertEqual((version, found["status"]), (3, "Fulfilled"))
+
+    def test_transition_all_orders(self):
+        """It should move only the matching Orders that may make the transition"""
+        orders = [OrderFactory(status=order_status) for order_status in ("Open", "Open", "Shipped", "Cancelled")]
+        for order in orders:
+            order.create()
+        ids = [order.id for order in orders]
+        moved = Order.transition_all("Shipped", Order.id_in(ids[1:]))
+        self.assertEqual(moved, [ids[1]])
+        self.assertEqual(Order.find(ids[0]).status, "Open")
+        self.assertEqual(Order.find(ids[1]).version, 2)
+        self.assertEqual(Order.find_statuses(ids[2:] + [0]), {ids[2]: "Shipped", ids[3]: "Cancelled"})
+
     def test_list_all_orders(self):
         """It should List all orders in the database"""
         orders = Order.all()
@@ -177,6 +257,73 @@ class TestOrder(unittest.TestCase):
         self.assertEqual(same_order.id, order.id)
         self.assertEqual(same_order.name, order.name)
 
+    def test_statistics(self):
+        """It should count Orders and total them by status and state"""
+        for order_status, state, shipping, prices, created in [
+            ("Open", "NY", 5.0, [1.5, 2.5], date(2023, 1, 10)),
+            ("Open", "NJ", 2.5, [], date(2023, 2, 10)),
+            ("Shipped", "NY", 1.25, [10.0], date(2023, 3, 10)),
+        ]:
+            items = [ItemFactory(item_price=price) for price in prices]
+            OrderFactory(
+                status=order_status, state=state, shipping_price=shipping, date_created=created, items=items
+            ).create()
+
+        stats = Order.statistics()
+        self.assertEqual(
+            {name: stats[name] for name in ("count", "item_count", "items_total", "shipping_total")},
+            {"count": 3, "item_count": 3, "items_total": 14.0, "shipping_total": 8.75},
+        )
+        self.assertEqual(
+            stats["by_status"]["Open"], {"count": 2, "item_count": 2, "items_total": 4.0, "shipping_total": 7.5}
+        )
+        self.assertEqual(
+            stats["by_state"]["NY"], {"count": 2, "item_count": 3, "items_total": 14.0, "shipping_total": 6.25}
+        )
+        self.assertNotIn("Cancelled", stats["by_status"])
+
+        stats = Order.statistics(created_after=date(2023, 2, 10), created_before=date(2023, 2, 10))
+        self.assertEqual(stats["count"], 1)
+        self.assertEqual(list(stats["by_state"]), ["NJ"])
+
+    def test_paginate_orders(self):
+        """It should page through Orders with a cursor"""
+        for order in OrderFactory.create_batch(5):
+            order.create()
+        ids = sorted(order.id for order in Order.all())
+        page, cursor = Order.paginate(limit=3)
+        self.assertEqual([order.id for order in page], ids[:3])
+        self.assertIsNotNone(cursor)
+        page, cursor = Order.paginate(limit=3, cursor=cursor)
+        self.assertEqual([order.id for order in page], ids[3:])
+        self.assertIsNone(cursor)
+
+    def test_paginate_filtered_orders(self):
+        """It should page through a filtered query of Orders"""
+        for order in OrderFactory.create_batch(3, name="Paged"):
+            order.create()
+        OrderFactory(name="Other").create()
+        page, cursor = Order.paginate(Order.find_by_name("Paged"), limit=2)
+        self.assertEqual(len(page), 2)
+        page, cursor = Order.paginate(Order.find_by_name("Paged"), limit=2, cursor=cursor)
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page[0].name, "Paged")
+        self.assertIsNone(cursor)
+
+    def test_paginate_bad_cursor(self):
+        """It should not page with a bad cursor"""
+        self.assertRaises(DataValidationError, Order.paginate, limit=1, cursor="bad")
+        self.assertRaises(DataValidationError, Order.paginate, limit=1, cursor=encode_cursor("1"))
+
+    def test_stream_orders(self):
+        """It should Stream every Order in batches"""
+        for order in OrderFactory.create_batch(5):
+            order.create()
+        ids = sorted(order.id for order in Order.all())
+        self.assertEqual([order.id for order in Order.stream(batch_size=2)], ids)
+        shipped = Order.find_by_status("Shipped")
+        self.assertEqual(len(list(Order.stream(shipped, batch_size=2))), shipped.count())
+
     def test_serialize_an_order(self):
         """It should Serialize an order"""
         order = OrderFactory()
@@ -197,6 +344,28 @@ class TestOrder(unittest.TestCase):
         self.assertEqual(items[0]["order_id"], item.order_id)
         self.assertEqual(items[0]["sku"], item.sku)
 
+    def test_serialize_order_fields(self):
+        """It should Serialize only the fields asked for"""
+        order = OrderFactory()
+        order.items.append(ItemFactory())
+        self.assertEqual(
+            order.serialize(["id", "date_created", "items"]),
+            {"id": order.id, "date_created": str(order.date_created), "items": [order.items[0].serialize()]},
+        )
+        self.assertEqual(list(order.serialize()), list(Order.FIELDS))
+
+    def test_load_fields(self):
+        """It should read only the columns of the fields asked for"""
+        order = OrderFactory()
+        order.create()
+        db.session.expunge_all()
+        found = Order.query.options(Order.load_fields(["name", "items"])).all()[0]
+        state = inspect(found)
+        self.assertNotIn("street", state.dict)
+        self.assertIn("name", state.dict)
+        self.assertIn("version", state.dict)
+        self.assertNotIn("items", state.dict)
+
     def test_deserialize_an_order(self):
         """It should Deserialize an order"""
         order = OrderFactory()
@@ -222,6 +391,12 @@ class TestOrder(unittest.TestCase):
         order = Order()
         self.assertRaises(DataValidationError, order.deserialize, [])
 
+    def test_deserialize_with_bad_status(self):
+        """It should not Deserialize an order with an unknown status"""
+        data = OrderFactory().serialize()
+        data["status"] = "Lost"
+        self.assertRaises(DataValidationError, Order().deserialize, data)
+
     def test_deserialize_item_key_error(self):
         """It should not Deserialize an item with a KeyError"""
         item = Item()
@@ -232,6 +407,18 @@ class TestOrder(unittest.TestCase):
         item = Item()
         self.assertRaises(DataValidationError, item.deserialize, [])
 
+    def test_deserialize_item_numbers(self):
+        """It should convert the price and sku of an Item to numbers"""
+        item = Item().deserialize({"order_id": 1, "item_price": "12", "sku": "345"})
+        self.assertEqual(item.item_price, 12.0)
+        self.assertEqual(item.sku, 345)
+        for price in ("abc", True, [1], "nan", "1e400"):
+            data = {"order_id": 1, "item_price": price, "sku": 1}
+            self.assertRaises(DataValidationError, Item().deserialize, data)
+        for sku in ("abc", 1.5, 2**31, False):
+            data = {"order_id": 1, "item_price": 1.0, "sku": sku}
+            self.assertRaises(DataValidationError, Item().deserialize, data)
+
     def test_add_order_item(self):
         """It should Create an order with an item and add it to the database"""
         orders = Order.all()
@@ -256,6 +443,31 @@ class TestOrder(unittest.TestCase):
         self.assertEqual(len(new_order.items), 2)
         self.assertEqual(new_order.items[1].item_price, item2.item_price)
 
+    def test_add_many_order_items(self):
+        """It should Add many items to an order at once"""
+        order = OrderFactory()
+        order.create()
+        items = order.add_items(ItemFactory.create_batch(3))
+        self.assertEqual(len(items), 3)
+        self.assertTrue(all(item["id"] is not None for item in items))
+        order = Order.find(order.id)
+        self.assertEqual(len(order.items), 3)
+        self.assertEqual(order.add_items([]), [])
+
+    def test_replace_order_items(self):
+        """It should Replace all of the items of an order"""
+        order = OrderFactory()
+        order.items = [ItemFactory(order=order), ItemFactory(order=order)]
+        order.create()
+        other = OrderFactory()
+        other.items = [ItemFactory(order=other)]
+        other.create()
+
+        items = order.replace_items(ItemFactory.create_batch(3))
+        order = Order.find(order.id)
+        self.assertEqual(sorted(item.id for item in order.items), sorted(item["id"] for item in items))
+        self.assertEqual(len(Order.find(other.id).items), 1)
+
     def test_update_order_item(self):
         """It should Update an orders item"""
         orders = Order.all()
@@ -305,3 +517,204 @@ class TestOrder(unittest.TestCase):
         # Fetch it back again
         order = Order.find(order.id)
         self.assertEqual(len(order.items), 0)
+
+    def test_search(self):
+        """It should Search Orders by name and address, best matches first"""
+        for name, city in (("Jane Smith", "Albany"), ("Ann Lee", "Smithtown"), ("Bob Ray", "Austin")):
+            OrderFactory(name=name, city=city, street="1 Main St", postal_code="10001", status="Open").create()
+        query, rank = Order.search("SMITH")
+        orders = query.order_by(*Order.sort_order(rank, True)).all()
+        self.assertEqual(sorted(order.name for order in orders), ["Ann Lee", "Jane Smith"])
+        self.assertGreaterEqual(orders[0].search_rank, orders[1].search_rank)
+        query, _ = Order.search("smith albany", Order.find_by_status("Open"))
+        self.assertEqual([order.name for order in query], ["Jane Smith"])
+
+        # the index follows changes to the Orders
+        order = Order.find_by_name("Bob Ray").one()
+        order.name = "Bob Smith"
+        order.update()
+        query, _ = Order.search("smith")
+        self.assertEqual(query.count(), 3)
+        order.delete()
+        query, _ = Order.search("smith")
+        self.assertEqual(query.count(), 2)
+
+    def test_search_short_terms(self):
+        """It should not Search for terms shorter than a trigram"""
+        self.assertRaises(DataValidationError, Order.search, "a b")
+        query, _ = Order.search("a lee")
+        self.assertEqual(query.all(), [])
+
+    def test_item_order_dates(self):
+        """It should copy the date_created of an Order onto its Items"""
+        order = Order(name="Dated", street="1 Main St", city="Town", state="NY", postal_code="10001",
+                      shipping_price=5, status="Open", items=[ItemFactory(id=None)])
+        order.create()
+        self.assertEqual(order.date_created, date.today())
+        self.assertEqual(order.items[0].order_date_created, date.today())
+
+        older = OrderFactory(date_created=date(2022, 3, 4))
+        older.items = []
+        older.create()
+        older.add_items([ItemFactory()])
+        item = order.items[0]
+        item.order_id = older.id
+        db.session.commit()
+        dates = db.session.query(Item.order_date_created).filter(Item.order_id == older.id).all()
+        self.assertEqual(dates, [(date(2022, 3, 4),), (date(2022, 3, 4),)])
+
+    def test_created_between(self):
+        """It should find Orders created in a range of dates"""
+        for day in (1, 10, 20):
+            OrderFactory(date_created=date(2023, 4, day)).create()
+        query = Order.query.filter(*Order.created_between(date(2023, 4, 10), None))
+        self.assertEqual(sorted(order.date_created.day for order in query), [10, 20])
+        query = Order.query.filter(*Order.created_between(date(2023, 4, 1), date(2023, 4, 10)))
+        self.assertEqual(sorted(order.date_created.day for order in query), [1, 10])
+
+    ######################################################################
+    #  O R D E R   T O T A L S   T E S T   C A S E S
+    ######################################################################
+
+    def assert_totals(self, order_id, item_count, items_total):
+        """Checks the stored totals of an Order"""
+        db.session.expire_all()
+        order = Order.find(order_id)
+        self.assertEqual(order.item_count, item_count)
+        self.assertAlmostEqual(order.items_total, items_total)
+
+    def test_totals_on_create(self):
+        """It should count the Items of a new Order"""
+        order = OrderFactory()
+        order.items = [ItemFactory(item_price=2.5), ItemFactory(item_price=4.0)]
+        order.create()
+        self.assert_totals(order.id, 2, 6.5)
+
+        orders = OrderFactory.build_batch(2)
+        orders[0].items = [ItemFactory(item_price=1.0, id=None)]
+        orders[1].items = []
+        first, second = Order.create_all(orders)
+        self.assert_totals(first, 1, 1.0)
+        self.assert_totals(second, 0, 0.0)
+
+    def test_totals_on_item_changes(self):
+        """It should keep the totals as Items are added, changed, moved and deleted"""
+        order = OrderFactory()
+        order.items = [ItemFactory(item_price=2.5)]
+        order.create()
+        other = OrderFactory()
+        other.items = []
+        other.create()
+
+        order = Order.find(order.id)
+        order.items.append(ItemFactory(item_price=4.0, id=None))
+        order.update()
+        self.assert_totals(order.id, 2, 6.5)
+
+        item = Order.find(order.id).items[0]
+        item.item_price = 3.0
+        db.session.commit()
+        self.assert_totals(order.id, 2, 7.0)
+
+        item = Order.find(order.id).items[0]
+        item.order_id = other.id
+        db.session.commit()
+        self.assert_totals(order.id, 1, 4.0)
+        self.assert_totals(other.id, 1, 3.0)
+
+        Order.find(order.id).items[0].delete()
+        self.assert_totals(order.id, 0, 0.0)
+        self.assert_totals(other.id, 1, 3.0)
+
+    def test_totals_on_bulk_items(self):
+        """It should keep the totals when Items are added or replaced in bulk"""
+        order = OrderFactory()
+        order.items = [ItemFactory(item_price=1.0)]
+        order.create()
+        order.add_items([ItemFactory(item_price=2.0), ItemFactory(item_price=3.0)])
+        self.assert_totals(order.id, 3, 6.0)
+        order = Order.find(order.id)
+        order.replace_items([ItemFactory(item_price=5.0)])
+        self.assert_totals(order.id, 1, 5.0)
+
+    def test_total_drift(self):
+        """It should find and repair Orders whose totals are off"""
+        order = OrderFactory()
+        order.items = [ItemFactory(item_price=2.5), ItemFactory(item_price=4.0)]
+        order.create()
+        good = OrderFactory()
+        good.items = []
+        good.create()
+        self.assertEqual(Order.find_total_drift(), [])
+
+        db.session.execute(text('UPDATE "order" SET item_count = 5, items_total = 1'))
+        db.session.commit()
+        drift = Order.find_total_drift()
+        self.assertEqual([row["id"] for row in drift], [order.id, good.id])
+        self.assertEqual(drift[0]["counted_item_count"], 2)
+        self.assertEqual(drift[0]["counted_items_total"], 6.5)
+
+        Order.repair_totals([row["id"] for row in drift], chunk_size=1)
+        self.assertEqual(Order.find_total_drift(), [])
+        self.assert_totals(order.id, 2, 6.5)
+        self.assertEqual(Order.find(good.id).version, 2)
+
+    def test_sort_by_total(self):
+        """It should page through Orders sorted by their total"""
+        for price in (3.0, 1.0, 2.0, 2.0):
+            order = OrderFactory()
+            order.items = [ItemFactory(item_price=price)]
+            order.create()
+        query = Order.query.filter(*Order.total_between(1.5, None))
+        page, cursor = Order.paginate(query, 2, sort=Order.items_total, descending=True)
+        self.assertEqual([order.items_total for order in page], [3.0, 2.0])
+        page, cursor = Order.paginate(query, 2, cursor, sort=Order.items_total, descending=True)
+        self.assertEqual([order.items_total for order in page], [2.0])
+        self.assertIsNone(cursor)
+        totals = [order.items_total for order in Order.stream(sort=Order.items_total, batch_size=1)]
+        self.assertEqual(totals, [1.0, 2.0, 2.0, 3.0])
+
+    ######################################################################
+    #  I N D E X   T E S T   C A S E S
+    ######################################################################
+
+    def test_name_and_status_query_uses_index(self):
+        """It should use an index to find Orders by name and status"""
+        plan = explain(Order.find_by_name_and_status("Jane Doe", "Open"))
+        self.assertIn("ix_order_name_status", plan)
+        plan = explain(Order.find_by_name("Jane Doe"))
+        self.assertIn("ix_order_name_status", plan)
+
+    def test_open_orders_query_uses_index(self):
+        """It should use the partial index to page through Open Orders"""
+        plan = explain(Order.find_by_status("Open").order_by(Order.id).limit(10))
+        self.assertIn("ix_order_status_open", plan)
+
+    def test_search_uses_index(self):
+        """It should use the search index to Search Orders"""
+        query, _ = Order.search("smith")
+        self.assertIn("order_search", explain(query))
+
+    def test_date_query_uses_index(self):
+        """It should use an index to find Orders created in a range of dates"""
+        plan = explain(Order.query.filter(*Order.created_between(date(2023, 4, 1), date(2023, 4, 30))))
+        self.assertIn("ix_order_date_created", plan)
+
+    def test_order_items_query_uses_index(self):
+        """It should use an index to load the Items of Orders"""
+        plan = explain(Item.query.filter(Item.order_id.in_([1, 2, 3])))
+        self.assertIn("ix_item_order_id", plan)
+
+
+def explain(query):
+    """Returns the plan the database picks for a query as a string"""
+    statement = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    with db.engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # the test tables are tiny so a sequential scan always looks
+            # cheapest, take it off the table to see which index is picked
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+            rows = connection.exec_driver_sql(f"EXPLAIN {statement}")
+        else:
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}")
+        return "\n".join(" ".join(str(value) for value in row) for row in rows)
@@ -0,0 +1,67 @@
+"""
+Test cases for the Order Partitions
+
+The partitions only exist on Postgres, these tests check the statements
+that manage them against a mock connection
+"""
+from datetime import date
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service import partitions
+
+
+######################################################################
+#  P A R T I T I O N   T E S T   C A S E S
+######################################################################
+class TestPartitions(TestCase):
+    """Test Cases for the Order Partitions"""
+
+    def test_months(self):
+        """It should list the months starting with a date"""
+        self.assertEqual(
+            partitions.months(date(2022, 11, 15), 3),
+            [date(2022, 11, 1), date(2022, 12, 1), date(2023, 1, 1)],
+        )
+        self.assertEqual(partitions.months(date(2022, 11, 15), 0), [])
+        self.assertEqual(partitions.next_month(date(2023, 12, 31)), date(2024, 1, 1))
+
+    def test_partition_names(self):
+        """It should name a partition after its month and read the month back"""
+        self.assertEqual(partitions.partition_name("order", date(2023, 4, 1)), "order_2023_04")
+        self.assertEqual(partitions.partition_month("item_2023_04"), date(2023, 4, 1))
+        self.assertIsNone(partitions.partition_month("order_default"))
+
+    @patch("service.partitions.list_partitions")
+    def test_create_partitions(self, list_mock):
+        """It should create the missing month partitions of both tables"""
+        list_mock.side_effect = lambda connection, table: ["order_2023_04"] if table == "order" else []
+        connection = MagicMock()
+        created = partitions.create_partitions(connection, date(2023, 4, 20), 2)
+        self.assertEqual(created, ["item_2023_04", "order_2023_05", "item_2023_05"])
+        statement = str(connection.execute.call_args_list[0].args[0])
+        self.assertEqual(
+            statement,
+            "CREATE TABLE IF NOT EXISTS \"item_2023_04\" PARTITION OF \"item\" "
+            "FOR VALUES FROM ('2023-04-01') TO ('2023-05-01')",
+        )
+
+    @patch("service.partitions.foreign_keys")
+    @patch("service.partitions.list_partitions")
+    def test_detach_partitions(self, list_mock, keys_mock):
+        """It should detach the Items and then the Orders of the old months"""
+        list_mock.side_effect = lambda connection, table: [
+            f"{table}_2022_12", f"{table}_2023_01", f"{table}_2023_02", f"{table}_default"
+        ]
+        keys_mock.return_value = ["item_order_id_order_date_created_fkey"]
+        connection = MagicMock()
+        detached = partitions.detach_partitions(connection, date(2023, 1, 31))
+        self.assertEqual(detached, ["item_2022_12", "order_2022_12"])
+        statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+        self.assertEqual(
+            statements,
+            [
+                'ALTER TABLE "item" DETACH PARTITION "item_2022_12"',
+                'ALTER TABLE "item_2022_12" DROP CONSTRAINT "item_order_id_order_date_created_fkey"',
+                'ALTER TABLE "order" DETACH PARTITION "order_2022_12"',
+            ],
+        )
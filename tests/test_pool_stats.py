@@ -0,0 +1,75 @@
+"""
+Test cases for the Connection Pool Statistics
+
+"""
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.pool_stats import InstrumentedQueuePool, pool_stats
+
+
+######################################################################
+#  P O O L   S T A T S   T E S T   C A S E S
+######################################################################
+class TestPoolStats(unittest.TestCase):
+    """Test Cases for the Connection Pool Statistics"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.engine = create_engine(
+            "sqlite:////tmp/test_pool_stats.db",
+            poolclass=InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=1,
+            pool_timeout=0.05,
+        )
+        pool_stats.reset()
+        pool_stats.instrument(self.engine)
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.engine.dispose()
+
+    def test_count_checkouts(self):
+        """It should count connections checked out and in"""
+        with self.engine.connect():
+            stats = pool_stats.stats(self.engine.pool)
+            self.assertEqual(stats["in_use"], 1)
+            self.assertEqual(stats["checked_out"], 1)
+        stats = pool_stats.stats(self.engine.pool)
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["peak_in_use"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_total"], 0)
+        self.assertEqual(stats["size"], 1)
+
+    def test_instrument_once(self):
+        """It should not count a checkout twice when instrumented twice"""
+        pool_stats.instrument(self.engine)
+        with self.engine.connect():
+            pass
+        self.assertEqual(pool_stats.stats()["checkouts"], 1)
+
+    def test_count_overflow_and_timeouts(self):
+        """It should count overflow connections and checkouts that time out"""
+        with self.engine.connect(), self.engine.connect():
+            stats = pool_stats.stats(self.engine.pool)
+            self.assertEqual(stats["overflow_checkouts"], 1)
+            self.assertEqual(stats["overflow"], 1)
+            self.assertRaises(PoolTimeoutError, self.engine.connect)
+        stats = pool_stats.stats(self.engine.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["peak_in_use"], 2)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.05)
+
+    def test_listener(self):
+        """It should tell the listener about every pool event"""
+        events = []
+        listener = pool_stats.listener
+        pool_stats.listener = lambda event, *args: events.append(event)
+        try:
+            with self.engine.connect(), self.engine.connect():
+                pass
+        finally:
+            pool_stats.listener = listener
+        self.assertEqual(events, ["wait", "checkout", "wait", "overflow", "checkout", "checkin", "checkin"])
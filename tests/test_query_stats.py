@@ -0,0 +1,23 @@
+"""
+Test cases for the Query Statistics
+
+"""
+import unittest
+from service.common.query_stats import parameters_shape
+
+
+######################################################################
+#  Q U E R Y   S T A T S   T E S T   C A S E S
+######################################################################
+class TestQueryStats(unittest.TestCase):
+    """Test Cases for the Query Statistics"""
+
+    def test_parameters_shape(self):
+        """It should describe statement parameters without their values"""
+        self.assertEqual(parameters_shape(("secret", 42)), 2)
+        self.assertEqual(parameters_shape(None), 0)
+        self.assertEqual(parameters_shape({"sku": 1, "order_id": 2}), ["order_id", "sku"])
+        self.assertEqual(
+            parameters_shape([{"sku": 1}, {"sku": 2}], executemany=True), {"rows": 2, "row": ["sku"]}
+        )
+        self.assertEqual(parameters_shape([], executemany=True), {"rows": 0, "row": None})
@@ -6,12 +6,18 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+from datetime import date
+import json
 import logging
 from unittest import TestCase
 from itertools import cycle
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
 from tests.factories import ItemFactory, OrderFactory
 from service.common import status  # HTTP Status Codes
-from service.models import db, Order, init_db
+from service.models import db, Order, Item, encode_cursor, init_db, order_cache
 from service.routes import app
 
 
@@ -21,6 +27,12 @@ DATABASE_URI = os.getenv(
 
 BASE_URL = "/orders"
 
+
+def metric_sample(name, **labels):
+    """Returns the value of a Prometheus sample or 0 if it was not recorded"""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
@@ -45,7 +57,9 @@ class TestOrderService(TestCase):
     def setUp(self):
         """Runs before each test"""
         db.session.query(Order).delete()  # clean up the last tests
+        db.session.query(Item).delete()  # clean up the last tests
         db.session.commit()
+        order_cache.clear()
 
         self.client = app.test_client()
 
@@ -102,6 +116,107 @@ class TestOrderService(TestCase):
         orders = Order.all()
         self.assertEqual(len(orders), 0)
 
+    def test_create_order_batch(self):
+        """It should Create many Orders with their Items in one request"""
+        orders = []
+        for order in OrderFactory.create_batch(3):
+            data = order.serialize()
+            data["items"] = [item.serialize() for item in ItemFactory.create_batch(2)]
+            orders.append(data)
+        resp = self.client.post(f"{BASE_URL}/batch", json=orders)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(data["errors"], [])
+        self.assertEqual(len(data["ids"]), 3)
+        for order_id, order in zip(data["ids"], orders):
+            found = Order.find(order_id)
+            self.assertEqual(found.name, order["name"])
+            self.assertEqual(len(found.items), 2)
+
+    def test_create_order_leaves_other_orders_alone(self):
+        """It should not bump the version of the Order an Item's order_id names"""
+        other = self._create_orders(1)[0]
+        data = OrderFactory().serialize()
+        data["items"] = [dict(ItemFactory().serialize(), order_id=other.id) for _ in range(2)]
+        resp, statements = self._capture_queries(BASE_URL, expected=status.HTTP_201_CREATED, method="post", json=data)
+        self.assertEqual(len(resp.get_json()["items"]), 2)
+        # the Order and its Items are written without looking up the Order the Items name
+        inserts = [index for index, statement in enumerate(statements) if statement.startswith("INSERT INTO item")]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(any(statement.startswith("SELECT") for statement in statements[:inserts[0]]))
+        resp = self.client.get(f"{BASE_URL}/{other.id}")
+        self.assertEqual(resp.headers["ETag"], '"1"')
+        self.assertEqual(resp.get_json()["items"], [])
+
+    def test_create_order_batch_statements(self):
+        """It should Create a batch with the same number of statements whatever its size"""
+        counts = []
+        for size in (2, 20):
+            orders = []
+            for order in OrderFactory.build_batch(size):
+                data = order.serialize()
+                # clients send the Items of a new Order with a placeholder order_id
+                data["items"] = [dict(item.serialize(), order_id=0) for item in ItemFactory.build_batch(2)]
+                orders.append(data)
+            _, statements = self._capture_queries(
+                f"{BASE_URL}/batch", expected=status.HTTP_201_CREATED, method="post", json=orders
+            )
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_create_order_batch_with_errors(self):
+        """It should Create the valid Orders of a batch and report the others"""
+        orders = [OrderFactory().serialize(), {"name": "missing address"}, OrderFactory().serialize()]
+        orders[2]["status"] = "Lost"
+        orders.append(OrderFactory().serialize())
+        resp = self.client.post(f"{BASE_URL}/batch", json=orders)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertIsNotNone(data["ids"][0])
+        self.assertIsNone(data["ids"][1])
+        self.assertIsNone(data["ids"][2])
+        self.assertIsNotNone(data["ids"][3])
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 2])
+        self.assertEqual(len(Order.all()), 2)
+
+    def test_create_order_batch_with_bad_values(self):
+        """It should report Orders and Items whose values do not fit their columns"""
+        good = OrderFactory().serialize()
+        bad = [
+            dict(good, state="NYC"),
+            dict(good, name="x" * 65),
+            dict(good, city=12),
+            dict(good, shipping_price="free"),
+            dict(good, items=[{"order_id": 0, "item_price": "cheap", "sku": 1}]),
+            dict(good, items=[{"order_id": 0, "item_price": 1.0, "sku": 2**31}]),
+            dict(good, items=5),
+            "not an order",
+        ]
+        resp = self.client.post(f"{BASE_URL}/batch", json=[good] + bad)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertIsNotNone(data["ids"][0])
+        self.assertEqual(data["ids"][1:], [None] * len(bad))
+        self.assertEqual([error["index"] for error in data["errors"]], list(range(1, len(bad) + 1)))
+        self.assertIn("state", data["errors"][0]["message"])
+        self.assertEqual(len(Order.all()), 1)
+
+    def test_create_order_batch_all_invalid(self):
+        """It should not Create a batch where every Order is invalid"""
+        resp = self.client.post(f"{BASE_URL}/batch", json=[{}, []])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["ids"], [None, None])
+        self.assertEqual(len(Order.all()), 0)
+
+    def test_create_order_batch_bad_body(self):
+        """It should not Create a batch that is not an array or too large"""
+        resp = self.client.post(f"{BASE_URL}/batch", json=OrderFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/batch", json=[{}] * (app.config["MAX_BATCH_SIZE"] + 1))
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        resp = self.client.post(f"{BASE_URL}/batch", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
     ######################################################################
     #  TESTS FOR READ ORDER
     ######################################################################
@@ -122,6 +237,168 @@ class TestOrderService(TestCase):
         resp = self.client.get(f"{BASE_URL}/0")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_order_from_cache(self):
+        """It should Read an Order again without going to the database"""
+        order = self._create_orders_with_items(1, 2)[0]
+        hits = order_cache.stats()["hits"]
+        resp, count = self._count_queries(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(count, 1)
+        resp, count = self._count_queries(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(count, 0)
+        self.assertEqual(resp.get_json(), order)
+        resp, count = self._count_queries(f"{BASE_URL}/{order['id']}/items")
+        self.assertEqual(count, 0)
+        self.assertEqual(resp.get_json(), order["items"])
+
+        resp = self.client.get("/instrumentation")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["order_cache"]["hits"], hits + 2)
+        self.assertGreater(resp.get_json()["db_pool"]["checkouts"], 0)
+
+    def test_metrics(self):
+        """It should return the request metrics in the Prometheus text format"""
+        self.client.get("/health")
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        body = resp.get_data(as_text=True)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn('http_requests_total{method="GET",route="/health",status="200"}', body)
+        self.assertEqual(metric_sample("http_requests_in_flight"), 0)
+
+    def test_metrics_by_route(self):
+        """It should count and time requests by route template and status"""
+        order = self._create_orders_with_items(1, 1)[0]
+        labels = {"method": "GET", "route": "/orders/<int:order_id>"}
+        found = metric_sample("http_requests_total", status="200", **labels)
+        observed = metric_sample("http_request_duration_seconds_count", **labels)
+        db_time = metric_sample("http_request_db_seconds_sum", **labels)
+        unmatched = metric_sample("http_requests_total", method="GET", route="<unmatched>", status="404")
+        misses = metric_sample("order_cache_events_total", event="misses")
+        hits = metric_sample("order_cache_events_total", event="hits")
+
+        self.client.get(f"{BASE_URL}/{order['id']}")
+        self.client.get(f"{BASE_URL}/{order['id']}")
+        self.client.get("/no/such/url")
+
+        self.assertEqual(metric_sample("http_requests_total", status="200", **labels), found + 2)
+        self.assertEqual(metric_sample("http_request_duration_seconds_count", **labels), observed + 2)
+        self.assertGreater(metric_sample("http_request_db_seconds_sum", **labels), db_time)
+        self.assertEqual(
+            metric_sample("http_requests_total", method="GET", route="<unmatched>", status="404"), unmatched + 1
+        )
+        self.assertEqual(metric_sample("order_cache_events_total", event="misses"), misses + 1)
+        self.assertEqual(metric_sample("order_cache_events_total", event="hits"), hits + 1)
+
+    def test_sql_timing_headers(self):
+        """It should report the SQL statements a request ran in its headers"""
+        order = self._create_orders_with_items(1, 3)[0]
+        resp = self.client.get(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(resp.headers["X-DB-Queries"], "1")
+        self.assertRegex(resp.headers["Server-Timing"], r'^db;dur=[0-9.]+;desc="1 queries"$')
+        resp = self.client.get(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(resp.headers["X-DB-Queries"], "0")
+
+    def test_slow_query_log(self):
+        """It should log the statements slower than the threshold with their route"""
+        order = self._create_orders_with_items(1, 1)[0]
+        threshold = app.config["SLOW_QUERY_MS"]
+        app.config["SLOW_QUERY_MS"] = 0
+        try:
+            with self.assertLogs(app.logger, "WARNING") as logs:
+                self.client.get(f"{BASE_URL}/{order['id']}")
+        finally:
+            app.config["SLOW_QUERY_MS"] = threshold
+        self.assertEqual(len(logs.records), 1)
+        entry = json.loads(logs.records[0].args[0])
+        self.assertEqual(entry["route"], "/orders/<int:order_id>")
+        self.assertEqual(entry["method"], "GET")
+        self.assertEqual(entry["parameters"], 1)
+        self.assertIn("SELECT", entry["statement"])
+
+    def test_cache_invalidated_by_writes(self):
+        """It should not Read a stale Order from the cache after a write"""
+        order = self._create_orders_with_items(1, 1, status="Open")[0]
+        url = f"{BASE_URL}/{order['id']}"
+        item_id = order["items"][0]["id"]
+        self.client.get(url)
+
+        changed = dict(order, name="Changed")
+        del changed["items"]
+        self.client.put(url, json=changed)
+        self.assertEqual(self.client.get(url).get_json()["name"], "Changed")
+
+        self.client.post(f"{url}/items", json=ItemFactory().serialize())
+        self.assertEqual(len(self.client.get(url).get_json()["items"]), 2)
+
+        item = dict(order["items"][0], sku=987654)
+        self.client.put(f"{url}/items/{item_id}", json=item)
+        self.assertIn(987654, [item["sku"] for item in self.client.get(url).get_json()["items"]])
+
+        self.client.delete(f"{url}/items/{item_id}")
+        self.assertEqual(len(self.client.get(url).get_json()["items"]), 1)
+
+        self.client.put(f"{url}/items", json=[ItemFactory().serialize()] * 3)
+        self.assertEqual(len(self.client.get(url).get_json()["items"]), 3)
+
+        self.client.put(f"{url}/cancel")
+        self.assertEqual(self.client.get(url).get_json()["status"], "Cancelled")
+
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_order_not_modified(self):
+        """It should answer 304 Not Modified when the ETag still matches"""
+        order = self._create_orders_with_items(1, 2)[0]
+        url = f"{BASE_URL}/{order['id']}"
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+
+        # the version lookup skips loading the order and its items
+        db.session.remove()
+        order_cache.clear()
+        resp, count = self._count_queries(url, headers={"If-None-Match": etag}, expected=304)
+        self.assertEqual(count, 1)
+        self.assertEqual(resp.get_data(), b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        # served from the cache there is no query at all
+        self.client.get(url)
+        resp, count = self._count_queries(url, headers={"If-None-Match": etag}, expected=304)
+        self.assertEqual(count, 0)
+
+        resp = self.client.get(url, headers={"If-None-Match": '"0"'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_order_modified(self):
+        """It should send the Order again when it or its Items changed"""
+        order = self._create_orders_with_items(1, 1)[0]
+        url = f"{BASE_URL}/{order['id']}"
+        order_etag = self.client.get(url).headers["ETag"]
+        items_etag = self.client.get(f"{url}/items").headers["ETag"]
+        resp = self.client.get(f"{url}/items", headers={"If-None-Match": items_etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(f"{url}/items", json=ItemFactory().serialize())
+        resp = self.client.get(url, headers={"If-None-Match": order_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], order_etag)
+        resp = self.client.get(f"{url}/items", headers={"If-None-Match": items_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+
+        changed = dict(order, name="Changed")
+        del changed["items"]
+        resp = self.client.put(url, json=changed)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).headers["ETag"], resp.headers["ETag"])
+
+    def test_get_order_not_modified_not_found(self):
+        """It should not answer 304 for an Order that is not found"""
+        resp = self.client.get(f"{BASE_URL}/0", headers={"If-None-Match": '"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     ######################################################################
     #  TESTS FOR UPDATE ORDER
     ######################################################################
@@ -153,6 +430,37 @@ class TestOrderService(TestCase):
         resp = self.client.put(f"{BASE_URL}/{new_order_id}", json=new_order)
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_update_order_if_match(self):
+        """It should only Update an Order whose ETag matches If-Match"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}"
+        resp = self.client.get(url)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        del data["items"]
+
+        data["name"] = "First Writer"
+        resp = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        data["name"] = "Second Writer"
+        resp = self.client.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.client.get(url).get_json()["name"], "First Writer")
+
+        resp = self.client.put(url, json=data, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_update_order_lost_race(self):
+        """It should return 409 Conflict when a concurrent write wins"""
+        order = self._create_orders(1)[0]
+        data = self.client.get(f"{BASE_URL}/{order.id}").get_json()
+        del data["items"]
+        with patch.object(Order, "update", side_effect=StaleDataError("lost")):
+            resp = self.client.put(f"{BASE_URL}/{order.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
     ######################################################################
     #  TESTS FOR DELETE ORDER
     ######################################################################
@@ -238,6 +546,239 @@ class TestOrderService(TestCase):
         self.assertEqual(data[0]["name"], test_order_4.name)
         self.assertEqual(data[0]["status"], test_order_4.status)
 
+    def test_get_order_list_paged(self):
+        """It should Get a list of Orders one page at a time"""
+        orders = self._create_orders(5)
+        resp = self.client.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([order["id"] for order in data], [order.id for order in orders[:2]])
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        # follow the next links to the end
+        found = [order["id"] for order in data]
+        while "Link" in resp.headers:
+            next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+            resp = self.client.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertLessEqual(len(data), 2)
+            found += [order["id"] for order in data]
+        self.assertEqual(found, [order.id for order in orders])
+
+    def test_get_order_list_paged_by_status(self):
+        """It should keep the filters when paging through Orders"""
+        self._create_orders(8)
+        resp = self.client.get(BASE_URL, query_string="status=Open&limit=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 1)
+        next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+        self.assertIn("status=Open", next_url)
+        resp = self.client.get(next_url)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["status"], "Open")
+        self.assertNotIn("Link", resp.headers)
+
+    def test_get_order_list_bad_page_args(self):
+        """It should not List Orders with a bad limit or cursor"""
+        resp = self.client.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="limit=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="limit=100000")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_order_list_sorted_by_total(self):
+        """It should List Orders filtered and sorted by the total of their Items"""
+        for price in (30.0, 10.0, 50.0, 20.0, 40.0):
+            order = OrderFactory().serialize()
+            order["items"] = [ItemFactory(item_price=price).serialize(), ItemFactory(item_price=1.25).serialize()]
+            self.assertEqual(self.client.post(BASE_URL, json=order).status_code, status.HTTP_201_CREATED)
+        totals = [11.25, 21.25, 31.25, 41.25, 51.25]
+        resp = self.client.get(BASE_URL, query_string="sort=-items_total")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["items_total"] for order in resp.get_json()], totals[::-1])
+
+        # page through the middle three in order of their total
+        query = f"sort=items_total&min_total={totals[1]}&max_total={totals[3]}&limit=2"
+        resp = self.client.get(BASE_URL, query_string=query)
+        found = [order["items_total"] for order in resp.get_json()]
+        next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+        self.assertIn("sort=items_total", next_url)
+        resp = self.client.get(next_url)
+        found += [order["items_total"] for order in resp.get_json()]
+        self.assertNotIn("Link", resp.headers)
+        self.assertEqual(found, totals[1:4])
+
+        resp = self.client.get(BASE_URL, query_string="sort=-item_count&stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_order_list_bad_sort_args(self):
+        """It should not List Orders with a bad sort or total"""
+        resp = self.client.get(BASE_URL, query_string="sort=name")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="min_total=cheap")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string="sort=items_total&limit=1&cursor=" + encode_cursor(1))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_orders(self):
+        """It should Search Orders by name and address a page at a time"""
+        for name in ("Jane Smith", "John Smithers", "Ann Lee"):
+            self._create_orders_with_items(1, 1, name=name, status="Open")
+        resp = self.client.get(BASE_URL, query_string="q=smith&limit=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        found = [order["name"] for order in resp.get_json()]
+        next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+        self.assertIn("q=smith", next_url)
+        resp = self.client.get(next_url)
+        found += [order["name"] for order in resp.get_json()]
+        self.assertNotIn("Link", resp.headers)
+        self.assertEqual(sorted(found), ["Jane Smith", "John Smithers"])
+
+        resp = self.client.get(BASE_URL, query_string="q=smith&sort=-id&fields=id,name")
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        self.assertGreater(data[0]["id"], data[1]["id"])
+        resp = self.client.get(BASE_URL, query_string="q=smith&status=Cancelled")
+        self.assertEqual(resp.get_json(), [])
+
+        resp = self.client.get(BASE_URL, query_string="q=ab")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_order_list_by_date(self):
+        """It should List the Orders created in a range of dates"""
+        for day in (1, 10, 20):
+            OrderFactory(date_created=date(2023, 4, day), status="Open").create()
+        resp = self.client.get(BASE_URL, query_string="created_after=2023-04-05&created_before=2023-04-15")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["date_created"] for order in resp.get_json()], ["2023-04-10"])
+        resp = self.client.get(BASE_URL, query_string="created_after=2023-04-10&status=Open&limit=1")
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertIn("created_after=2023-04-10", resp.headers["Link"])
+        resp = self.client.get(BASE_URL, query_string="created_before=April")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_orders_query_count(self):
+        """It should List Orders with the same number of queries for any count"""
+        self._create_orders_with_items(2, 3)
+        resp, small_count = self._count_queries(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 2)
+
+        self._create_orders_with_items(8, 3)
+        resp, large_count = self._count_queries(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 10)
+        self.assertTrue(all(len(order["items"]) == 3 for order in resp.get_json()))
+        self.assertEqual(small_count, large_count)
+
+        # paging should not change the number of queries either
+        _, page_count = self._count_queries(BASE_URL + "?limit=5")
+        self.assertEqual(page_count, large_count)
+
+    def test_get_order_query_count(self):
+        """It should Read an Order and its Items with one query"""
+        order = self._create_orders_with_items(1, 5)[0]
+        db.session.remove()
+        resp, count = self._count_queries(f"{BASE_URL}/{order['id']}")
+        self.assertEqual(len(resp.get_json()["items"]), 5)
+        self.assertEqual(count, 1)
+
+    def test_stream_order_list(self):
+        """It should Stream a list of Orders as NDJSON"""
+        orders = self._create_orders_with_items(5, 2)
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, orders)
+
+    def test_stream_order_list_by_status(self):
+        """It should Stream a filtered list of Orders with ?stream=1"""
+        self._create_orders(8)
+        app.config["STREAM_BATCH_SIZE"] = 1
+        try:
+            resp = self.client.get(BASE_URL, query_string="status=Shipped&stream=1")
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = 500
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(order["status"] == "Shipped" for order in lines))
+
+    def test_list_orders_with_fields(self):
+        """It should List only the fields asked for and read only their columns"""
+        orders = self._create_orders_with_items(3, 2)
+        resp, statements = self._capture_queries(f"{BASE_URL}?fields=status,id,name")
+        self.assertEqual(
+            resp.get_json(),
+            [{"id": order["id"], "name": order["name"], "status": order["status"]} for order in orders],
+        )
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("street", statements[0])
+        self.assertNotIn("item", statements[0])
+
+        resp, statements = self._capture_queries(f"{BASE_URL}?fields=id&include=items&limit=2")
+        self.assertEqual(resp.get_json(), [{"id": order["id"], "items": order["items"]} for order in orders[:2]])
+        self.assertEqual(len(statements), 2)
+
+    def test_stream_orders_with_fields(self):
+        """It should Stream only the fields asked for"""
+        orders = self._create_orders_with_items(2, 1)
+        resp = self.client.get(BASE_URL, query_string="stream=1&fields=id,date_created")
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [{"id": order["id"], "date_created": order["date_created"]} for order in orders])
+
+    def test_get_order_with_fields(self):
+        """It should Read only the fields asked for, from the cache if it can"""
+        order = self._create_orders_with_items(1, 2)[0]
+        url = f"{BASE_URL}/{order['id']}?fields=name,status"
+        resp, statements = self._capture_queries(url)
+        self.assertEqual(resp.get_json(), {"name": order["name"], "status": order["status"]})
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("item", statements[0])
+        self.assertTrue(resp.headers["ETag"])
+
+        self.client.get(f"{BASE_URL}/{order['id']}")
+        resp, count = self._count_queries(url + "&include=items")
+        self.assertEqual(count, 0)
+        self.assertEqual(resp.get_json(), {"name": order["name"], "status": order["status"], "items": order["items"]})
+
+    def test_bad_fields(self):
+        """It should not accept unknown or empty fields"""
+        resp = self.client.get(f"{BASE_URL}?fields=id,password")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("password", resp.get_json()["message"])
+        resp = self.client.get(f"{BASE_URL}/1?fields=")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_stats(self):
+        """It should return Order statistics computed in the database"""
+        # POST /orders does not take date_created, save the Orders directly
+        for _ in range(3):
+            items = ItemFactory.build_batch(2)
+            OrderFactory(status="Open", state="NY", date_created=date(2023, 1, 10), items=items).create()
+        OrderFactory(status="Cancelled", state="CA", date_created=date(2023, 3, 10), items=[ItemFactory()]).create()
+        resp, statements = self._capture_queries(f"{BASE_URL}/stats")
+        stats = resp.get_json()
+        self.assertEqual(len(statements), 1)
+        self.assertIn("GROUP BY", statements[0])
+        self.assertNotIn("item", statements[0].replace("item_count", "").replace("items_total", ""))
+        self.assertEqual(stats["count"], 4)
+        self.assertEqual(stats["item_count"], 7)
+        self.assertEqual(stats["by_status"]["Open"]["count"], 3)
+        self.assertEqual(stats["by_state"]["CA"]["item_count"], 1)
+
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="created_after=2023-02-01")
+        self.assertEqual(resp.get_json()["count"], 1)
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="created_before=2023-02-01")
+        self.assertEqual(resp.get_json()["count"], 3)
+        resp = self.client.get(f"{BASE_URL}/stats", query_string="created_after=yesterday")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_list_nonexistent_order(self):
         """It should not List an Order where ID is not found"""
         test_order = OrderFactory()
@@ -283,6 +824,153 @@ class TestOrderService(TestCase):
         response = self.client.put(f"{BASE_URL}/{order.id}/cancel")
         self.assertEqual(response.status_code, 409)
 
+    def test_cancel_order_returns_its_own_result(self):
+        """It should return the Order from the UPDATE instead of reading it again"""
+        order = OrderFactory(status="Open")
+        order.create()
+        resp, statements = self._capture_queries(f"{BASE_URL}/{order.id}/cancel", method="put")
+        self.assertEqual(resp.get_json()["status"], "Cancelled")
+        self.assertEqual(resp.headers["ETag"], '"2"')
+        self.assertTrue(statements[0].startswith("UPDATE") and "RETURNING" in statements[0])
+        # only the Items are read after the UPDATE, in the same transaction
+        self.assertFalse(any('FROM "order"' in statement for statement in statements[1:]))
+
+    def test_ship_and_fulfill_an_order(self):
+        """It should Ship an Open order and then Fulfill it"""
+        order = self._create_orders_with_items(1, 2, status="Open")[0]
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/fulfill")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/ship")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["status"], "Shipped")
+        self.assertEqual(len(data["items"]), 2)
+        self.assertEqual(resp.headers["ETag"], self.client.get(f"{BASE_URL}/{order['id']}").headers["ETag"])
+
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("Shipped", resp.get_json()["message"])
+
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/fulfill")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "Fulfilled")
+
+    def test_transition_nonexistent_order(self):
+        """It should not change the status of an Order that is not found"""
+        for action in ("cancel", "ship", "fulfill"):
+            resp = self.client.put(f"{BASE_URL}/0/{action}")
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cancel_order_is_one_statement(self):
+        """It should Cancel an Order with a single UPDATE"""
+        order = self._create_orders(1)[0]
+        statements = []
+
+        def record(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.put(f"{BASE_URL}/{order.id}/cancel")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        writes = [statement for statement in statements if not statement.startswith("SELECT")]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith("UPDATE"))
+
+    def test_transition_many_orders(self):
+        """It should Ship many Orders with one UPDATE and report the ones it could not"""
+        open_orders = []
+        for _ in range(3):
+            order = OrderFactory(status="Open")
+            order.create()
+            open_orders.append(order)
+        cancelled = OrderFactory(status="Cancelled")
+        cancelled.create()
+        self.client.get(f"{BASE_URL}/{open_orders[0].id}")  # cache it
+
+        ids = [order.id for order in open_orders] + [cancelled.id, 0, open_orders[0].id]
+        statements = []
+
+        def record(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.post(f"{BASE_URL}/status", json={"status": "Shipped", "ids": ids})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["transitioned"], sorted(order.id for order in open_orders))
+        self.assertEqual(
+            data["rejected"],
+            [
+                {"id": cancelled.id, "message": "Order is Cancelled and cannot be Shipped"},
+                {"id": 0, "message": "Order was not found"},
+            ],
+        )
+        writes = [statement for statement in statements if not statement.startswith("SELECT")]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith("UPDATE"))
+
+        resp = self.client.get(f"{BASE_URL}/{open_orders[0].id}")
+        self.assertEqual(resp.get_json()["status"], "Shipped")
+        self.assertEqual(resp.headers["ETag"], '"2"')
+
+    def test_transition_orders_by_filter(self):
+        """It should Cancel the Open Orders that match a filter"""
+        for day, order_status in ((1, "Open"), (2, "Open"), (3, "Shipped"), (20, "Open")):
+            OrderFactory(name="Truck", status=order_status, date_created=date(2023, 4, day)).create()
+        OrderFactory(name="Other", status="Open", date_created=date(2023, 4, 1)).create()
+        body = {"status": "Cancelled", "filter": {"name": "Truck", "created_before": "2023-04-10"}}
+        resp = self.client.post(f"{BASE_URL}/status", json=body)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["transitioned"]), 2)
+        self.assertEqual(resp.get_json()["rejected"], [])
+        self.assertFalse(resp.get_json()["more"])
+        self.assertEqual(Order.find_by_status("Cancelled").count(), 2)
+
+    def test_transition_orders_by_filter_in_batches(self):
+        """It should move at most MAX_STATUS_BATCH_SIZE Orders that match a filter per request"""
+        orders = [OrderFactory(name="Truck", status="Open") for _ in range(3)]
+        for order in orders:
+            order.create()
+        body = {"status": "Shipped", "filter": {"name": "Truck"}}
+        with patch.dict(app.config, {"MAX_STATUS_BATCH_SIZE": 2}):
+            resp = self.client.post(f"{BASE_URL}/status", json=body)
+            self.assertEqual(resp.get_json()["transitioned"], sorted(order.id for order in orders)[:2])
+            self.assertTrue(resp.get_json()["more"])
+            resp = self.client.post(f"{BASE_URL}/status", json=body)
+            self.assertEqual(len(resp.get_json()["transitioned"]), 1)
+            self.assertFalse(resp.get_json()["more"])
+        self.assertEqual(Order.find_by_status("Shipped").count(), 3)
+
+    def test_transition_orders_bad_request(self):
+        """It should not move Orders with a bad status, ids or filter"""
+        url = f"{BASE_URL}/status"
+        for body in (
+            [1, 2],
+            {"status": "Lost", "ids": [1]},
+            {"status": ["Shipped"], "ids": [1]},
+            {"status": "Shipped"},
+            {"status": "Shipped", "ids": [1], "filter": {"name": "Truck"}},
+            {"status": "Shipped", "ids": []},
+            {"status": "Shipped", "ids": ["1", True]},
+            {"status": "Shipped", "filter": {}},
+            {"status": "Shipped", "filter": {"state": "NY"}},
+            {"status": "Shipped", "filter": {"created_after": "April"}},
+        ):
+            resp = self.client.post(url, json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+        with patch.dict(app.config, {"MAX_STATUS_BATCH_SIZE": 2}):
+            resp = self.client.post(url, json={"status": "Shipped", "ids": [1, 2, 3]})
+            self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        resp = self.client.post(url, data="ids", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
     ######################################################################
     #  TESTS FOR CREATE ITEM
     ######################################################################
@@ -303,6 +991,91 @@ class TestOrderService(TestCase):
         self.assertEqual(data["item_price"], item.item_price)
         self.assertEqual(data["sku"], item.sku)
 
+    def test_add_item_with_string_numbers(self):
+        """It should Add an item whose price is a string and reject one that is not a number"""
+        order = self._create_orders(1)[0]
+        url = f"{BASE_URL}/{order.id}/items"
+        resp = self.client.post(url, json={"order_id": order.id, "item_price": "12", "sku": 7})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["item_price"], 12.0)
+        resp = self.client.post(url, json={"order_id": order.id, "item_price": "abc", "sku": 7})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        # the session is still usable after the bad request
+        resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.get_json()["items_total"], 12.0)
+
+    def test_add_many_items(self):
+        """It should Add an array of items to an order"""
+        order = self._create_orders_with_items(1, 1)[0]
+        items = [item.serialize() for item in ItemFactory.create_batch(3)]
+        resp = self.client.post(f"{BASE_URL}/{order['id']}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        self.assertTrue(all(item["order_id"] == order["id"] for item in data))
+        self.assertEqual([item["sku"] for item in data], [item["sku"] for item in items])
+
+        resp = self.client.get(f"{BASE_URL}/{order['id']}/items")
+        self.assertEqual(len(resp.get_json()), 4)
+
+    def test_list_items_paged(self):
+        """It should List the items of an order one page at a time"""
+        order = self._create_orders_with_items(1, 5)[0]
+        url = f"{BASE_URL}/{order['id']}/items"
+        resp = self.client.get(url, query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        seen = [item["id"] for item in resp.get_json()]
+        while "Link" in resp.headers:
+            next_url = resp.headers["Link"].split(";")[0].strip("<>")
+            resp = self.client.get(next_url)
+            seen.extend(item["id"] for item in resp.get_json())
+        self.assertEqual(seen, sorted(item["id"] for item in order["items"]))
+        resp = self.client.get(f"{BASE_URL}/0/items", query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(url, query_string={"limit": 0})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_add_many_items_with_bad_item(self):
+        """It should not Add any items when one of them is invalid"""
+        order = self._create_orders(1)[0]
+        items = [ItemFactory().serialize(), {"sku": 1}]
+        resp = self.client.post(f"{BASE_URL}/{order.id}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_replace_items(self):
+        """It should Replace all of the items of an order"""
+        order = self._create_orders_with_items(1, 3)[0]
+        items = [item.serialize() for item in ItemFactory.create_batch(2)]
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+
+        resp = self.client.get(f"{BASE_URL}/{order['id']}/items")
+        self.assertEqual(resp.get_json(), data)
+
+        # an empty array removes every item
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/items", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{order['id']}/items")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_replace_items_bad_request(self):
+        """It should not Replace the items of an order with bad data"""
+        order = self._create_orders_with_items(1, 2)[0]
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/items", json=ItemFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(f"{BASE_URL}/{order['id']}/items", json=[{"sku": 1}])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/{order['id']}/items")
+        self.assertEqual(len(resp.get_json()), 2)
+        resp = self.client.put(f"{BASE_URL}/0/items", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     ######################################################################
     #  TESTS FOR READ ITEM
     ######################################################################
@@ -516,3 +1289,35 @@ class TestOrderService(TestCase):
             order.id = new_order["id"]
             orders.append(order)
         return orders
+
+    def _create_orders_with_items(self, count, item_count, **kwargs):
+        """Creates orders that each have item_count items"""
+        orders = []
+        for _ in range(count):
+            order = OrderFactory(**kwargs).serialize()
+            order["items"] = [item.serialize() for item in ItemFactory.create_batch(item_count)]
+            resp = self.client.post(BASE_URL, json=order)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            orders.append(resp.get_json())
+        return orders
+
+    def _count_queries(self, url, headers=None, expected=status.HTTP_200_OK):
+        """Calls GET on url and returns the response and number of SQL statements"""
+        resp, statements = self._capture_queries(url, headers, expected)
+        return resp, len(statements)
+
+    def _capture_queries(self, url, headers=None, expected=status.HTTP_200_OK, method="get", json=None):
+        """Calls GET (or method) on url and returns the response and the SQL statements it ran"""
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        db.session.remove()
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            resp = getattr(self.client, method)(url, headers=headers, json=json)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(resp.status_code, expected)
+        return resp, statements